@@ -0,0 +1,571 @@
+"""
+Benchmarks the update_financials hot path on a synthetic companyfacts.zip, without the real
+archive or a database.
+
+    python benchmark.py                    # run and compare against the stored baseline
+    python benchmark.py --save-baseline    # run and store the results as the new baseline
+
+Throughput depends on the machine, so the baseline is not committed: record one with
+--save-baseline on the machine the benchmark will run on, before the change being measured.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, timedelta
+import config
+import concepts
+import derived
+import snapshot
+import update_financials
+from companyfacts import CompanyFactsArchive, extractFacts, memberName
+from factstore import FactStore
+from resolution import ResolutionTable
+
+FLOW_CONCEPTS = {
+    concepts.Concept.Revenue,
+    concepts.Concept.NetIncome,
+    concepts.Concept.CashFlowFromOperatingActivities,
+    concepts.Concept.CashFlowFromInvestingActivities,
+    concepts.Concept.CashFlowFromFinancingActivities,
+    concepts.Concept.CapitalExpenditures,
+    concepts.Concept.Dividends,
+}
+SHARE_TAGS = [a.name for a in concepts.aliases if a.concept == concepts.Concept.SharesOutstanding]
+DEI_TAGS = {"EntityCommonStockSharesOutstanding"}
+QUARTER_MONTHS = [3, 6, 9, 12]
+QUARTER_DAYS = [91, 182, 273, 365]
+
+
+class GeneratorOptions:
+    """
+    Shape of the synthetic companyfacts documents.
+
+    Parameters:
+        years: int - fiscal years of history per company.
+
+        tags: int - number of tags per company that the ETL reads (Assets is always one of them).
+
+        extraTags: int - number of tags per company that the ETL skips.
+
+        shareTags: int - number of share count tags per company.
+
+        duplicateRate: float - chance that a filing repeats a fact from the previous year's
+        filing as a comparative, under its own fiscal year.
+
+        amendedRate: float - chance that a filing is followed by a 10-K/A or 10-Q/A restating
+        its values.
+
+        largeFilerRate: float - share of companies that are very large filers.
+
+        largeFilerScale: int - how many times more history and tags a large filer has.
+
+        lastYear: int - last fiscal year of history, fixed so a seed always gives the same data.
+    """
+
+    def __init__(
+        self,
+        years: int = 15,
+        tags: int = 25,
+        extraTags: int = 150,
+        shareTags: int = 2,
+        duplicateRate: float = 0.8,
+        amendedRate: float = 0.05,
+        largeFilerRate: float = 0.02,
+        largeFilerScale: int = 3,
+        lastYear: int = 2024,
+    ):
+        self.years: int = years
+        self.tags: int = tags
+        self.extraTags: int = extraTags
+        self.shareTags: int = shareTags
+        self.duplicateRate: float = duplicateRate
+        self.amendedRate: float = amendedRate
+        self.largeFilerRate: float = largeFilerRate
+        self.largeFilerScale: int = largeFilerScale
+        self.lastYear: int = lastYear
+
+    def toDict(self) -> dict:
+        return dict(self.__dict__)
+
+
+def generateCompanyFacts(cik: str, rnd: random.Random, options: GeneratorOptions) -> dict:
+    """
+    Returns:
+        dict - a companyfacts document shaped like the SEC's: quarterly 10-Q and annual 10-K
+        filings, year-to-date flow values, prior-year comparatives, amendments and a cover page
+        share count, for tags picked at random from the concept aliases.
+    """
+    large = rnd.random() < options.largeFilerRate
+    scale = options.largeFilerScale if large else 1
+    years = options.years * scale
+    lastYear = options.lastYear
+    fiscalYearEndMonth = rnd.choice([3, 6, 9, 12, 12, 12])
+    quarterEnds = []  # (fiscal year, quarter index, end)
+    for fy in range(lastYear - years + 1, lastYear + 1):
+        for q in range(4):
+            month = (fiscalYearEndMonth + QUARTER_MONTHS[q]) % 12 or 12
+            year = fy - 1 if month > fiscalYearEndMonth else fy
+            quarterEnds.append((fy, q, lastDayOfMonth(year, month)))
+
+    def filing(fy: int, q: int) -> dict:
+        form = "10-K" if q == 3 else "10-Q"
+        filed = quarterEnds[(fy - quarterEnds[0][0]) * 4 + q][2] + timedelta(days=40)
+        return {
+            "accn": f"{cik}-{fy % 100:02d}-{rnd.randint(0, 999999):06d}",
+            "fy": fy,
+            "fp": "FY" if q == 3 else f"Q{q + 1}",
+            "form": form,
+            "filed": filed.isoformat(),
+        }
+
+    def entries(kind: str, magnitude: int) -> list[dict]:
+        out = []
+        previous = {}
+        for fy, q, end in quarterEnds:
+            f = filing(fy, q)
+            values = {}
+            if kind == "flow":
+                # Quarterly and year-to-date values; 10-Ks report the year
+                lengths = [3] if q == 3 else ([0] if q == 0 else [0, q])
+                for length in lengths:
+                    values[(QUARTER_DAYS[length], end)] = rnd.randint(-magnitude, magnitude * 4)
+            else:
+                values[(None, end)] = rnd.randint(0, magnitude * 10)
+            for (days, e), val in values.items():
+                out.append(fact(f, e, val, days))
+            if previous and rnd.random() < options.duplicateRate:
+                for (days, e), val in previous.items():
+                    out.append(fact(f, e, val, days))
+            if rnd.random() < options.amendedRate:
+                amended = dict(f, form=f["form"] + "/A", accn=f["accn"] + "A")
+                for (days, e), val in values.items():
+                    out.append(fact(amended, e, val + rnd.randint(-1000, 1000), days))
+            if q == 3 or kind != "flow":
+                previous = values
+        return out
+
+    aliases = [a for a in concepts.aliases if a.concept != concepts.Concept.SharesOutstanding]
+    count = min(len(aliases), options.tags * scale)
+    picked = {"Assets"} | {a.name for a in rnd.sample(aliases, count)}
+    usGaap = {}
+    dei = {}
+    for tag in sorted(picked):
+        concept = concepts.strToAlias[tag].concept
+        kind = "flow" if concept in FLOW_CONCEPTS else "instant"
+        usGaap[tag] = tagObject(tag, "USD", entries(kind, 10 ** rnd.randint(6, 10)))
+    for tag in rnd.sample(SHARE_TAGS, min(len(SHARE_TAGS), options.shareTags)):
+        shares = []
+        for fy, q, end in quarterEnds:
+            f = filing(fy, q)
+            # Cover page counts are as of shortly before the filing date
+            asOf = end + timedelta(days=rnd.randint(20, 60))
+            shares.append(fact(f, asOf, rnd.randint(10**6, 10**10)))
+        (dei if tag in DEI_TAGS else usGaap)[tag] = tagObject(tag, "shares", shares)
+    for i in range(options.extraTags * scale):
+        f = filing(*quarterEnds[-1][:2])
+        ends = [end for _, _, end in quarterEnds[-rnd.randint(1, 12) :]]
+        extra = [fact(f, end, rnd.randint(0, 10**9), 91) for end in ends]
+        usGaap[f"Unused{i}Amount"] = tagObject(f"Unused{i}Amount", "USD", extra)
+    tags = list(usGaap.items())
+    rnd.shuffle(tags)
+    publicFloat = fact(filing(lastYear, 3), quarterEnds[-1][2], 10**9)
+    dei["EntityPublicFloat"] = tagObject("EntityPublicFloat", "USD", [publicFloat])
+    return {
+        "cik": int(cik),
+        "entityName": f"Synthetic Company {cik}",
+        "facts": {"dei": dei, "us-gaap": dict(tags)},
+    }
+
+
+def fact(filing: dict, end: date, val: int, days: int = None) -> dict:
+    entry = {}
+    if days is not None:
+        entry["start"] = (end - timedelta(days=days - 1)).isoformat()
+    entry["end"] = end.isoformat()
+    entry["val"] = val
+    entry.update(filing)
+    return entry
+
+
+def tagObject(tag: str, units: str, entries: list[dict]) -> dict:
+    return {
+        "label": tag,
+        "description": f"Synthetic {tag} values, with \"quotes\" and {{braces}}.",
+        "units": {units: entries},
+    }
+
+
+def lastDayOfMonth(year: int, month: int) -> date:
+    if month == 12:
+        return date(year, 12, 31)
+    return date(year, month + 1, 1) - timedelta(days=1)
+
+
+def buildArchive(path: str, companies: int, seed: int, options: GeneratorOptions) -> list[str]:
+    """
+    Writes a companyfacts.zip of generated companies.
+
+    Returns:
+        list[str] - the CIKs in the archive.
+    """
+    rnd = random.Random(seed)
+    ciks = [str(cik).zfill(10) for cik in sorted(rnd.sample(range(1000, 2_000_000), companies))]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for cik in ciks:
+            document = generateCompanyFacts(cik, rnd, options)
+            zf.writestr(memberName(cik), json.dumps(document, separators=(",", ":")))
+    return ciks
+
+
+class Company:
+    __slots__ = ("cik", "content", "data", "facts")
+
+    def __init__(self, cik: str, content: bytes):
+        self.cik: str = cik
+        self.content: bytes = content
+        self.data: dict = extractFacts(content, concepts.strToAlias)
+        self.facts: int = update_financials.countFacts(self.data)
+
+
+class RecordingTable(ResolutionTable):
+    """
+    ResolutionTable that keeps every offer, so the offers can be replayed on their own.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.offers: list[tuple] = []
+
+    def offer(self, fp, concept: str, value) -> None:
+        self.offers.append((fp, concept, value))
+        super().offer(fp, concept, value)
+
+
+def benchExtractFacts(companies: list[Company]):
+    def prepare():
+        return None
+
+    def work(_):
+        for c in companies:
+            extractFacts(c.content, concepts.strToAlias)
+
+    return prepare, work, sum(c.facts for c in companies)
+
+
+def benchProcessEntries(companies: list[Company]):
+    entryLists = [c.data["facts"]["us-gaap"]["Assets"]["units"]["USD"] for c in companies]
+
+    def prepare():
+        return None
+
+    def work(_):
+        for entries in entryLists:
+            update_financials.processEntries(entries)
+
+    return prepare, work, sum(len(entries) for entries in entryLists)
+
+
+def benchAddFinancialValues(companies: list[Company]):
+    def prepare():
+        return [(c, update_financials.createPeriodIndex(c.data, c.cik)) for c in companies]
+
+    def work(state):
+        for c, periods in state:
+            update_financials.addFinancialValues(c.data, periods)
+
+    return prepare, work, sum(c.facts for c in companies)
+
+
+def benchOffer(companies: list[Company]):
+    offers = []
+    for c in companies:
+        table = RecordingTable()
+        periods = update_financials.createPeriodIndex(c.data, c.cik)
+        update_financials.addFinancialValues(c.data, periods, table)
+        offers.append(table.offers)
+
+    def prepare():
+        for companyOffers in offers:
+            for fp, _, _ in companyOffers:
+                fp.conceptToFinancialValues = defaultdict(list)
+        return None
+
+    def work(_):
+        for companyOffers in offers:
+            table = ResolutionTable()
+            for fp, concept, value in companyOffers:
+                table.offer(fp, concept, value)
+
+    return prepare, work, sum(len(o) for o in offers)
+
+
+def benchAddMissingOneQuarterConcepts(companies: list[Company]):
+    def prepare():
+        state = []
+        for c in companies:
+            periods = update_financials.createPeriodIndex(c.data, c.cik)
+            table = update_financials.addFinancialValues(c.data, periods)
+            state.append((c, periods, table))
+        return state
+
+    def work(state):
+        for c, periods, table in state:
+            update_financials.addMissingOneQuarterConcepts(periods, c.cik, table)
+
+    return prepare, work, sum(c.facts for c in companies)
+
+
+def benchAddDerivedMetrics(companies: list[Company]):
+    def prepare():
+        state = []
+        for c in companies:
+            store = FactStore()
+            periods = update_financials.createFinancialPeriods(c.data, c.cik)
+            if periods:
+                store.addFinancialPeriods(c.cik, periods)
+            state.append(store)
+        return state
+
+    def work(state):
+        for store in state:
+            derived.addDerivedMetrics(store)
+
+    return prepare, work, sum(c.facts for c in companies)
+
+
+def benchCreateFinancialPeriods(companies: list[Company]):
+    def prepare():
+        return None
+
+    def work(_):
+        for c in companies:
+            update_financials.createFinancialPeriods(c.data, c.cik)
+
+    return prepare, work, sum(c.facts for c in companies)
+
+
+STAGES = {
+    "extractFacts": benchExtractFacts,
+    "processEntries": benchProcessEntries,
+    "addFinancialValues": benchAddFinancialValues,
+    "ResolutionTable.offer": benchOffer,
+    "addMissingOneQuarterConcepts": benchAddMissingOneQuarterConcepts,
+    "createFinancialPeriods": benchCreateFinancialPeriods,
+    "addDerivedMetrics": benchAddDerivedMetrics,
+}
+
+
+def timeStage(prepare, work, facts: int, repeat: int) -> dict:
+    """
+    Times work(prepare()) repeat times, keeping the fastest, then runs it once more under
+    tracemalloc for the peak memory it allocates. Only work is timed.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        state = prepare()
+        start = time.perf_counter()
+        work(state)
+        best = min(best, time.perf_counter() - start)
+    state = prepare()
+    tracemalloc.start()
+    work(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": round(best, 4),
+        "facts": facts,
+        "factsPerSec": round(facts / best) if best else 0,
+        "peakBytes": peak,
+    }
+
+
+def drain(stores, metrics=None, replaceCiks=None) -> bool:
+    for _ in stores:
+        pass
+    return True
+
+
+@contextmanager
+def nullSink(directory: str, zipPath: str, ciks: list[str]):
+    """
+    Points update_financials.run at the synthetic archive and discards what it would upload.
+    Local outputs (manifest, issues, snapshot) go to directory.
+    """
+    replaced = [
+        (config, "ZIP_PATH", zipPath),
+        (config, "MANIFEST_PATH_FINANCIALS", os.path.join(directory, "manifest.json")),
+        (config, "ISSUES_PATH_FINANCIALS", os.path.join(directory, "issues.csv")),
+        (config, "METRICS_PATH_FINANCIALS", os.path.join(directory, "metrics.json")),
+        (config, "PROMETHEUS_PATH_FINANCIALS", os.path.join(directory, "metrics.prom")),
+        (snapshot, "FINANCIALS_DIR", os.path.join(directory, "snapshot", "financials")),
+        (update_financials, "fetchCiks", lambda: ciks),
+        (update_financials, "prepareTables", lambda: True),
+        (update_financials, "loadFinancials", drain),
+        (update_financials, "loadAnnualFinancials", drain),
+        (update_financials.screen_cache, "refresh", lambda logger, warm=True: None),
+    ]
+    saved = [(obj, name, getattr(obj, name)) for obj, name, _ in replaced]
+    for obj, name, value in replaced:
+        setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        for obj, name, value in saved:
+            setattr(obj, name, value)
+
+
+def benchRun(zipPath: str, ciks: list[str], facts: int, workers: int, repeat: int) -> dict:
+    directory = tempfile.mkdtemp(prefix="benchmark_run_")
+    try:
+        with nullSink(directory, zipPath, ciks):
+            def work(_):
+                update_financials.run(workers=workers, full=True)
+
+            return timeStage(lambda: None, work, facts, repeat)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def compare(
+    results: dict, baseline: dict, speedThreshold: float, memoryThreshold: float
+) -> list[str]:
+    """
+    Returns:
+        list[str] - a message for each stage slower or hungrier than the baseline allows.
+    """
+    regressions = []
+    for stage, result in results.items():
+        base = baseline.get(stage)
+        if not base:
+            continue
+        if result["factsPerSec"] < base["factsPerSec"] * (1 - speedThreshold):
+            regressions.append(
+                f"{stage}: {result['factsPerSec']:,} facts/s is more than {speedThreshold:.0%} "
+                f"below the baseline {base['factsPerSec']:,}"
+            )
+        if result["peakBytes"] > base["peakBytes"] * (1 + memoryThreshold):
+            regressions.append(
+                f"{stage}: peak {result['peakBytes']:,} bytes is more than {memoryThreshold:.0%} "
+                f"above the baseline {base['peakBytes']:,}"
+            )
+    return regressions
+
+
+def printResults(results: dict, baseline: dict) -> None:
+    print(f"{'stage':<30} {'seconds':>9} {'facts/s':>12} {'vs base':>8} {'peak MiB':>9}")
+    for stage, r in results.items():
+        base = baseline.get(stage)
+        change = f"{r['factsPerSec'] / base['factsPerSec'] - 1:+.0%}" if base else ""
+        print(
+            f"{stage:<30} {r['seconds']:>9.3f} {r['factsPerSec']:>12,} {change:>8} "
+            f"{r['peakBytes'] / (1 << 20):>9.1f}"
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark update_financials on synthetic data")
+    parser.add_argument("--companies", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--years", type=int, default=15)
+    parser.add_argument("--tags", type=int, default=25)
+    parser.add_argument("--extra-tags", type=int, default=150)
+    parser.add_argument("--share-tags", type=int, default=2)
+    parser.add_argument("--duplicate-rate", type=float, default=0.8)
+    parser.add_argument("--amended-rate", type=float, default=0.05)
+    parser.add_argument("--large-filer-rate", type=float, default=0.02)
+    parser.add_argument("--large-filer-scale", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest counts")
+    parser.add_argument("--workers", type=int, default=1, help="processes for the run() stage")
+    parser.add_argument("--stages", nargs="*", choices=list(STAGES) + ["run"])
+    parser.add_argument("--baseline", default=config.BENCHMARK_BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument(
+        "--speed-threshold",
+        type=float,
+        default=config.BENCHMARK_SPEED_THRESHOLD,
+        help="allowed drop in facts/s relative to the baseline",
+    )
+    parser.add_argument(
+        "--memory-threshold",
+        type=float,
+        default=config.BENCHMARK_MEMORY_THRESHOLD,
+        help="allowed rise in peak memory relative to the baseline",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    options = GeneratorOptions(
+        years=args.years,
+        tags=args.tags,
+        extraTags=args.extra_tags,
+        shareTags=args.share_tags,
+        duplicateRate=args.duplicate_rate,
+        amendedRate=args.amended_rate,
+        largeFilerRate=args.large_filer_rate,
+        largeFilerScale=args.large_filer_scale,
+    )
+    workload = {"companies": args.companies, "seed": args.seed, **options.toDict()}
+    stages = args.stages or list(STAGES) + ["run"]
+
+    directory = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        zipPath = os.path.join(directory, "companyfacts.zip")
+        start = time.perf_counter()
+        ciks = buildArchive(zipPath, args.companies, args.seed, options)
+        with CompanyFactsArchive(zipPath) as archive:
+            companies = [Company(cik, archive.read(cik)) for cik in ciks]
+        facts = sum(c.facts for c in companies)
+        print(
+            f"Generated {len(companies)} companies, {facts:,} facts, "
+            f"{os.path.getsize(zipPath) / (1 << 20):.1f} MiB zipped "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+        results = {}
+        for stage in stages:
+            if stage == "run":
+                results[stage] = benchRun(zipPath, ciks, facts, args.workers, args.repeat)
+            else:
+                results[stage] = timeStage(*STAGES[stage](companies), args.repeat)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    baseline = {}
+    try:
+        with open(args.baseline, "r") as f:
+            stored = json.load(f)
+        if stored.get("workload") == workload:
+            baseline = stored["results"]
+        else:
+            print("Baseline was recorded with a different workload, not comparing")
+    except FileNotFoundError:
+        print(f"No baseline at {args.baseline}, record one with --save-baseline")
+
+    printResults(results, baseline)
+    output = {"workload": workload, "results": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(output, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.speed_threshold, args.memory_threshold)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import config
+
+COMPILED_VERSION = 1
+
+
+class Catalog:
+    """
+    The concept catalog (config.CONCEPT_CATALOG_PATH) compiled into parallel lists, from which
+    concepts builds its Concept enum and the tag -> alias table extraction checks tags against.
+
+    Concept ids start at 1, matching the values of concepts.Concept. Tag ids start at 0 and
+    follow the order of the catalog file.
+    """
+
+    def __init__(
+        self,
+        sourceHash: str,
+        conceptNames: list[str],
+        conceptDerived: list[bool],
+        tagNames: list[str],
+        tagConcept: list[int],
+        tagWeight: list[int],
+    ):
+        self.sourceHash: str = sourceHash
+        self.conceptNames: list[str] = conceptNames  # index is concept id - 1
+        self.conceptDerived: list[bool] = conceptDerived
+        self.tagNames: list[str] = tagNames
+        self.tagConcept: list[int] = tagConcept
+        self.tagWeight: list[int] = tagWeight
+
+    def rulesHash(self) -> str:
+        """
+        Returns:
+            str - SHA-256 of the compiled concepts and aliases, which changes only with what the
+            rules produce, not with edits to the catalog file such as notes or formatting.
+        """
+        rules = [
+            self.conceptNames,
+            self.conceptDerived,
+            self.tagNames,
+            self.tagConcept,
+            self.tagWeight,
+        ]
+        return hashlib.sha256(json.dumps(rules, separators=(",", ":")).encode()).hexdigest()
+
+    def toDict(self) -> dict:
+        return {
+            "version": COMPILED_VERSION,
+            "source": self.sourceHash,
+            "concepts": self.conceptNames,
+            "derived": self.conceptDerived,
+            "tags": self.tagNames,
+            "tagConcept": self.tagConcept,
+            "tagWeight": self.tagWeight,
+        }
+
+    @classmethod
+    def fromDict(cls, data: dict) -> "Catalog":
+        return cls(
+            data["source"],
+            data["concepts"],
+            data["derived"],
+            data["tags"],
+            data["tagConcept"],
+            data["tagWeight"],
+        )
+
+
+def compileCatalog(source: dict, sourceHash: str) -> Catalog:
+    """
+    Raises:
+        ValueError: if a concept or tag is defined twice, a derived concept has aliases, or a
+        weight is not an integer.
+    """
+    conceptNames = []
+    conceptDerived = []
+    tagNames = []
+    tagConcept = []
+    tagWeight = []
+    seenTags = set()
+    for entry in source["concepts"]:
+        name = entry["name"]
+        if name in conceptNames:
+            raise ValueError(f"Concept {name} is defined twice")
+        conceptNames.append(name)
+        derived = bool(entry.get("derived", False))
+        conceptDerived.append(derived)
+        aliases = entry.get("aliases", [])
+        if derived and aliases:
+            raise ValueError(f"Derived concept {name} cannot have aliases")
+        for tag, weight in aliases:
+            if tag in seenTags:
+                raise ValueError(f"Tag {tag} is an alias of more than one concept")
+            if not isinstance(weight, int):
+                raise ValueError(f"Weight of {tag} is not an integer: {weight!r}")
+            seenTags.add(tag)
+            tagNames.append(tag)
+            tagConcept.append(len(conceptNames))
+            tagWeight.append(weight)
+    return Catalog(sourceHash, conceptNames, conceptDerived, tagNames, tagConcept, tagWeight)
+
+
+def loadCatalog(path: str = None, cachePath: str = None) -> Catalog:
+    """
+    Returns the compiled catalog, from the cache if it was compiled from the same catalog file
+    content, otherwise compiling it and refreshing the cache.
+    """
+    path = path or config.CONCEPT_CATALOG_PATH
+    cachePath = cachePath or config.CONCEPT_CATALOG_CACHE_PATH
+    with open(path, "rb") as f:
+        content = f.read()
+    sourceHash = hashlib.sha256(content).hexdigest()
+    try:
+        with open(cachePath, "r") as f:
+            data = json.load(f)
+        if data.get("version") == COMPILED_VERSION and data.get("source") == sourceHash:
+            return Catalog.fromDict(data)
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    catalog = compileCatalog(json.loads(content), sourceHash)
+    saveCatalog(cachePath, catalog)
+    return catalog
+
+
+def saveCatalog(cachePath: str, catalog: Catalog) -> None:
+    tmpPath = cachePath + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+        with open(tmpPath, "w") as f:
+            json.dump(catalog.toDict(), f, separators=(",", ":"))
+        os.replace(tmpPath, cachePath)
+    except OSError:
+        # Only a cache; without it the catalog is compiled again next time
+        pass
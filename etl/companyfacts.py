@@ -0,0 +1,256 @@
+import json
+import mmap
+import os
+import re
+import struct
+import zipfile
+import zlib
+import config
+
+
+INDEX_VERSION = 1
+LOCAL_HEADER_SIZE = 30
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+FACT_TYPES = ("dei", "us-gaap")
+
+# Quotes inside JSON strings are always escaped, so these can only match real JSON syntax.
+FACTS_KEY = re.compile(rb'"facts"\s*:\s*\{')
+# The start of a tag's object: only tag objects have label/description/units fields
+TAG_OBJECT = re.compile(rb'\{\s*"(?:label|description|units)"\s*:')
+WHITESPACE = b" \t\r\n"
+
+
+class MemberInfo:
+    __slots__ = ("offset", "compressType", "compressSize", "fileSize", "crc")
+
+    def __init__(
+        self, offset: int, compressType: int, compressSize: int, fileSize: int, crc: int
+    ):
+        self.offset: int = offset  # offset of the member's local file header
+        self.compressType: int = compressType
+        self.compressSize: int = compressSize
+        self.fileSize: int = fileSize
+        self.crc: int = crc
+
+    def toList(self) -> list[int]:
+        return [self.offset, self.compressType, self.compressSize, self.fileSize, self.crc]
+
+    def __repr__(self):
+        return (
+            f"MemberInfo(offset: {self.offset}, compressType: {self.compressType}, "
+            f"compressSize: {self.compressSize}, fileSize: {self.fileSize}, crc: {self.crc})"
+        )
+
+
+class CompanyFactsArchive:
+    """
+    Read-only view of companyfacts.zip that opens the archive once.
+
+    The central directory is parsed a single time into a CIK -> MemberInfo index, which is
+    persisted next to the zip and reused for as long as the zip's size and mtime are unchanged.
+    Members are read straight from their offsets through a memory map of the archive.
+    """
+
+    def __init__(self, path: str = config.ZIP_PATH, indexPath: str = None):
+        self.path: str = path
+        self.indexPath: str = indexPath or path + ".index.json"
+        self.cikToMember: dict[str, MemberInfo] = self._loadIndex()
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, cik: str) -> bool:
+        return cik in self.cikToMember
+
+    def __len__(self) -> int:
+        return len(self.cikToMember)
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def ciks(self) -> list[str]:
+        return list(self.cikToMember.keys())
+
+    def member(self, cik: str) -> MemberInfo:
+        if cik not in self.cikToMember:
+            raise KeyError(f"There is no item named '{memberName(cik)}' in the archive")
+        return self.cikToMember[cik]
+
+    def read(self, cik: str) -> bytes:
+        """
+        Returns the uncompressed bytes of CIK##########.json.
+
+        Raises:
+            KeyError: if the archive has no member for the CIK.
+            zipfile.BadZipFile: if the member is corrupt.
+        """
+        info = self.member(cik)
+        mm = self._mm
+        header = mm[info.offset : info.offset + LOCAL_HEADER_SIZE]
+        if header[:4] != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"Bad local file header for {memberName(cik)}")
+        nameLen, extraLen = struct.unpack("<HH", header[26:30])
+        start = info.offset + LOCAL_HEADER_SIZE + nameLen + extraLen
+        raw = mm[start : start + info.compressSize]
+        if info.compressType == zipfile.ZIP_STORED:
+            content = raw
+        elif info.compressType == zipfile.ZIP_DEFLATED:
+            content = zlib.decompress(raw, -zlib.MAX_WBITS, info.fileSize or zlib.DEF_BUF_SIZE)
+        else:
+            raise zipfile.BadZipFile(
+                f"Unsupported compression type {info.compressType} for {memberName(cik)}"
+            )
+        if zlib.crc32(content) != info.crc:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for {memberName(cik)}")
+        return content
+
+    def _loadIndex(self) -> dict[str, MemberInfo]:
+        signature = archiveSignature(self.path)
+        try:
+            with open(self.indexPath, "r") as f:
+                index = json.load(f)
+            if index.get("version") == INDEX_VERSION and index.get("archive") == signature:
+                return {cik: MemberInfo(*m) for cik, m in index["members"].items()}
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        cikToMember = buildIndex(self.path)
+        saveIndex(self.indexPath, signature, cikToMember)
+        return cikToMember
+
+
+def memberName(cik: str) -> str:
+    return "CIK" + cik + ".json"
+
+
+def cikFromMemberName(name: str) -> str | None:
+    if name.startswith("CIK") and name.endswith(".json") and "/" not in name:
+        return name[3:-5]
+    return None
+
+
+def archiveSignature(path: str) -> dict:
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def buildIndex(path: str) -> dict[str, MemberInfo]:
+    """
+    Parses the zip central directory once and maps each CIK to its member's location.
+    """
+    cikToMember = {}
+    with zipfile.ZipFile(path, "r") as z:
+        for zi in z.infolist():
+            cik = cikFromMemberName(zi.filename)
+            if cik is None:
+                continue
+            cikToMember[cik] = MemberInfo(
+                zi.header_offset, zi.compress_type, zi.compress_size, zi.file_size, zi.CRC
+            )
+    return cikToMember
+
+
+def saveIndex(indexPath: str, signature: dict, cikToMember: dict[str, MemberInfo]) -> None:
+    index = {
+        "version": INDEX_VERSION,
+        "archive": signature,
+        "members": {cik: m.toList() for cik, m in cikToMember.items()},
+    }
+    tmpPath = indexPath + ".tmp"
+    try:
+        with open(tmpPath, "w") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(tmpPath, indexPath)
+    except OSError:
+        # The index is only a cache; a read-only data dir just means rebuilding it next run
+        pass
+
+
+def extractFacts(
+    content: bytes, tags: dict | set, factTypes: tuple[str] = FACT_TYPES
+) -> dict:
+    """
+    Builds only the parts of a companyfacts JSON document that the ETL reads.
+
+    Scans the raw bytes for the start of each tag's object, reads the tag (and, for the first
+    tag of a fact type, the fact type) from the key in front of it, and JSON-decodes just the
+    objects of the wanted tags. Everything else is skipped without being decoded.
+
+    Returns:
+        dict - {"facts": {factType: {tag: {...}}}} with the same entries json.loads would give
+        for each wanted tag. A fact type present in the document is present here even if none
+        of its tags are wanted. Returns {} if the document has no "facts" key.
+    """
+    facts = FACTS_KEY.search(content)
+    if not facts:
+        return {}
+    factsStart = facts.end()
+    # Fact types are keyed in the output even when empty, as json.loads would have them
+    factTypeToTags = {
+        factType: {} for factType in factTypes if hasObjectKey(content, factType, factsStart)
+    }
+    decoder = json.JSONDecoder()
+    tagsOut = None  # dict of the fact type currently being walked, None if not wanted
+    pending = None  # (tag, start) of a wanted tag whose object ends where the next one starts
+    for m in TAG_OBJECT.finditer(content, factsStart):
+        start = m.start()
+        if pending:
+            tagsOut[pending[0]] = decodeObject(decoder, content, pending[1], start)
+            pending = None
+        tag, keyStart = keyBefore(content, start)
+        before = skipWhitespaceBackward(content, keyStart - 1)
+        if content[before] == ord("{"):  # first tag of a new fact type
+            factType, _ = keyBefore(content, before)
+            tagsOut = factTypeToTags.get(factType)
+        if tagsOut is not None and tag in tags:
+            pending = (tag, start)
+    if pending:
+        tagsOut[pending[0]] = decodeObject(decoder, content, pending[1], len(content))
+    return {"facts": factTypeToTags}
+
+
+def hasObjectKey(content: bytes, key: str, start: int) -> bool:
+    quoted = b'"' + key.encode("utf-8") + b'"'
+    pos = content.find(quoted, start)
+    while pos != -1:
+        i = skipWhitespace(content, pos + len(quoted))
+        if content[i : i + 1] == b":" and content[skipWhitespace(content, i + 1)] == ord("{"):
+            return True
+        pos = content.find(quoted, pos + 1)
+    return False
+
+
+def keyBefore(content: bytes, objectStart: int) -> tuple[str, int]:
+    """
+    Returns the key of the object starting at objectStart, and the position of its opening quote.
+    """
+    colon = skipWhitespaceBackward(content, objectStart - 1)
+    close = skipWhitespaceBackward(content, colon - 1)
+    open_ = content.rindex(b'"', 0, close)
+    return content[open_ + 1 : close].decode("utf-8"), open_
+
+
+def skipWhitespace(content: bytes, i: int) -> int:
+    while i < len(content) and content[i] in WHITESPACE:
+        i += 1
+    return i
+
+
+def skipWhitespaceBackward(content: bytes, i: int) -> int:
+    while content[i] in WHITESPACE:
+        i -= 1
+    return i
+
+
+def decodeObject(decoder: json.JSONDecoder, content: bytes, start: int, end: int):
+    obj, _ = decoder.raw_decode(content[start:end].decode("utf-8"))
+    return obj
@@ -1,4 +1,6 @@
-from enum import Enum, auto
+from enum import Enum
+import hashlib
+from catalog import loadCatalog
 
 class Duration(Enum):
     Other = 0
@@ -14,109 +16,51 @@ class Period(Enum):
     Q4 = 4
     FY = 4
 
-class Concept(Enum):
-    SharesOutstanding = auto()
-    CashAndCashEquivalents = auto()
-    Assets = auto()
-    ShortTermDebt = auto()
-    LongTermDebt = auto()
-    Equity = auto()
-    Revenue = auto()
-    NetIncome = auto()
-    CashFlowFromOperatingActivities = auto()
-    CashFlowFromInvestingActivities = auto()
-    CashFlowFromFinancingActivities = auto()
-    CapitalExpenditures = auto()
-    Dividends = auto()
+# Concepts and their aliases are defined in the catalog file (config.CONCEPT_CATALOG_PATH)
+catalog = loadCatalog()
+
+Concept = Enum(
+    "Concept", [(name, i + 1) for i, name in enumerate(catalog.conceptNames)], module=__name__
+)
+
+derivedConcepts = [c for c, derived in zip(Concept, catalog.conceptDerived) if derived]
+reportedConcepts = [c for c, derived in zip(Concept, catalog.conceptDerived) if not derived]
 
 class Alias():
+    __slots__ = ('weight', 'name', 'concept', 'id')
+
     def __init__(self, weight: int, name: str, concept: Concept):
         self.weight: int = weight # determines relative priority vs other aliases for a given concept
         self.name: str = name
         self.concept: Concept = concept
+        self.id: int = None # index into aliases
+
+aliases = [
+    Alias(weight, name, Concept(concept))
+    for name, concept, weight in zip(catalog.tagNames, catalog.tagConcept, catalog.tagWeight)
+]
+for i, alias in enumerate(aliases):
+    alias.id = i
+
+# The tag -> alias hash table extraction checks every tag against
+strToAlias = {alias.name: alias for alias in aliases}
+
+# Stand-ins for the alias of a derived value, which no tag reports. Not in strToAlias, so they are
+# never looked for in companyfacts.
+derivedAliases = {concept: Alias(0, concept.name, concept) for concept in derivedConcepts}
+for i, alias in enumerate(derivedAliases.values(), len(aliases)):
+    alias.id = i
+allAliases = aliases + list(derivedAliases.values())
+
+# Bump whenever a change to update_financials alters which rows a given companyfacts JSON produces
+RULES_REVISION = 2
 
-strToAlias = {alias.name: alias for alias in [
-    # Shares Outstanding (uses highest value, weight doesn't matter)
-    Alias(0, 'EntityCommonStockSharesOutstanding', Concept.SharesOutstanding),
-    Alias(0, 'CommonStockSharesOutstanding', Concept.SharesOutstanding),
-    Alias(0, 'CommonStockSharesIssued', Concept.SharesOutstanding),
-    Alias(0, 'WeightedAverageNumberOfDilutedSharesOutstanding', Concept.SharesOutstanding),
-    Alias(0, 'WeightedAverageNumberOfSharesOutstandingBasic', Concept.SharesOutstanding),
-    # Cash and Equivalents
-    Alias(6, 'CashAndCashEquivalentsAtCarryingValue', Concept.CashAndCashEquivalents),
-    Alias(4, 'CashCashEquivalentsAndShortTermInvestments', Concept.CashAndCashEquivalents),
-    Alias(3, 'CashAndCashEquivalentsAtCarryingValueIncludingDiscontinuedOperations', Concept.CashAndCashEquivalents),
-    Alias(2, 'CashCashEquivalentsRestrictedCashAndRestrictedCashEquivalents', Concept.CashAndCashEquivalents),
-    Alias(0, 'CashCashEquivalentsAndFederalFundsSold', Concept.CashAndCashEquivalents),
-    Alias(0, 'CashAndDueFromBanks', Concept.CashAndCashEquivalents),
-    Alias(0, 'Cash', Concept.CashAndCashEquivalents),
-    # Assets
-    Alias(0, 'Assets', Concept.Assets),
-    # Short-Term Debt
-    Alias(4, 'DebtCurrent', Concept.ShortTermDebt),
-    Alias(4, 'LongTermDebtCurrent', Concept.ShortTermDebt),
-    Alias(4, 'LongTermDebtAndCapitalLeaseObligationsCurrent', Concept.ShortTermDebt),
-    Alias(4, 'ShortTermBorrowings', Concept.ShortTermDebt),
-    Alias(4, 'NotesPayableCurrent', Concept.ShortTermDebt),
-    Alias(2, 'ConvertibleNotesPayableCurrent', Concept.ShortTermDebt),
-    Alias(2, 'OtherShortTermBorrowings', Concept.ShortTermDebt),
-    Alias(2, 'CommercialPaper', Concept.ShortTermDebt),
-    Alias(0, 'ConvertibleDebtCurrent', Concept.ShortTermDebt),
-    Alias(-2, 'ConvertibleDebt', Concept.ShortTermDebt),
-    # Long-Term Debt
-    Alias(2, 'LongTermDebtAndCapitalLeaseObligations', Concept.LongTermDebt),
-    Alias(2, 'LongTermDebtNoncurrent', Concept.LongTermDebt),
-    Alias(2, 'LongTermDebt', Concept.LongTermDebt),
-    Alias(2, 'LongTermNotesAndLoans', Concept.LongTermDebt),
-    Alias(2, 'LongTermNotesPayable', Concept.LongTermDebt),
-    Alias(1, 'SeniorLongTermNotes', Concept.LongTermDebt),
-    Alias(1, 'CapitalLeaseObligationsNoncurrent', Concept.LongTermDebt),
-    Alias(0, 'ConvertibleLongTermNotesPayable', Concept.LongTermDebt),
-    Alias(0, 'DebtAndCapitalLeaseObligations', Concept.LongTermDebt),
-    Alias(-1, 'LongTermDebtAndCapitalLeaseObligationsIncludingCurrentMaturities', Concept.LongTermDebt),
-    Alias(-2, 'DebtInstrumentCarryingAmount', Concept.LongTermDebt),
-    Alias(-4, 'DebtLongtermAndShorttermCombinedAmount', Concept.LongTermDebt),
-    # Equity
-    Alias(2, 'StockholdersEquityIncludingPortionAttributableToNoncontrollingInterest', Concept.Equity),
-    Alias(2, 'PartnersCapitalIncludingPortionAttributableToNoncontrollingInterest', Concept.Equity),
-    Alias(0, 'StockholdersEquity', Concept.Equity),
-    Alias(0, 'PartnersCapital', Concept.Equity),
-    # Revenue
-    Alias(16, 'RevenueFromContractWithCustomerExcludingAssessedTax', Concept.Revenue),
-    Alias(14, 'RevenueFromContractWithCustomerIncludingAssessedTax', Concept.Revenue),
-    Alias(12, 'RegulatedAndUnregulatedOperatingRevenue', Concept.Revenue),
-    Alias(10, 'RevenuesNetOfInterestExpense', Concept.Revenue),
-    Alias(8, 'SalesRevenueServicesNet', Concept.Revenue),
-    Alias(6, 'SalesRevenueGoodsNet', Concept.Revenue),
-    Alias(4, 'NoninterestIncome', Concept.Revenue),
-    Alias(2, 'SalesRevenueNet', Concept.Revenue),
-    Alias(0, 'Revenues', Concept.Revenue),
-    # Net Income
-    Alias(8, 'NetIncomeLossAvailableToCommonStockholdersBasic', Concept.NetIncome),
-    Alias(6, 'IncomeLossFromContinuingOperations', Concept.NetIncome),
-    Alias(4, 'NetIncomeLoss', Concept.NetIncome),
-    Alias(2, 'ProfitLoss', Concept.NetIncome),
-    # Cash Flow from Operating Activities
-    Alias(2, 'NetCashProvidedByUsedInOperatingActivities', Concept.CashFlowFromOperatingActivities),
-    Alias(0, 'NetCashProvidedByUsedInOperatingActivitiesContinuingOperations', Concept.CashFlowFromOperatingActivities),
-    # Cash Flow from Investing Activities
-    Alias(2, 'NetCashProvidedByUsedInInvestingActivities', Concept.CashFlowFromInvestingActivities),
-    Alias(0, 'NetCashProvidedByUsedInInvestingActivitiesContinuingOperations', Concept.CashFlowFromInvestingActivities),
-    # Cash Flow from Financing Activities
-    Alias(2, 'NetCashProvidedByUsedInFinancingActivities', Concept.CashFlowFromFinancingActivities),
-    Alias(0, 'NetCashProvidedByUsedInFinancingActivitiesContinuingOperations', Concept.CashFlowFromFinancingActivities),
-    # Capital Expenditures
-    Alias(0, 'PaymentsToAcquirePropertyPlantAndEquipment', Concept.CapitalExpenditures),
-    Alias(-2, 'PaymentsToAcquireProductiveAssets', Concept.CapitalExpenditures),
-    Alias(-2, 'PaymentsToAcquireOtherPropertyPlantAndEquipment', Concept.CapitalExpenditures),
-    Alias(-3, 'PaymentsToAcquireOtherProductiveAssets', Concept.CapitalExpenditures),
-    Alias(-4, 'PaymentsForProceedsFromProductiveAssets', Concept.CapitalExpenditures),
-    # Dividends
-    Alias(2, 'PaymentsOfDividendsCommonStock', Concept.Dividends),
-    Alias(2, 'DividendsCommonStockCash', Concept.Dividends),
-    Alias(0, 'PaymentsOfDividends', Concept.Dividends),
-    Alias(0, 'PaymentsOfOrdinaryDividends', Concept.Dividends),
-]}
+def rulesVersion() -> str:
+    """
+    Identifies the concept rules (the compiled catalog: concepts, their order and which are
+    derived, aliases and weights; and RULES_REVISION) that produced a set of rows.
+    """
+    return hashlib.sha256(f"{RULES_REVISION}|{catalog.rulesHash()}".encode()).hexdigest()[:16]
 
 excuses = {
     '0000002488', # Doesn’t have/report ST-debt, dividends
@@ -4,12 +4,50 @@ EMAIL = "jsripraj@gmail.com"
 URL_SEC_TICKERS = "https://www.sec.gov/files/company_tickers.json"
 URL_SEC_COMPANYFACTS = "https://www.sec.gov/Archives/edgar/daily-index/xbrl/companyfacts.zip"
 BATCH_SIZE_SEC_TICKERS = 100
+PRICE_WORKERS = 4
+PRICE_REQUESTS_PER_SECOND = 1
+PRICE_BURST = 2
+MAX_RETRIES_PRICES = 3
 BATCH_SIZE_SUPABASE = 1000
+BATCH_SIZE_SUPABASE_DELETE = 100
+MAX_IN_FLIGHT_SUPABASE = 4
+MAX_RETRIES_SUPABASE = 5
+FETCH_PARALLEL_SUPABASE = 4  # key ranges fetched concurrently by batchFetch
+PIPELINE_CHUNK_FACTS = 100_000  # facts per chunk handed to the writers
+PIPELINE_QUEUE_CHUNKS = 2  # chunks queued per writer before parsing waits
+PIPELINE_CIKS_PER_TASK = 32  # most CIKs sent to a worker process at once
+PIPELINE_TASKS_PER_WORKER = 2  # tasks submitted ahead per worker process
+MAX_PAYLOAD_BYTES_SUPABASE = 1_000_000
+RETRY_BASE_DELAY_SUPABASE = 0.5  # seconds
+RETRY_MAX_DELAY_SUPABASE = 30  # seconds
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 LOG_DIR = os.path.join(BASE_DIR, "log")
 PROBLEM_CIK_DIR = os.path.join(DATA_DIR, "problem_ciks")
 LOG_PATH_FINANCIALS = os.path.join(LOG_DIR, "update_financials.log")
 LOG_PATH_COMPANIES = os.path.join(LOG_DIR, "update_companies.log")
+METRICS_PATH_FINANCIALS = os.path.join(LOG_DIR, "update_financials_metrics.json")
+PROMETHEUS_PATH_FINANCIALS = os.path.join(LOG_DIR, "update_financials.prom")
+PROFILE_DIR = os.path.join(LOG_DIR, "profiles")
+METRICS_SLOWEST_CIKS = 20
 ZIP_PATH = os.path.join(DATA_DIR, "companyfacts.zip")
-CHUNK_SIZE = 8192
+CONCEPT_CATALOG_PATH = os.path.join(BASE_DIR, "concepts.json")
+CONCEPT_CATALOG_CACHE_PATH = os.path.join(DATA_DIR, "concepts.compiled.json")
+SCHEMA_PATH = os.path.join(BASE_DIR, "schema.sql")  # DDL of the tables the ETL writes
+TICKERS_PATH = os.path.join(DATA_DIR, "company_tickers.json")
+CHUNK_SIZE = 1 << 20
+FETCH_PARALLEL_RANGES = 8
+FETCH_MIN_PARALLEL_BYTES = 64 << 20  # smaller downloads use a single request
+FETCH_WRITE_BUFFER = 8 << 20
+FETCH_STATE_INTERVAL = 16 << 20  # bytes per range between saves of download progress
+SNAPSHOT_DIR = os.path.join(DATA_DIR, "snapshot")
+PRICE_DIR = os.path.join(DATA_DIR, "prices")
+POINT_IN_TIME_DIR = os.path.join(DATA_DIR, "point_in_time")
+SHARD_DIR = os.path.join(DATA_DIR, "shards")
+MANIFEST_PATH_FINANCIALS = os.path.join(DATA_DIR, "financials_manifest.json")
+CIK_CACHE_PATH = os.path.join(DATA_DIR, "companies_ciks.json")
+ISSUES_PATH_FINANCIALS = os.path.join(DATA_DIR, "financials_issues.csv")
+ISSUE_YEARS = 10  # only periods this recent are checked for concept issues
+BENCHMARK_BASELINE_PATH = os.path.join(BASE_DIR, "benchmark_baseline.json")
+BENCHMARK_SPEED_THRESHOLD = 0.15  # fail if facts/s drops more than this below the baseline
+BENCHMARK_MEMORY_THRESHOLD = 0.25  # fail if peak memory rises more than this above it
@@ -0,0 +1,145 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import concepts
+from factstore import FactStore, NO_DURATION
+
+Concept = concepts.Concept
+Duration = concepts.Duration
+
+# Flow concept -> its trailing-twelve-month sum of OneQuarter values
+TTM_CONCEPTS = {
+    Concept.Revenue: Concept.RevenueTTM,
+    Concept.NetIncome: Concept.NetIncomeTTM,
+    Concept.FreeCashFlow: Concept.FreeCashFlowTTM,
+}
+# TTM concept -> its growth over the TTM four quarters earlier
+GROWTH_CONCEPTS = {
+    Concept.RevenueTTM: Concept.RevenueGrowth,
+    Concept.NetIncomeTTM: Concept.NetIncomeGrowth,
+}
+# Concept -> the same divided by the period's shares outstanding
+PER_SHARE_CONCEPTS = {
+    Concept.RevenueTTM: Concept.RevenuePerShare,
+    Concept.NetIncomeTTM: Concept.EarningsPerShare,
+    Concept.FreeCashFlowTTM: Concept.FreeCashFlowPerShare,
+    Concept.Equity: Concept.BookValuePerShare,
+}
+
+
+def addDerivedMetrics(store: FactStore) -> int:
+    """
+    Appends the derived concepts (concepts.derivedConcepts) of every company in the store,
+    computed in one vectorized pass over the resolved values, so screens can read them as single
+    values:
+
+    - FreeCashFlow: CashFlowFromOperatingActivities - CapitalExpenditures, for each duration
+      both are reported with.
+    - *TTM: sum of the OneQuarter values of the four calendar quarters up to the period, with
+      duration Year. Needs all four, so OneQuarter values derived by
+      addMissingOneQuarterConcepts count.
+    - *Growth: TTM over the TTM four quarters earlier, minus 1, if the earlier one is positive.
+    - *PerShare: TTM (or Equity, with no duration) over the period's shares outstanding.
+
+    Returns:
+        int - number of facts added.
+    """
+    before = len(store)
+    if before == 0:
+        return 0
+    # Copies, as the arrays cannot grow while numpy views of them exist
+    factPeriod = np.array(store.factPeriod, dtype=np.uint32)
+    factConcept = np.array(store.factConcept, dtype=np.uint16)
+    factDuration = np.array(store.factDuration, dtype=np.int8)
+    factValue = np.array(store.factValue, dtype=np.float64)
+
+    # Grid cell of each period: one row per company, one column per calendar quarter
+    years = np.array(store.periodYear, dtype=np.int64)
+    quarters = years * 4 + np.array(store.periodQuarter, dtype=np.int64)
+    firstQuarter = int(quarters.min())
+    shape = (len(store.ciks), int(quarters.max()) - firstQuarter + 1)
+    cells = np.array(store.periodCik, dtype=np.int64) * shape[1] + quarters - firstQuarter
+    # Two periods can fall in the same calendar quarter; derived values go to the first
+    _, firstPeriods = np.unique(cells, return_index=True)
+    periodCells = cells[firstPeriods]
+
+    def factsOf(concept: Concept, duration: int) -> tuple[np.ndarray, np.ndarray]:
+        # First fact per period of a concept and duration, as (periods, values)
+        mask = (factConcept == concept.value) & (factDuration == duration)
+        periods, first = np.unique(factPeriod[mask], return_index=True)
+        return periods, factValue[mask][first]
+
+    # Free cash flow, matched on (period, duration)
+    fcfPeriods, fcfDurations, fcfValues = [], [], []
+    for duration in Duration:
+        if duration == Duration.Other:
+            continue
+        cfoPeriods, cfo = factsOf(Concept.CashFlowFromOperatingActivities, duration.value)
+        capexPeriods, capex = factsOf(Concept.CapitalExpenditures, duration.value)
+        periods, i, j = np.intersect1d(cfoPeriods, capexPeriods, return_indices=True)
+        fcfPeriods.append(periods)
+        fcfDurations.append(np.full(len(periods), duration.value, dtype=np.int8))
+        fcfValues.append(cfo[i] - capex[j])
+    fcfPeriods = np.concatenate(fcfPeriods)
+    order = np.argsort(fcfPeriods, kind="stable")
+    fcfPeriods = fcfPeriods[order]
+    fcfDurations = np.concatenate(fcfDurations)[order]
+    fcfValues = np.concatenate(fcfValues)[order]
+    store.addFacts(fcfPeriods, Concept.FreeCashFlow, fcfDurations, fcfValues)
+    quarterlyFcf = fcfDurations == Duration.OneQuarter.value
+
+    def grid(periods: np.ndarray, values: np.ndarray) -> np.ndarray:
+        g = np.full(shape[0] * shape[1], np.nan)
+        # The first period of each cell, assigned once
+        gridCells, first = np.unique(cells[periods], return_index=True)
+        g[gridCells] = values[first]
+        return g.reshape(shape)
+
+    ttmGrids = {}
+    for concept, ttmConcept in TTM_CONCEPTS.items():
+        if concept == Concept.FreeCashFlow:
+            periods, values = fcfPeriods[quarterlyFcf], fcfValues[quarterlyFcf]
+        else:
+            periods, values = factsOf(concept, Duration.OneQuarter.value)
+        quarterly = grid(periods, values)
+        ttm = np.full(shape, np.nan)
+        if shape[1] >= 4:
+            ttm[:, 3:] = sliding_window_view(quarterly, 4, axis=1).sum(axis=-1)
+        ttmGrids[ttmConcept] = ttm
+        addFromGrid(store, ttmConcept, ttm, firstPeriods, periodCells)
+
+    for ttmConcept, growthConcept in GROWTH_CONCEPTS.items():
+        ttm = ttmGrids[ttmConcept]
+        growth = np.full(shape, np.nan)
+        previous = ttm[:, :-4]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            growth[:, 4:] = np.where(previous > 0, ttm[:, 4:] / previous - 1, np.nan)
+        addFromGrid(store, growthConcept, growth, firstPeriods, periodCells)
+
+    # Shares outstanding are resolved to the highest value, so take the highest of a period's
+    shareMask = factConcept == Concept.SharesOutstanding.value
+    shares = np.full(len(store.periodEnd), np.nan)
+    np.fmax.at(shares, factPeriod[shareMask], factValue[shareMask])
+    shares[shares <= 0] = np.nan
+    for concept, perShareConcept in PER_SHARE_CONCEPTS.items():
+        if concept in ttmGrids:
+            perShare = ttmGrids[concept].ravel()[periodCells] / shares[firstPeriods]
+            addValues(store, perShareConcept, firstPeriods, Duration.Year.value, perShare)
+        else:
+            periods, values = factsOf(concept, NO_DURATION)
+            addValues(store, perShareConcept, periods, NO_DURATION, values / shares[periods])
+    return len(store) - before
+
+
+def addFromGrid(
+    store: FactStore, concept: Concept, g: np.ndarray, periods: np.ndarray, cells: np.ndarray
+) -> None:
+    addValues(store, concept, periods, Duration.Year.value, g.ravel()[cells])
+
+
+def addValues(
+    store: FactStore, concept: Concept, periods: np.ndarray, duration: int, values: np.ndarray
+) -> None:
+    # Missing inputs leave NaN, which is not stored
+    keep = np.isfinite(values)
+    periods = periods[keep]
+    store.addFacts(periods, concept, np.full(len(periods), duration, dtype=np.int8), values[keep])
@@ -0,0 +1,326 @@
+from array import array
+from datetime import datetime
+import numpy as np
+import concepts
+
+
+NO_DURATION = -1  # factDuration value for facts without a duration (instants and shares)
+NO_FILING_FY = 0  # factFilingFy value for facts without a filing fiscal year
+# Typed arrays of a FactStore, as saved by toArrays
+STORE_ARRAYS = (
+    "periodCik",
+    "periodEnd",
+    "periodYear",
+    "periodQuarter",
+    "factCik",
+    "factPeriod",
+    "factConcept",
+    "factDuration",
+    "factValue",
+    "factAlias",
+    "factFilingFy",
+)
+
+
+class FactStore:
+    """
+    Compact, columnar store of resolved financial facts.
+
+    Each fact is one position in a set of parallel typed arrays instead of a FinancialValue object.
+    Facts point into a table of periods (also parallel arrays), and concepts, durations and aliases
+    are stored as small integer ids. Facts keep the order they were added in, which is the order
+    rows are emitted in.
+    """
+
+    def __init__(self):
+        self.ciks: list[str] = []
+        self.cikToId: dict[str, int] = {}
+
+        # Periods
+        self.periodCik = array("I")
+        self.periodEnd = array("i")  # proleptic Gregorian ordinal of the period end
+        self.periodYear = array("H")  # calendar year
+        self.periodQuarter = array("B")  # calendar period, concepts.Period value
+
+        # Facts
+        self.factCik = array("I")
+        self.factPeriod = array("I")  # index into the period arrays
+        self.factConcept = array("H")  # concepts.Concept value
+        self.factDuration = array("b")  # concepts.Duration value, or NO_DURATION
+        self.factValue = array("d")  # reported values are integers, exact up to 2**53
+        self.factAlias = array("H")  # concepts.Alias id
+        self.factFilingFy = array("H")  # or NO_FILING_FY
+
+    def __len__(self) -> int:
+        return len(self.factValue)
+
+    def __getitem__(self, i: int) -> "FactView":
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("fact index out of range")
+        return FactView(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield FactView(self, i)
+
+    def cikId(self, cik: str) -> int:
+        if cik not in self.cikToId:
+            self.cikToId[cik] = len(self.ciks)
+            self.ciks.append(cik)
+        return self.cikToId[cik]
+
+    def addPeriod(self, cik: str, end: datetime, cy: int, cp: concepts.Period) -> int:
+        """
+        Returns:
+            int: the new period's index.
+        """
+        self.periodCik.append(self.cikId(cik))
+        self.periodEnd.append(end.toordinal())
+        self.periodYear.append(cy)
+        self.periodQuarter.append(cp.value)
+        return len(self.periodEnd) - 1
+
+    def addFact(
+        self,
+        period: int,
+        concept: concepts.Concept,
+        duration: concepts.Duration | None,
+        value: float,
+        alias: concepts.Alias,
+        filingFiscalYear: int | None,
+    ) -> None:
+        self.factCik.append(self.periodCik[period])
+        self.factPeriod.append(period)
+        self.factConcept.append(concept.value)
+        self.factDuration.append(duration.value if duration else NO_DURATION)
+        self.factValue.append(value)
+        self.factAlias.append(alias.id)
+        self.factFilingFy.append(filingFiscalYear or NO_FILING_FY)
+
+    def addFacts(
+        self,
+        periods: np.ndarray,
+        concept: concepts.Concept,
+        durations: np.ndarray,
+        values: np.ndarray,
+    ) -> None:
+        """
+        Appends facts of a derived concept, one per element of the parallel arrays.
+
+        Parameters:
+            durations: np.ndarray - concepts.Duration values or NO_DURATION.
+        """
+        periods = np.asarray(periods, dtype=np.uint32)
+        self.factCik.frombytes(np.frombuffer(self.periodCik, dtype=np.uint32)[periods].tobytes())
+        self.factPeriod.frombytes(periods.tobytes())
+        self.factConcept.frombytes(np.full(len(periods), concept.value, dtype=np.uint16).tobytes())
+        self.factDuration.frombytes(np.asarray(durations, dtype=np.int8).tobytes())
+        self.factValue.frombytes(np.asarray(values, dtype=np.float64).tobytes())
+        alias = concepts.derivedAliases[concept].id
+        self.factAlias.frombytes(np.full(len(periods), alias, dtype=np.uint16).tobytes())
+        self.factFilingFy.frombytes(np.full(len(periods), NO_FILING_FY, dtype=np.uint16).tobytes())
+
+    def addFinancialPeriods(self, cik: str, fps: list) -> None:
+        """
+        Adds the periods and FinancialValues of one company.
+
+        Parameters:
+            fps: list[FinancialPeriod] - populated FinancialPeriods, in the order rows should be
+            emitted.
+        """
+        for fp in fps:
+            period = self.addPeriod(cik, fp.end, fp.cy, fp.cp)
+            for concept, fvs in fp.conceptToFinancialValues.items():
+                for fv in fvs:
+                    self.addFact(
+                        period,
+                        concepts.Concept[concept],
+                        fv.duration,
+                        fv.value,
+                        fv.alias,
+                        fv.filingFiscalYear,
+                    )
+
+    def extend(self, other: "FactStore") -> None:
+        """
+        Appends all periods and facts of another store, e.g. one built by a worker process.
+        """
+        cikMap = [self.cikId(cik) for cik in other.ciks]
+        periodOffset = len(self.periodEnd)
+        self.periodCik.extend(array("I", (cikMap[c] for c in other.periodCik)))
+        self.periodEnd.extend(other.periodEnd)
+        self.periodYear.extend(other.periodYear)
+        self.periodQuarter.extend(other.periodQuarter)
+        self.factCik.extend(array("I", (cikMap[c] for c in other.factCik)))
+        self.factPeriod.extend(array("I", (p + periodOffset for p in other.factPeriod)))
+        self.factConcept.extend(other.factConcept)
+        self.factDuration.extend(other.factDuration)
+        self.factValue.extend(other.factValue)
+        self.factAlias.extend(other.factAlias)
+        self.factFilingFy.extend(other.factFilingFy)
+
+    def toArrays(self) -> dict[str, np.ndarray]:
+        """
+        Returns:
+            dict[str, np.ndarray] - the store's arrays by attribute name, e.g. for np.savez.
+        """
+        arrays = {}
+        for name in STORE_ARRAYS:
+            values = getattr(self, name)
+            arrays[name] = np.frombuffer(values, dtype=values.typecode)
+        arrays["ciks"] = np.array(self.ciks, dtype=str)
+        return arrays
+
+    @classmethod
+    def fromArrays(cls, arrays) -> "FactStore":
+        """
+        Rebuilds a store from the arrays of toArrays.
+        """
+        store = cls()
+        for cik in arrays["ciks"].tolist():
+            store.cikId(cik)
+        for name in STORE_ARRAYS:
+            getattr(store, name).frombytes(np.ascontiguousarray(arrays[name]).tobytes())
+        return store
+
+    def rows(self):
+        """
+        Yields a (cik, year, period, duration, concept, value) tuple per fact, read straight from
+        the arrays. Integral values are yielded as ints.
+        """
+        ciks = self.ciks
+        periodYear = self.periodYear
+        periodNames = [None] + [p.name for p in concepts.Period]
+        quarterNames = [periodNames[q] for q in self.periodQuarter]
+        conceptNames = conceptIdToName()
+        durationNames = durationIdToName()
+        for cik, period, concept, duration, value in zip(
+            self.factCik, self.factPeriod, self.factConcept, self.factDuration, self.factValue
+        ):
+            yield (
+                ciks[cik],
+                periodYear[period],
+                quarterNames[period],
+                durationNames[duration],
+                conceptNames[concept],
+                int(value) if value.is_integer() else value,
+            )
+
+    def annualRows(self):
+        """
+        Pivots the facts a screen reads into one row per (cik, year): the Q4 value of each
+        concept with duration Year or no duration, the Year one if there are both.
+
+        Yields:
+            tuple - (cik, year, value of each concepts.Concept in definition order or None).
+        """
+        factPeriod = np.frombuffer(self.factPeriod, dtype=np.uint32)
+        quarters = np.frombuffer(self.periodQuarter, dtype=np.uint8)[factPeriod]
+        durations = np.frombuffer(self.factDuration, dtype=np.int8)
+        isYear = durations == concepts.Duration.Year.value
+        facts = np.flatnonzero(
+            (quarters == concepts.Period.Q4.value) & (isYear | (durations == NO_DURATION))
+        )
+        # No-duration values first, so a Year value is the last of its cell
+        facts = facts[np.argsort(isYear[facts], kind="stable")]
+        years = np.frombuffer(self.periodYear, dtype=np.uint16)[factPeriod[facts]]
+        keys = np.frombuffer(self.factCik, dtype=np.uint32)[facts].astype(np.int64) << 16 | years
+        uniqueKeys, keyIndex = np.unique(keys, return_inverse=True)
+
+        conceptColumn = np.zeros(max(c.value for c in concepts.Concept) + 1, dtype=np.int64)
+        conceptColumn[[c.value for c in concepts.Concept]] = np.arange(len(concepts.Concept))
+        columns = conceptColumn[np.frombuffer(self.factConcept, dtype=np.uint16)[facts]]
+        # One fact per cell, the last in that order, since assigning to repeated indices leaves
+        # any one of the values
+        cells = keyIndex * len(concepts.Concept) + columns
+        _, lastFromEnd = np.unique(cells[::-1], return_index=True)
+        last = len(cells) - 1 - lastFromEnd
+        facts, keyIndex, columns = facts[last], keyIndex[last], columns[last]
+        values = np.zeros((len(uniqueKeys), len(concepts.Concept)), dtype=np.float64)
+        present = np.zeros(values.shape, dtype=bool)
+        values[keyIndex, columns] = np.frombuffer(self.factValue, dtype=np.float64)[facts]
+        present[keyIndex, columns] = True
+
+        ciks = self.ciks
+        for key, rowValues, rowPresent in zip(
+            uniqueKeys.tolist(), values.tolist(), present.tolist()
+        ):
+            yield (
+                ciks[key >> 16],
+                key & 0xFFFF,
+                *(v if p else None for v, p in zip(rowValues, rowPresent)),
+            )
+
+
+class FactView:
+    """
+    Read-only object view of one fact in a FactStore, for code that still wants objects.
+    """
+
+    __slots__ = ("store", "index")
+
+    def __init__(self, store: FactStore, index: int):
+        self.store: FactStore = store
+        self.index: int = index
+
+    @property
+    def cik(self) -> str:
+        return self.store.ciks[self.store.factCik[self.index]]
+
+    @property
+    def period(self) -> int:
+        return self.store.factPeriod[self.index]
+
+    @property
+    def end(self) -> datetime:
+        return datetime.fromordinal(self.store.periodEnd[self.period])
+
+    @property
+    def cy(self) -> int:
+        return self.store.periodYear[self.period]
+
+    @property
+    def cp(self) -> concepts.Period:
+        return concepts.Period(self.store.periodQuarter[self.period])
+
+    @property
+    def concept(self) -> concepts.Concept:
+        return concepts.Concept(self.store.factConcept[self.index])
+
+    @property
+    def duration(self) -> concepts.Duration | None:
+        duration = self.store.factDuration[self.index]
+        return None if duration == NO_DURATION else concepts.Duration(duration)
+
+    @property
+    def value(self) -> float:
+        return self.store.factValue[self.index]
+
+    @property
+    def alias(self) -> concepts.Alias:
+        return concepts.allAliases[self.store.factAlias[self.index]]
+
+    @property
+    def filingFiscalYear(self) -> int | None:
+        fy = self.store.factFilingFy[self.index]
+        return None if fy == NO_FILING_FY else fy
+
+    def __repr__(self):
+        return (
+            f"FactView(cik: {self.cik}, cy: {self.cy}, cp: {self.cp.name}, "
+            f"concept: {self.concept.name}, alias: {self.alias.name}, value: {self.value}, "
+            f"filing FY: {self.filingFiscalYear}, "
+            f"duration: {self.duration.name if self.duration else None})"
+        )
+
+
+def conceptIdToName() -> dict[int, str]:
+    return {c.value: c.name for c in concepts.Concept}
+
+
+def durationIdToName() -> dict[int, str | None]:
+    names = {d.value: d.name for d in concepts.Duration}
+    names[NO_DURATION] = None
+    return names
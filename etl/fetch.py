@@ -0,0 +1,303 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import mmap
+import os
+import struct
+import threading
+import zipfile
+import requests
+import config
+
+
+class FetchError(Exception):
+    pass
+
+
+class Resource:
+    """
+    Validators and size of a remote resource, as of the last response.
+    """
+
+    def __init__(self, etag: str = None, lastModified: str = None, size: int = None):
+        self.etag: str = etag
+        self.lastModified: str = lastModified
+        self.size: int = size
+
+    @classmethod
+    def fromResponse(cls, response: requests.Response) -> "Resource":
+        size = response.headers.get("Content-Length")
+        return cls(
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            int(size) if size is not None else None,
+        )
+
+    def toDict(self) -> dict:
+        return {"etag": self.etag, "lastModified": self.lastModified, "size": self.size}
+
+    def sameAs(self, other: "Resource") -> bool:
+        if self.etag and other.etag:
+            return self.etag == other.etag
+        if self.lastModified and other.lastModified:
+            return self.lastModified == other.lastModified and self.size == other.size
+        return False
+
+    def ifRange(self) -> str | None:
+        return self.etag or self.lastModified
+
+
+def fetch(
+    url: str,
+    path: str,
+    logger,
+    verify=None,
+    parallel: int = config.FETCH_PARALLEL_RANGES,
+    session: requests.Session = None,
+) -> bool:
+    """
+    Downloads url to path unless the copy at path is already current.
+
+    The ETag and Last-Modified of the last download are kept in path + ".meta.json" and sent as
+    a conditional request. Downloads go to path + ".part" and resume from where they stopped with
+    Range requests, as long as the resource hasn't changed. Large files are fetched as several
+    byte ranges in parallel. The finished file is checked (size, plus verify(partPath) if given)
+    before it atomically replaces path.
+
+    Parameters:
+        verify: Callable[[str], None] - raises if the downloaded file is not usable.
+
+        parallel: int - maximum number of byte ranges to download at once.
+
+    Returns:
+        bool: True if a new copy was downloaded, False if path was already current.
+    """
+    session = session or newSession()
+    metaPath = path + ".meta.json"
+    partPath = path + ".part"
+    statePath = path + ".part.json"
+
+    current = loadResource(metaPath) if os.path.exists(path) else None
+    headers = {}
+    if current and current.etag:
+        headers["If-None-Match"] = current.etag
+    if current and current.lastModified:
+        headers["If-Modified-Since"] = current.lastModified
+    response = session.head(url, headers=headers, allow_redirects=True)
+    if response.status_code == 304:
+        logger.info(f"{url} not modified")
+        return False
+    response.raise_for_status()
+    remote = Resource.fromResponse(response)
+    if current and current.sameAs(remote):
+        logger.info(f"{url} not modified")
+        return False
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    state = loadState(statePath, remote)
+    acceptsRanges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+    if (
+        acceptsRanges
+        and remote.size
+        and remote.size >= config.FETCH_MIN_PARALLEL_BYTES
+        and parallel > 1
+    ):
+        downloadRanges(session, url, partPath, statePath, remote, state, parallel, logger)
+    else:
+        downloadStream(session, url, partPath, statePath, remote, acceptsRanges, logger)
+
+    size = os.path.getsize(partPath)
+    if remote.size is not None and size != remote.size:
+        raise FetchError(f"Downloaded {size} bytes of {url}, expected {remote.size}")
+    if verify:
+        try:
+            verify(partPath)
+        except Exception:
+            # Start over next time rather than resuming into a corrupt file
+            removeIfExists(partPath)
+            removeIfExists(statePath)
+            raise
+    os.replace(partPath, path)
+    saveJson(metaPath, remote.toDict())
+    removeIfExists(statePath)
+    logger.info(f"Downloaded {url} ({size} bytes)")
+    return True
+
+
+def downloadStream(
+    session: requests.Session,
+    url: str,
+    partPath: str,
+    statePath: str,
+    remote: Resource,
+    acceptsRanges: bool,
+    logger,
+) -> None:
+    """
+    Downloads with a single request, appending to an existing .part file if the server can
+    resume it.
+    """
+    offset = 0
+    if acceptsRanges and remote.ifRange() and os.path.exists(statePath):
+        offset = os.path.getsize(partPath) if os.path.exists(partPath) else 0
+    headers = {}
+    if offset:
+        headers = {"Range": f"bytes={offset}-", "If-Range": remote.ifRange()}
+    saveJson(statePath, {"resource": remote.toDict()})
+    with session.get(url, headers=headers, stream=True) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            offset = 0
+        else:
+            logger.info(f"Resuming {url} at byte {offset}")
+        with open(partPath, "r+b" if offset else "wb", buffering=config.FETCH_WRITE_BUFFER) as f:
+            f.seek(offset)
+            f.truncate()
+            for chunk in r.iter_content(chunk_size=config.CHUNK_SIZE):
+                f.write(chunk)
+
+
+def downloadRanges(
+    session: requests.Session,
+    url: str,
+    partPath: str,
+    statePath: str,
+    remote: Resource,
+    state: dict | None,
+    parallel: int,
+    logger,
+) -> None:
+    """
+    Downloads byte ranges of the file in parallel into a preallocated .part file. Progress of
+    each range is kept in the state file so an interrupted download resumes where each range
+    stopped.
+    """
+    if state is None or not os.path.exists(partPath):
+        rangeSize = -(-remote.size // parallel)
+        ranges = [
+            [start, min(start + rangeSize, remote.size), start]  # start, end, next byte
+            for start in range(0, remote.size, rangeSize)
+        ]
+        state = {"resource": remote.toDict(), "ranges": ranges}
+        with open(partPath, "wb") as f:
+            f.truncate(remote.size)
+    else:
+        done = sum(r[2] - r[0] for r in state["ranges"])
+        logger.info(f"Resuming {url} with {done} of {remote.size} bytes done")
+    saveJson(statePath, state)
+    lock = threading.Lock()
+
+    def downloadRange(r: list[int]) -> None:
+        end = r[1]
+        if r[2] >= end:
+            return
+        headers = {"Range": f"bytes={r[2]}-{end - 1}"}
+        if remote.ifRange():
+            headers["If-Range"] = remote.ifRange()
+        with session.get(url, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise FetchError(f"{url} changed or does not support ranges, restart download")
+            with open(partPath, "r+b", buffering=config.FETCH_WRITE_BUFFER) as f:
+                f.seek(r[2])
+                # Next byte to write. r[2] only moves when progress is saved.
+                position = r[2]
+                for chunk in response.iter_content(chunk_size=config.CHUNK_SIZE):
+                    # Never past the range, even if the server sends more
+                    chunk = chunk[: end - position]
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    position += len(chunk)
+                    if position - r[2] >= config.FETCH_STATE_INTERVAL:
+                        f.flush()
+                        with lock:
+                            r[2] = position
+                            saveJson(statePath, state)
+                f.flush()
+                with lock:
+                    r[2] = position
+                    saveJson(statePath, state)
+        if r[2] < end:
+            raise FetchError(f"Range {r[0]}-{end - 1} of {url} ended early at {r[2]}")
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        for future in [executor.submit(downloadRange, r) for r in state["ranges"]]:
+            future.result()
+
+
+def verifyZip(path: str) -> None:
+    """
+    Checks a downloaded zip's structure: the central directory parses and every member's local
+    header is where the central directory says. Does not decompress anything.
+
+    Raises:
+        zipfile.BadZipFile: if the archive is truncated or corrupt.
+    """
+    with zipfile.ZipFile(path, "r") as z:
+        infos = z.infolist()
+    if not infos:
+        raise zipfile.BadZipFile(f"{path} has no members")
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for zi in infos:
+                if mm[zi.header_offset : zi.header_offset + 4] != b"PK\x03\x04":
+                    raise zipfile.BadZipFile(f"Bad local file header for {zi.filename}")
+                nameLen, extraLen = struct.unpack(
+                    "<HH", mm[zi.header_offset + 26 : zi.header_offset + 30]
+                )
+                if zi.header_offset + 30 + nameLen + extraLen + zi.compress_size > len(mm):
+                    raise zipfile.BadZipFile(f"{zi.filename} is truncated")
+
+
+def verifyJson(path: str) -> None:
+    with open(path, "rb") as f:
+        json.load(f)
+
+
+def newSession() -> requests.Session:
+    session = requests.Session()
+    session.headers["User-Agent"] = config.EMAIL
+    # Sizes, byte counts and Range offsets are all of the bytes as sent. With gzip, iter_content
+    # would write more bytes than Content-Length, and ranges would index the compressed body.
+    session.headers["Accept-Encoding"] = "identity"
+    return session
+
+
+def loadResource(metaPath: str) -> Resource | None:
+    try:
+        with open(metaPath, "r") as f:
+            meta = json.load(f)
+        return Resource(meta.get("etag"), meta.get("lastModified"), meta.get("size"))
+    except (OSError, ValueError):
+        return None
+
+
+def loadState(statePath: str, remote: Resource) -> dict | None:
+    """
+    Returns the saved progress of an interrupted download, or None if there is none or it was of
+    a different version of the resource.
+    """
+    try:
+        with open(statePath, "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    saved = state.get("resource", {})
+    if not remote.ifRange() or not Resource(**saved).sameAs(remote):
+        removeIfExists(statePath)
+        return None
+    return state if "ranges" in state else None
+
+
+def saveJson(path: str, obj: dict) -> None:
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmpPath, path)
+
+
+def removeIfExists(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
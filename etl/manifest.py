@@ -0,0 +1,64 @@
+import json
+import os
+import config
+import concepts
+from companyfacts import CompanyFactsArchive
+
+
+class Manifest:
+    """
+    Records what the financials table was built from: the CRC-32 and size of each CIK's
+    companyfacts member, and the concept rules version that produced the rows.
+    """
+
+    def __init__(self, rulesVersion: str = None, cikToFingerprint: dict[str, list[int]] = None):
+        self.rulesVersion: str = rulesVersion
+        self.cikToFingerprint: dict[str, list[int]] = cikToFingerprint or {}
+
+    def diff(self, other: "Manifest") -> tuple[list[str], list[str]]:
+        """
+        Returns:
+            tuple[list[str], list[str]] - CIKs in other that are new or changed relative to this
+            manifest, and CIKs in this manifest that are no longer in other.
+        """
+        changed = [
+            cik
+            for cik, fingerprint in other.cikToFingerprint.items()
+            if self.cikToFingerprint.get(cik) != fingerprint
+        ]
+        removed = [cik for cik in self.cikToFingerprint if cik not in other.cikToFingerprint]
+        return changed, removed
+
+
+def loadManifest(path: str = config.MANIFEST_PATH_FINANCIALS) -> Manifest | None:
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+        return Manifest(data["rulesVersion"], data["members"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def saveManifest(manifest: Manifest, path: str = config.MANIFEST_PATH_FINANCIALS) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w") as f:
+        json.dump(
+            {"rulesVersion": manifest.rulesVersion, "members": manifest.cikToFingerprint},
+            f,
+            separators=(",", ":"),
+        )
+    os.replace(tmpPath, path)
+
+
+def currentManifest(archive: CompanyFactsArchive, ciks: list[str]) -> Manifest:
+    """
+    Builds the manifest the given CIKs would have if loaded from the archive now, using only the
+    zip central directory.
+    """
+    cikToFingerprint = {}
+    for cik in ciks:
+        if cik in archive:
+            m = archive.member(cik)
+            cikToFingerprint[cik] = [m.crc, m.fileSize]
+    return Manifest(concepts.rulesVersion(), cikToFingerprint)
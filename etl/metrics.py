@@ -0,0 +1,111 @@
+import heapq
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import config
+
+
+class RunMetrics:
+    """
+    Cumulative time spent in each stage of an ETL run, event counters, and the CIKs that took
+    longest. Worker processes fill their own and the parent merges them.
+    """
+
+    def __init__(self, maxSlowest: int = config.METRICS_SLOWEST_CIKS):
+        self.stageSeconds: dict[str, float] = defaultdict(float)
+        self.counters: dict[str, int] = defaultdict(int)
+        self.slowest: list[tuple[float, str]] = []  # min-heap of (seconds, cik)
+        self.maxSlowest: int = maxSlowest
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stageSeconds[stage] += time.perf_counter() - start
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] += n
+
+    def recordCik(self, cik: str, seconds: float) -> None:
+        if len(self.slowest) < self.maxSlowest:
+            heapq.heappush(self.slowest, (seconds, cik))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, cik))
+
+    def recordWrite(self, summary) -> None:
+        """
+        Adds the counts of a supabase_utils.WriteSummary.
+        """
+        self.count("rows_written", summary.rowsWritten)
+        self.count("rows_failed", summary.rowsFailed)
+        self.count("batches_retried", summary.batchesRetried)
+        self.count("batches_split", summary.batchesSplit)
+
+    def merge(self, other: "RunMetrics") -> None:
+        for stage, seconds in other.stageSeconds.items():
+            self.stageSeconds[stage] += seconds
+        for name, n in other.counters.items():
+            self.counters[name] += n
+        for seconds, cik in other.slowest:
+            self.recordCik(cik, seconds)
+
+    def slowestCiks(self) -> list[tuple[str, float]]:
+        return [(cik, seconds) for seconds, cik in sorted(self.slowest, reverse=True)]
+
+    def toDict(self) -> dict:
+        return {
+            "stages": {stage: round(s, 6) for stage, s in self.stageSeconds.items()},
+            "counters": dict(self.counters),
+            "slowestCiks": [
+                {"cik": cik, "seconds": round(seconds, 6)} for cik, seconds in self.slowestCiks()
+            ],
+        }
+
+    def writeJson(self, path: str, **summary) -> None:
+        """
+        Parameters:
+            summary: run-level values (e.g. duration, success) written alongside the metrics.
+        """
+        writeAtomic(path, json.dumps({**summary, **self.toDict()}, indent=2))
+
+    def writePrometheus(self, path: str, job: str, durationSeconds: float, ok: bool) -> None:
+        """
+        Writes the metrics in the Prometheus text format, for node_exporter's textfile collector.
+        """
+        label = f'job="{job}"'
+        lines = [
+            "# HELP etl_run_duration_seconds Wall time of the last run.",
+            "# TYPE etl_run_duration_seconds gauge",
+            f"etl_run_duration_seconds{{{label}}} {durationSeconds:.6f}",
+            "# HELP etl_run_success 1 if the last run loaded everything, else 0.",
+            "# TYPE etl_run_success gauge",
+            f"etl_run_success{{{label}}} {int(ok)}",
+            "# HELP etl_run_timestamp_seconds Unix time the last run finished.",
+            "# TYPE etl_run_timestamp_seconds gauge",
+            f"etl_run_timestamp_seconds{{{label}}} {time.time():.0f}",
+            "# HELP etl_stage_seconds Time spent in each stage in the last run.",
+            "# TYPE etl_stage_seconds gauge",
+        ]
+        for stage, seconds in sorted(self.stageSeconds.items()):
+            lines.append(f'etl_stage_seconds{{{label},stage="{stage}"}} {seconds:.6f}')
+        for name, n in sorted(self.counters.items()):
+            lines.append(f"# TYPE etl_{name} gauge")
+            lines.append(f"etl_{name}{{{label}}} {n}")
+        lines.append("# HELP etl_slowest_cik_seconds Processing time of the slowest CIKs.")
+        lines.append("# TYPE etl_slowest_cik_seconds gauge")
+        for cik, seconds in self.slowestCiks():
+            lines.append(f'etl_slowest_cik_seconds{{{label},cik="{cik}"}} {seconds:.6f}')
+        writeAtomic(path, "\n".join(lines) + "\n")
+
+
+def writeAtomic(path: str, text: str) -> None:
+    # The textfile collector may read at any time, so never leave a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w") as f:
+        f.write(text)
+    os.replace(tmpPath, path)
@@ -0,0 +1,97 @@
+import queue
+import threading
+from collections import deque
+from metrics import RunMetrics
+
+END = object()  # no more chunks
+ABORT = object()  # stop without finishing the write
+
+
+class PipelineAborted(Exception):
+    pass
+
+
+class ChunkWriter:
+    """
+    Runs a write function on its own thread, feeding it chunks through a bounded queue. put
+    blocks while the queue is full, so a writer that falls behind slows its producer down
+    instead of letting chunks pile up in memory.
+
+    The write function is called as write(chunks, metrics) and must consume chunks, an iterator
+    that ends when the producer calls finish and raises PipelineAborted if it calls abort. It
+    returns True if everything was written.
+    """
+
+    def __init__(self, name: str, write, logger, maxQueued: int):
+        self.name: str = name
+        self.write = write
+        self.logger = logger
+        self.queue: queue.Queue = queue.Queue(maxsize=maxQueued)
+        self.metrics: RunMetrics = RunMetrics()
+        self.ok: bool = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"writer-{name}", daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        try:
+            with self.metrics.timer(f"write_{self.name}"):
+                self.ok = bool(self.write(self.chunks(), self.metrics))
+        except PipelineAborted:
+            self.logger.info(f"{self.name} writer aborted")
+        except Exception as e:
+            self.logger.error(f"Error in {self.name} writer: {e}")
+        finally:
+            self.stopped.set()
+
+    def chunks(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is END:
+                return
+            if chunk is ABORT:
+                raise PipelineAborted()
+            yield chunk
+
+    def put(self, chunk) -> None:
+        # A writer that already stopped (e.g. on an error) takes nothing more
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def finish(self) -> bool:
+        """
+        Waits for everything put so far to be written.
+
+        Returns:
+            bool - True if the write function succeeded.
+        """
+        self.put(END)
+        self.thread.join()
+        return self.ok
+
+    def abort(self) -> None:
+        self.put(ABORT)
+        self.thread.join()
+
+
+def boundedMap(executor, fn, items: list, maxInFlight: int):
+    """
+    Like executor.map, yielding results in order, but submits at most maxInFlight calls ahead
+    of the one being yielded, so unconsumed results cannot pile up.
+    """
+    items = iter(items)
+    inFlight = deque()
+    for item in items:
+        inFlight.append(executor.submit(fn, item))
+        if len(inFlight) >= maxInFlight:
+            break
+    while inFlight:
+        result = inFlight.popleft().result()
+        for item in items:
+            inFlight.append(executor.submit(fn, item))
+            break
+        yield result
@@ -0,0 +1,376 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+from collections import defaultdict
+from datetime import date, datetime
+import numpy as np
+import config
+import concepts
+import snapshot
+import update_financials
+import utils
+from companyfacts import FACT_TYPES, CompanyFactsArchive, extractFacts
+from factstore import FactStore
+from metrics import RunMetrics
+
+INDEX_VERSION = 2  # 1 did not record which tags each company's history covers
+NO_START = -1  # start of entries without a start date
+NO_FY = 0  # fy of entries without a fiscal year
+
+# One row per filed value. Names are codes into the store's dictionaries, so the store does not
+# depend on the order of the concept catalog.
+FACT_DTYPE = np.dtype(
+    [
+        ("cik", "<u4"),
+        ("factType", "u1"),  # index into FACT_TYPES
+        ("tag", "<u2"),  # index into the index's tags
+        ("units", "<u2"),  # index into the index's units
+        ("form", "<u2"),  # index into the index's forms
+        ("start", "<i4"),  # proleptic Gregorian ordinal, or NO_START
+        ("end", "<i4"),
+        ("filed", "<i4"),
+        ("fy", "<u2"),  # or NO_FY
+        ("accn", "<u8"),  # accession number without dashes
+        ("value", "<i8"),
+    ]
+)
+
+logger = update_financials.logger
+
+
+class PointInTimeStore:
+    """
+    Append-only store of every value filed for the catalog's tags, with its filing date,
+    accession number and fiscal year, where the financials table keeps only the value that wins
+    today. Rows are never changed or removed, so the facts known on any past date can be
+    reconstructed.
+
+    facts.bin holds FACT_DTYPE rows. Each ingest appends one segment, in which each company's rows
+    are contiguous and in companyfacts document order. index.json lists the segments with their
+    filing date range, the name dictionaries the rows refer to, the fact types of each company's
+    latest document (the resolution rules need them even when no wanted tag is filed under
+    them) and the order of its wanted tags (which breaks ties between aliases), and the last filing date (and accession numbers filed on it) seen for each company, so
+    re-ingesting an archive only appends newer filings. It also records the set of catalog tags
+    each company's history was ingested for: a tag added to the catalog since then has its whole
+    history ingested, not only the filings after the last one stored.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory: str = directory or config.POINT_IN_TIME_DIR
+        self.factsPath: str = os.path.join(self.directory, "facts.bin")
+        self.indexPath: str = os.path.join(self.directory, "index.json")
+        self.index: dict = self.loadIndex()
+        self.codes: dict[str, dict[str, int]] = {
+            kind: {name: i for i, name in enumerate(self.index[kind])}
+            for kind in ("tags", "units", "forms")
+        }
+
+    def loadIndex(self) -> dict:
+        try:
+            with open(self.indexPath, "r") as f:
+                index = json.load(f)
+            if index.get("version") == INDEX_VERSION:
+                return index
+        except (OSError, ValueError):
+            pass
+        return {
+            "version": INDEX_VERSION,
+            "tags": [],
+            "units": [],
+            "forms": [],
+            "segments": [],
+            "lastFiled": {},
+            "factTypes": {},
+            "tagOrder": {},  # CIK -> [fact type code, tag code] of its wanted tags, in document order
+            "tagSets": {},  # tag set id -> sorted tags
+            "cikTagSet": {},  # CIK -> id of the tag set its stored history covers
+        }
+
+    def saveIndex(self) -> None:
+        tmpPath = self.indexPath + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(self.index, f, separators=(",", ":"))
+        os.replace(tmpPath, self.indexPath)
+
+    def __len__(self) -> int:
+        return sum(segment["rows"] for segment in self.index["segments"])
+
+    def code(self, kind: str, name: str) -> int:
+        codes = self.codes[kind]
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(self.index[kind])
+            self.index[kind].append(name)
+        return code
+
+    def addTagSet(self, tags: list[str]) -> str:
+        """
+        Returns:
+            str - the id of the set of tags, which is recorded in the index.
+        """
+        tags = sorted(tags)
+        tagSet = hashlib.sha256("\n".join(tags).encode()).hexdigest()[:16]
+        self.index["tagSets"].setdefault(tagSet, tags)
+        return tagSet
+
+    def coveredTags(self, cik: str) -> set[str]:
+        """
+        Returns:
+            set[str] - the tags whose whole history up to the company's last ingest is stored.
+        """
+        return set(self.index["tagSets"].get(self.index["cikTagSet"].get(cik), ()))
+
+    def storedRows(self, tags: set[str]) -> dict[int, set[bytes]]:
+        """
+        Returns:
+            dict[int, set[bytes]] - the stored rows of the tags by CIK id, as bytes.
+        """
+        codes = [self.codes["tags"][tag] for tag in tags if tag in self.codes["tags"]]
+        facts = self.read()
+        if not codes or len(facts) == 0:
+            return {}
+        cikToRows = defaultdict(set)
+        for row in facts[np.isin(facts["tag"], codes)]:
+            cikToRows[int(row["cik"])].add(row.tobytes())
+        return cikToRows
+
+    def newRecords(self, cik: str, data: dict, stored: dict[int, set[bytes]] = None) -> np.ndarray:
+        """
+        Parameters:
+            stored: dict[int, set[bytes]] - rows already stored of tags some company's history
+            does not cover (see storedRows), e.g. of a tag that was dropped from the catalog and
+            added back. They are not appended again.
+
+        Returns:
+            np.ndarray - FACT_DTYPE rows of the company's entries in data that were filed after
+            the last filing already stored, in document order, plus every entry of the wanted
+            tags its stored history does not cover yet.
+        """
+        lastFiled, lastAccns = self.index["lastFiled"].get(cik, (0, []))
+        lastAccns = set(lastAccns)
+        covered = self.coveredTags(cik)
+        cikId = int(cik)
+        rows = []
+        tagOrder = []
+        self.index["factTypes"][cik] = list(data.get("facts", {}))
+        for typeCode, factType in enumerate(FACT_TYPES):
+            for tag, metadata in data.get("facts", {}).get(factType, {}).items():
+                if tag not in concepts.strToAlias:
+                    continue
+                # A tag added to the catalog since the company was last ingested
+                backfill = tag not in covered
+                tagCode = self.code("tags", tag)
+                tagOrder.append([typeCode, tagCode])
+                for units, entries in metadata["units"].items():
+                    unitsCode = self.code("units", units)
+                    for e in entries:
+                        filed = utils.strToOrdinal(e["filed"])
+                        accn = int(e["accn"].replace("-", ""))
+                        if not backfill and (
+                            filed < lastFiled or (filed == lastFiled and accn in lastAccns)
+                        ):
+                            continue
+                        rows.append(
+                            (
+                                cikId,
+                                typeCode,
+                                tagCode,
+                                unitsCode,
+                                self.code("forms", e["form"]),
+                                utils.strToOrdinal(e["start"]) if "start" in e else NO_START,
+                                utils.strToOrdinal(e["end"]),
+                                filed,
+                                int(e["fy"]) if e["fy"] else NO_FY,
+                                accn,
+                                int(e["val"]),
+                            )
+                        )
+        self.index["tagOrder"][cik] = tagOrder
+        records = np.array(rows, dtype=FACT_DTYPE)
+        if stored and cikId in stored and len(records):
+            storedRows = stored[cikId]
+            records = records[[row.tobytes() not in storedRows for row in records]]
+        if len(records):
+            newLast = int(records["filed"].max())
+            # Backfilled entries can all be older than the last filing
+            if newLast >= lastFiled:
+                accns = set(records["accn"][records["filed"] == newLast].tolist())
+                if newLast == lastFiled:
+                    accns |= lastAccns
+                self.index["lastFiled"][cik] = [newLast, sorted(accns)]
+        return records
+
+    def ingest(self, archive: CompanyFactsArchive, ciks: list[str]) -> int:
+        """
+        Appends the filings in the archive that are not stored yet as one segment.
+
+        Returns:
+            int - number of rows appended.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        start = len(self)
+        rows = 0
+        minFiled = maxFiled = None
+        tagSet = self.addTagSet(list(concepts.strToAlias))
+        wanted = set(self.index["tagSets"][tagSet])
+        uncovered = set()
+        for cik in ciks:
+            if cik in self.index["lastFiled"] and self.index["cikTagSet"].get(cik) != tagSet:
+                uncovered |= wanted - self.coveredTags(cik)
+        stored = self.storedRows(uncovered) if uncovered else None
+        indexChanged = False
+        with open(self.factsPath, "ab") as f:
+            # Drop rows a failed ingest wrote past the last segment
+            f.truncate(start * FACT_DTYPE.itemsize)
+            for cik in ciks:
+                if cik not in archive:
+                    continue
+                records = self.newRecords(
+                    cik, extractFacts(archive.read(cik), concepts.strToAlias), stored
+                )
+                if self.index["cikTagSet"].get(cik) != tagSet:
+                    self.index["cikTagSet"][cik] = tagSet
+                    indexChanged = True
+                if len(records) == 0:
+                    continue
+                f.write(records.tobytes())
+                rows += len(records)
+                low, high = int(records["filed"].min()), int(records["filed"].max())
+                minFiled = low if minFiled is None else min(minFiled, low)
+                maxFiled = high if maxFiled is None else max(maxFiled, high)
+        if rows:
+            self.index["segments"].append(
+                {
+                    "start": start,
+                    "rows": rows,
+                    "minFiled": minFiled,
+                    "maxFiled": maxFiled,
+                    "ingested": datetime.now().isoformat(timespec="seconds"),
+                    "archive": os.path.basename(archive.path),
+                }
+            )
+        if rows or indexChanged:
+            self.saveIndex()
+        logger.info(f"Appended {rows} filed values to the point-in-time store")
+        return rows
+
+    def asOf(self, day: date, ciks: list[str] = None) -> FactStore:
+        """
+        Returns the financials as they could have been built on day: the same resolution rules
+        and derived metrics as update_financials, run on only the values filed by then. The
+        view as of today is the financials table.
+
+        One pass: each company's rows are gathered from the segments filed by day, filtered on
+        filing date, and resolved once.
+
+        Parameters:
+            ciks: list[str] - companies to include. All if None.
+        """
+        asOfOrdinal = day.toordinal()
+        facts = self.read()
+        cikToSlices = defaultdict(list)
+        for segment in self.index["segments"]:
+            if segment["minFiled"] > asOfOrdinal:
+                continue
+            part = facts[segment["start"] : segment["start"] + segment["rows"]]
+            cikIds, starts, counts = np.unique(part["cik"], return_index=True, return_counts=True)
+            for cikId, s, n in zip(cikIds.tolist(), starts.tolist(), counts.tolist()):
+                cikToSlices[cikId].append((segment["start"] + s, n))
+        wanted = None if ciks is None else {int(cik) for cik in ciks}
+        result = FactStore()
+        metrics = RunMetrics()
+        for cikId in sorted(cikToSlices):
+            if wanted is not None and cikId not in wanted:
+                continue
+            records = np.concatenate([facts[s : s + n] for s, n in cikToSlices[cikId]])
+            records = records[records["filed"] <= asOfOrdinal]
+            if len(records) == 0:
+                continue
+            cik = f"{cikId:010d}"
+            store = FactStore()
+            data = self.toCompanyFacts(cik, records)
+            try:
+                update_financials.resolveFacts(cik, data, store, metrics)
+            except KeyError as ke:
+                utils.logCik(logger.debug, cik, f"KeyError: {ke}")
+                continue
+            result.extend(store)
+        return result
+
+    def read(self) -> np.ndarray:
+        rows = len(self)
+        if rows == 0:
+            return np.empty(0, dtype=FACT_DTYPE)
+        return np.memmap(self.factsPath, dtype=FACT_DTYPE, mode="r", shape=(rows,))
+
+    def toCompanyFacts(self, cik: str, records: np.ndarray) -> dict:
+        """
+        Rebuilds the companyfacts structure update_financials reads from one company's rows,
+        with tags in the order of its latest document, and units and entries in the order they
+        were stored.
+        """
+        tags, units, forms = self.index["tags"], self.index["units"], self.index["forms"]
+        ends = utils.ordinalsToDatetime64(records["end"].astype(np.int64)).astype(str).tolist()
+        starts = utils.ordinalsToDatetime64(records["start"].astype(np.int64)).astype(str).tolist()
+        factTypes = self.index["factTypes"].get(cik, FACT_TYPES)
+        factTypeToTags = {factType: {} for factType in factTypes}
+        for typeCode, tag, unit, form, start, startStr, end, fy, value in zip(
+            records["factType"].tolist(),
+            records["tag"].tolist(),
+            records["units"].tolist(),
+            records["form"].tolist(),
+            records["start"].tolist(),
+            starts,
+            ends,
+            records["fy"].tolist(),
+            records["value"].tolist(),
+        ):
+            factType = factTypeToTags.setdefault(FACT_TYPES[typeCode], {})
+            tagUnits = factType.setdefault(tags[tag], {"units": {}})
+            entry = {"end": end, "val": value, "fy": fy or None, "form": forms[form]}
+            if start != NO_START:
+                entry["start"] = startStr
+            tagUnits["units"].setdefault(units[unit], []).append(entry)
+        # Tags backfilled or first filed in a later segment were added after the others
+        position = {tuple(pair): i for i, pair in enumerate(self.index["tagOrder"].get(cik, ()))}
+        tagCodes = self.codes["tags"]
+        for typeCode, factType in enumerate(FACT_TYPES):
+            tagToUnits = factTypeToTags.get(factType)
+            if tagToUnits:
+                factTypeToTags[factType] = dict(
+                    sorted(
+                        tagToUnits.items(),
+                        key=lambda item: position.get((typeCode, tagCodes[item[0]]), len(position)),
+                    )
+                )
+        return {"facts": factTypeToTags}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Point-in-time store of every filed value")
+    parser.add_argument(
+        "--ingest",
+        action="store_true",
+        help="append the filings in companyfacts.zip that are not stored yet",
+    )
+    parser.add_argument(
+        "--as-of",
+        type=date.fromisoformat,
+        metavar="YYYY-MM-DD",
+        help="write the financials as known on this date to an Arrow file",
+    )
+    parser.add_argument("--out", help="file for --as-of, by default in the store's directory")
+    args = parser.parse_args()
+    store = PointInTimeStore()
+    if args.ingest:
+        with CompanyFactsArchive(config.ZIP_PATH) as archive:
+            store.ingest(archive, update_financials.fetchCiks())
+    if args.as_of:
+        if not snapshot.isAvailable():
+            sys.exit("pyarrow is required for --as-of")
+        facts = store.asOf(args.as_of)
+        out = args.out or os.path.join(store.directory, f"financials_{args.as_of}.arrow")
+        snapshot.writeTable(snapshot.factStoreToTable(facts), out)
+        logger.info(f"Wrote {len(facts)} facts as of {args.as_of} to {out}")
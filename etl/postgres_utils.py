@@ -0,0 +1,265 @@
+from dotenv import load_dotenv
+import os
+
+try:
+    import psycopg
+    from psycopg import sql
+except ImportError:
+    psycopg = None
+
+load_dotenv()
+
+url: str = os.environ.get("POSTGRES_URL")
+
+CONSTRAINT_TYPES = {"p": "primary key", "u": "unique"}  # pg_constraint contype -> SQL
+
+
+def isAvailable() -> bool:
+    """
+    Returns True if direct Postgres access is configured, i.e. psycopg is installed and
+    POSTGRES_URL is set. Otherwise loads go through the Supabase REST API.
+    """
+    return psycopg is not None and bool(url)
+
+
+def connect():
+    return psycopg.connect(url)
+
+
+def bulkLoad(tablename: str, columns: list[str], rows, logger) -> int:
+    """
+    Replaces the contents of a table atomically.
+
+    Rows are streamed with COPY into a staging table shaped like the live one, the live table's
+    indexes are built on it, and the two are swapped by renaming in one transaction, carrying
+    over grants, row-level security policies and the primary key and unique constraints (which
+    upserts on the table rely on). Readers see the old table until the swap
+    commits; if anything fails the live table is left untouched.
+
+    Parameters:
+        rows: Iterable[tuple] - values in the same order as columns.
+
+    Returns:
+        int - number of rows loaded.
+    """
+    staging = f"{tablename}_staging"
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("drop table if exists {}").format(sql.Identifier(staging)))
+            cur.execute(
+                sql.SQL(
+                    "create table {} (like {} including defaults including constraints "
+                    "including identity including generated)"
+                ).format(sql.Identifier(staging), sql.Identifier(tablename))
+            )
+            count = copyRows(cur, staging, columns, rows)
+            indexNames = createIndexesLike(cur, tablename, staging)
+            copyTableAccess(cur, tablename, staging)
+            cur.execute(sql.SQL("analyze {}").format(sql.Identifier(staging)))
+        conn.commit()
+        logger.info(f"Loaded {count} rows into {staging}")
+
+        try:
+            with conn.transaction():
+                with conn.cursor() as cur:
+                    cur.execute(sql.SQL("drop table {}").format(sql.Identifier(tablename)))
+                    cur.execute(
+                        sql.SQL("alter table {} rename to {}").format(
+                            sql.Identifier(staging), sql.Identifier(tablename)
+                        )
+                    )
+                    for stagingName, name, constraintType in indexNames:
+                        cur.execute(
+                            sql.SQL("alter index {} rename to {}").format(
+                                sql.Identifier(stagingName), sql.Identifier(name)
+                            )
+                        )
+                        if constraintType:
+                            cur.execute(
+                                sql.SQL("alter table {} add constraint {} {} using index {}").format(
+                                    sql.Identifier(tablename),
+                                    sql.Identifier(name),
+                                    sql.SQL(CONSTRAINT_TYPES[constraintType]),
+                                    sql.Identifier(name),
+                                )
+                            )
+        except Exception:
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL("drop table if exists {}").format(sql.Identifier(staging)))
+            conn.commit()
+            raise
+    logger.info(f"Swapped {staging} in as {tablename}")
+    return count
+
+
+def replaceWhereIn(
+    tablename: str, column: str, values: list, columns: list[str], rows, logger
+) -> int:
+    """
+    Deletes the rows whose column is in values and COPYs rows in their place, in one transaction.
+
+    Returns:
+        int - number of rows inserted.
+    """
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL("delete from {} where {} = any(%s)").format(
+                    sql.Identifier(tablename), sql.Identifier(column)
+                ),
+                (list(values),),
+            )
+            deleted = cur.rowcount
+            count = copyRows(cur, tablename, columns, rows)
+        conn.commit()
+    logger.info(f"Replaced {deleted} rows of {tablename} with {count} rows")
+    return count
+
+
+def fetchColumn(tablename: str, column: str) -> list:
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL("select {} from {}").format(
+                    sql.Identifier(column), sql.Identifier(tablename)
+                )
+            )
+            return [row[0] for row in cur.fetchall()]
+
+
+def executeScript(statements: str) -> None:
+    """
+    Runs SQL statements, e.g. DDL, in one transaction.
+    """
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(statements)
+        conn.commit()
+
+
+def truncateIfExists(tablename: str) -> None:
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute("select to_regclass(%s)", (tablename,))
+            if cur.fetchone()[0] is not None:
+                cur.execute(sql.SQL("truncate {}").format(sql.Identifier(tablename)))
+        conn.commit()
+
+
+def upsertRow(tablename: str, row: dict, key: list[str]) -> None:
+    """
+    Inserts a row, or updates the non-key columns of the row with the same key.
+    """
+    columns = list(row)
+    updates = [c for c in columns if c not in key]
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL("insert into {} ({}) values ({}) on conflict ({}) do update set {}").format(
+                    sql.Identifier(tablename),
+                    sql.SQL(", ").join(map(sql.Identifier, columns)),
+                    sql.SQL(", ").join([sql.Placeholder()] * len(columns)),
+                    sql.SQL(", ").join(map(sql.Identifier, key)),
+                    sql.SQL(", ").join(
+                        sql.SQL("{} = excluded.{}").format(sql.Identifier(c), sql.Identifier(c))
+                        for c in updates
+                    ),
+                ),
+                list(row.values()),
+            )
+        conn.commit()
+
+
+def copyRows(cur, tablename: str, columns: list[str], rows) -> int:
+    count = 0
+    statement = sql.SQL("copy {} ({}) from stdin").format(
+        sql.Identifier(tablename), sql.SQL(", ").join(map(sql.Identifier, columns))
+    )
+    with cur.copy(statement) as copy:
+        for row in rows:
+            copy.write_row(row)
+            count += 1
+    return count
+
+
+def createIndexesLike(cur, source: str, target: str) -> list[tuple[str, str, str | None]]:
+    """
+    Creates each of source's indexes on target. Indexes backing a constraint are created as plain
+    indexes, which the constraint can be added on once they have the source's names.
+
+    Returns:
+        list[tuple[str, str, str | None]] - (target index name, source index name, pg_constraint
+        contype of the constraint the index backs or None) triples.
+    """
+    cur.execute(
+        "select i.indexname, i.indexdef, c.contype from pg_indexes i "
+        "left join pg_constraint c on c.conindid = "
+        "to_regclass(quote_ident(i.schemaname) || '.' || quote_ident(i.indexname)) "
+        "and c.contype in ('p', 'u') "
+        "where i.schemaname = current_schema() and i.tablename = %s",
+        (source,),
+    )
+    names = []
+    for indexName, indexDef, constraintType in cur.fetchall():
+        targetName = f"{indexName}_staging"
+        # indexdef reads "CREATE [UNIQUE] INDEX name ON schema.table USING ..."
+        head, using = indexDef.split(" USING ", 1)
+        unique = "UNIQUE " if head.startswith("CREATE UNIQUE") else ""
+        cur.execute(
+            sql.SQL("create {}index {} on {} using ").format(
+                sql.SQL(unique), sql.Identifier(targetName), sql.Identifier(target)
+            )
+            + sql.SQL(using)
+        )
+        names.append((targetName, indexName, constraintType))
+    return names
+
+
+def copyTableAccess(cur, source: str, target: str) -> None:
+    """
+    Copies table privileges and row-level security (enabled flag and policies) from source to target.
+    """
+    cur.execute(
+        "select grantee, privilege_type from information_schema.role_table_grants "
+        "where table_schema = current_schema() and table_name = %s",
+        (source,),
+    )
+    for grantee, privilege in cur.fetchall():
+        cur.execute(
+            sql.SQL("grant {} on {} to {}").format(
+                sql.SQL(privilege), sql.Identifier(target), roleSql(grantee)
+            )
+        )
+
+    cur.execute(
+        "select relrowsecurity from pg_class "
+        "where oid = to_regclass(quote_ident(current_schema()) || '.' || quote_ident(%s))",
+        (source,),
+    )
+    row = cur.fetchone()
+    if row and row[0]:
+        cur.execute(
+            sql.SQL("alter table {} enable row level security").format(sql.Identifier(target))
+        )
+    cur.execute(
+        "select policyname, permissive, roles, cmd, qual, with_check from pg_policies "
+        "where schemaname = current_schema() and tablename = %s",
+        (source,),
+    )
+    for name, permissive, roles, cmd, qual, withCheck in cur.fetchall():
+        statement = sql.SQL("create policy {} on {} as {} for {} to {}").format(
+            sql.Identifier(name),
+            sql.Identifier(target),
+            sql.SQL(permissive),
+            sql.SQL(cmd),
+            sql.SQL(", ").join(roleSql(r) for r in roles),
+        )
+        if qual:
+            statement += sql.SQL(" using ({})").format(sql.SQL(qual))
+        if withCheck:
+            statement += sql.SQL(" with check ({})").format(sql.SQL(withCheck))
+        cur.execute(statement)
+
+
+def roleSql(role: str):
+    return sql.SQL("public") if role.lower() == "public" else sql.Identifier(role)
@@ -0,0 +1,273 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+import os
+import random
+import threading
+import time
+import numpy as np
+import config
+
+# One row per trading day: proleptic Gregorian ordinal and close
+BAR_DTYPE = np.dtype([("date", "<i4"), ("close", "<f8")])
+# Version of what the stored closes are. Histories stored under another version are refetched.
+STORE_VERSION = 2  # raw closes; 1 held closes adjusted as of the day they were fetched
+
+
+class PriceProvider(ABC):
+    """
+    Source of daily closing prices. Subclass to plug in another source, e.g. a fake one for
+    running the pipeline offline.
+    """
+
+    @abstractmethod
+    def fetchDaily(self, tickers: list[str], start: date | None) -> dict[str, np.ndarray]:
+        """
+        Parameters:
+            start: date | None - first day to fetch, or None for the full history.
+
+        Returns:
+            dict[str, np.ndarray] - BAR_DTYPE bars sorted by date for each ticker the source had
+            data for, with raw (not split- or dividend-adjusted) closes, so that closes fetched
+            at different times agree. Tickers it had nothing for are left out.
+        """
+
+
+class YahooPriceProvider(PriceProvider):
+    def fetchDaily(self, tickers: list[str], start: date | None) -> dict[str, np.ndarray]:
+        import yfinance as yf
+
+        # Adjusted closes change with every later split or dividend, so they would not line up
+        # with the history already stored, nor with the shares outstanding filed at the time
+        if start is None:
+            data = yf.download(
+                tickers, period="max", auto_adjust=False, progress=False, threads=False
+            )
+        else:
+            data = yf.download(
+                tickers, start=start, auto_adjust=False, progress=False, threads=False
+            )
+        if data is None or data.empty:
+            return {}
+        closes = data["Close"]
+        ordinals = np.array([d.toordinal() for d in closes.index.date], dtype=np.int32)
+        tickerToBars = {}
+        for ticker in tickers:
+            if ticker not in closes.columns:
+                continue
+            values = closes[ticker].to_numpy(dtype=np.float64)
+            valid = ~np.isnan(values)
+            if not valid.any():
+                continue
+            bars = np.empty(int(valid.sum()), dtype=BAR_DTYPE)
+            bars["date"] = ordinals[valid]
+            bars["close"] = values[valid]
+            tickerToBars[ticker] = bars
+        return tickerToBars
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: allows bursts of up to capacity requests, refilled at rate per
+    second.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self.tokens: float = capacity
+        self.updated: float = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class PriceStore:
+    """
+    Daily closes kept on disk as one small binary file of BAR_DTYPE rows per ticker, sorted by
+    date, so a ticker's history can be loaded, searched and appended to on its own. Histories
+    written under another STORE_VERSION are dropped, so they are backfilled again.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory: str = directory or config.PRICE_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        versionPath = os.path.join(self.directory, "version")
+        try:
+            with open(versionPath, "r") as f:
+                version = int(f.read())
+        except (OSError, ValueError):
+            version = None
+        if version != STORE_VERSION:
+            for name in os.listdir(self.directory):
+                if name.endswith(".bin"):
+                    os.remove(os.path.join(self.directory, name))
+            with open(versionPath, "w") as f:
+                f.write(str(STORE_VERSION))
+
+    def path(self, ticker: str) -> str:
+        return os.path.join(self.directory, ticker.replace("/", "_") + ".bin")
+
+    def read(self, ticker: str) -> np.ndarray:
+        try:
+            return np.fromfile(self.path(ticker), dtype=BAR_DTYPE)
+        except FileNotFoundError:
+            return np.empty(0, dtype=BAR_DTYPE)
+
+    def lastBar(self, ticker: str) -> tuple[date, float] | None:
+        """
+        Returns the date and close of the ticker's last stored bar, reading only that bar.
+        """
+        path = self.path(ticker)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+        if size < BAR_DTYPE.itemsize:
+            return None
+        last = np.fromfile(path, dtype=BAR_DTYPE, offset=size - BAR_DTYPE.itemsize)[0]
+        return date.fromordinal(int(last["date"])), float(last["close"])
+
+    def lastDate(self, ticker: str) -> date | None:
+        last = self.lastBar(ticker)
+        return last[0] if last else None
+
+    def append(self, ticker: str, bars: np.ndarray) -> int:
+        """
+        Appends the bars newer than the ticker's last stored bar.
+
+        Returns:
+            int - number of bars appended.
+        """
+        last = self.lastDate(ticker)
+        if last is not None:
+            bars = bars[bars["date"] > last.toordinal()]
+        if len(bars) == 0:
+            return 0
+        with open(self.path(ticker), "ab") as f:
+            f.write(np.ascontiguousarray(bars, dtype=BAR_DTYPE).tobytes())
+        return len(bars)
+
+    def closeOn(self, ticker: str, day: date) -> tuple[date, float] | None:
+        """
+        Returns the last close on or before day, with its date.
+        """
+        bars = self.read(ticker)
+        i = np.searchsorted(bars["date"], day.toordinal(), side="right") - 1
+        if i < 0:
+            return None
+        return date.fromordinal(int(bars["date"][i])), float(bars["close"][i])
+
+    def yearEndCloses(self, ticker: str) -> dict[int, tuple[date, float]]:
+        """
+        Returns the last close of each calendar year the ticker traded in, with its date.
+        """
+        bars = self.read(ticker)
+        if len(bars) == 0:
+            return {}
+        days = bars["date"].astype(np.int64) - date(1970, 1, 1).toordinal()
+        years = days.astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64) + 1970
+        lastOfYear = np.flatnonzero(np.diff(years, append=years[-1] + 1))
+        return {
+            int(years[i]): (date.fromordinal(int(bars["date"][i])), float(bars["close"][i]))
+            for i in lastOfYear
+        }
+
+
+def ingestPrices(
+    tickers: list[str],
+    store: PriceStore,
+    provider: PriceProvider,
+    logger,
+    batchSize: int = config.BATCH_SIZE_SEC_TICKERS,
+    workers: int = config.PRICE_WORKERS,
+    bucket: TokenBucket = None,
+    maxRetries: int = config.MAX_RETRIES_PRICES,
+    today: date = None,
+) -> set[str]:
+    """
+    Brings the stored daily closes of each ticker up to date.
+
+    Tickers without stored history are backfilled with their full history once; the rest fetch
+    only the days after their last stored bar. Batches of tickers that need the same start date
+    are fetched concurrently, each request waiting for a token from the rate limiter. A batch
+    that raises is retried with backoff. Tickers a backfill returned nothing for are retried in
+    later, smaller batches; an update returning nothing just means there are no new bars yet.
+
+    Returns:
+        set[str] - tickers whose fetch failed after all retries.
+    """
+    today = today or date.today()
+    bucket = bucket or TokenBucket(config.PRICE_REQUESTS_PER_SECOND, config.PRICE_BURST)
+    startToTickers: dict[date | None, list[str]] = {}
+    for ticker in tickers:
+        last = store.lastDate(ticker)
+        if last is not None and last >= today:
+            continue
+        start = None if last is None else last + timedelta(days=1)
+        startToTickers.setdefault(start, []).append(ticker)
+
+    def fetchBatch(start: date | None, batch: list[str]) -> tuple[list[str], int]:
+        """
+        Returns the tickers that failed, and the number of bars stored.
+        """
+        for attempt in range(maxRetries + 1):
+            bucket.acquire()
+            try:
+                tickerToBars = provider.fetchDaily(batch, start)
+                break
+            except Exception as e:
+                if attempt == maxRetries:
+                    logger.error(f"Error fetching prices for {len(batch)} tickers: {e}")
+                    return batch, 0
+                time.sleep(random.uniform(0, min(30, 0.5 * 2**attempt)))
+        stored = 0
+        for ticker, bars in tickerToBars.items():
+            stored += store.append(ticker, bars)
+        if start is not None:
+            return [], stored
+        return [t for t in batch if t not in tickerToBars], stored
+
+    failed = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = [
+            (start, group[i : i + batchSize], 0)
+            for start, group in startToTickers.items()
+            for i in range(0, len(group), batchSize)
+        ]
+        barsStored = 0
+        while pending:
+            futures = [
+                (start, attempt, executor.submit(fetchBatch, start, batch))
+                for start, batch, attempt in pending
+            ]
+            pending = []
+            for start, attempt, future in futures:
+                missing, stored = future.result()
+                barsStored += stored
+                if not missing:
+                    continue
+                if attempt < maxRetries:
+                    # Smaller batches, so one bad ticker costs less of a retry
+                    size = max(1, len(missing) // 2)
+                    pending.extend(
+                        (start, missing[i : i + size], attempt + 1)
+                        for i in range(0, len(missing), size)
+                    )
+                else:
+                    failed.update(missing)
+    logger.info(
+        f"Stored {barsStored} daily bars for {len(tickers) - len(failed)} tickers, "
+        f"{len(failed)} without prices"
+    )
+    return failed
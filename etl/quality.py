@@ -0,0 +1,86 @@
+import csv
+import json
+import os
+import config
+import utils
+from companyfacts import CompanyFactsArchive
+
+# Issue kinds found by update_financials.findConceptIssues
+MISSING = "missing"  # no value for the concept
+MULTIPLE_SHARE_VALUES = "multiple_share_values"
+NON_QUARTER_DURATION = "non_quarter_duration"  # the only value covers more than a quarter
+NO_QUARTER_DURATION = "no_quarter_duration"  # several values, none usable as a quarter
+
+ISSUE_COLUMNS = ["cik", "period", "concept", "kind", "values", "detail"]
+
+
+def saveIssues(
+    issues: list[tuple], path: str = None, replaceCiks: list[str] = None
+) -> None:
+    """
+    Writes concept issues as a CSV file with one row per (cik, period, concept, kind).
+
+    Parameters:
+        issues: list[tuple] - rows in ISSUE_COLUMNS order.
+
+        replaceCiks: list[str] - if given, only these CIKs' issues are replaced and those of
+        every other CIK already in the file are kept, as after an incremental load.
+    """
+    path = path or config.ISSUES_PATH_FINANCIALS
+    if replaceCiks is not None:
+        replaced = set(replaceCiks)
+        issues = [row for row in loadIssues(path) if row[0] not in replaced] + issues
+        issues.sort(key=lambda row: row[0])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(ISSUE_COLUMNS)
+        writer.writerows(issues)
+    os.replace(tmpPath, path)
+
+
+def loadIssues(path: str = None) -> list[tuple]:
+    path = path or config.ISSUES_PATH_FINANCIALS
+    try:
+        with open(path, "r", newline="") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            return [
+                (cik, period, concept, kind, int(values), detail)
+                for cik, period, concept, kind, values, detail in reader
+            ]
+    except FileNotFoundError:
+        return []
+
+
+def extractIssueCiks(
+    logger, ciks: list[str] = None, path: str = None
+) -> int:
+    """
+    Writes the raw companyfacts JSON of CIKs with issues to config.PROBLEM_CIK_DIR for manual
+    inspection. Meant to be run on its own after a load, not as part of one.
+
+    Parameters:
+        ciks: list[str] - CIKs to extract. Defaults to every CIK in the issues file.
+
+    Returns:
+        int: number of CIKs extracted.
+    """
+    if ciks is None:
+        ciks = sorted({row[0] for row in loadIssues(path)})
+    os.makedirs(config.PROBLEM_CIK_DIR, exist_ok=True)
+    extracted = 0
+    with CompanyFactsArchive(config.ZIP_PATH) as archive:
+        for cik in ciks:
+            try:
+                content = archive.read(cik)
+            except KeyError:
+                utils.logCik(logger.debug, cik, "not found in archive")
+                continue
+            data = json.loads(content.decode("utf-8"))
+            with open(os.path.join(config.PROBLEM_CIK_DIR, f"CIK{cik}.json"), "w") as outFile:
+                json.dump(data, outFile, indent=2)
+            extracted += 1
+    logger.info(f"Extracted {extracted} CIKs with issues to {config.PROBLEM_CIK_DIR}")
+    return extracted
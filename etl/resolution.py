@@ -0,0 +1,124 @@
+from collections import defaultdict
+import concepts
+
+
+def priorityKey(filingFiscalYear: int | None, weight: int) -> tuple[int, int]:
+    """
+    Ranks competing values of the same concept and duration: a later filing fiscal year wins,
+    then a higher alias weight. Values without a filing fiscal year rank below all others.
+    """
+    return (filingFiscalYear or 0, weight)
+
+
+def outranks(newKey: tuple[int, int], existingKey: tuple[int, int]) -> bool:
+    """
+    Returns True if a value with newKey should replace one with existingKey. Ties go to the new
+    value. A new value without a filing fiscal year never replaces anything.
+    """
+    return newKey[0] > 0 and newKey >= existingKey
+
+
+class ConceptSlots:
+    """
+    The resolved values of one concept in one period: at most one winning value per duration,
+    each with its precomputed priority key, indexed by duration.
+    """
+
+    __slots__ = ("values", "keys", "durationToIndices")
+
+    def __init__(self, values: list):
+        """
+        Parameters:
+            values: list[FinancialValue] - list to resolve into, e.g. one of
+            FinancialPeriod.conceptToFinancialValues. May already hold values.
+        """
+        self.values: list = values
+        self.keys: list[tuple[int, int]] = [
+            priorityKey(v.filingFiscalYear, v.alias.weight) for v in values
+        ]
+        self.durationToIndices: dict[concepts.Duration | None, list[int]] = defaultdict(list)
+        self.reindex()
+
+    def reindex(self) -> None:
+        self.durationToIndices.clear()
+        for i, v in enumerate(self.values):
+            self.durationToIndices[v.duration].append(i)
+
+    def has(self, duration: concepts.Duration | None) -> bool:
+        return bool(self.durationToIndices.get(duration))
+
+    def first(self, duration: concepts.Duration | None):
+        """
+        Returns the first value with the given duration, or None.
+        """
+        indices = self.durationToIndices.get(duration)
+        return self.values[indices[0]] if indices else None
+
+    def append(self, value) -> None:
+        self.values.append(value)
+        self.keys.append(priorityKey(value.filingFiscalYear, value.alias.weight))
+        self.durationToIndices[value.duration].append(len(self.values) - 1)
+
+    def offer(self, value) -> None:
+        """
+        Determines whether and how a FinancialValue should be added, then does it.
+
+        The new value can be appended, skipped, or replace an existing value.
+        """
+        values = self.values
+        # If there are no values yet, add it
+        if not values:
+            self.append(value)
+            return
+
+        # For shares, just take the higher value
+        if value.units == "shares":
+            if value.value >= values[0].value:
+                values[0] = value
+                self.keys[0] = priorityKey(value.filingFiscalYear, value.alias.weight)
+                self.reindex()
+            return
+
+        # If the duration doesn't exist, add it
+        indices = self.durationToIndices.get(value.duration)
+        if not indices:
+            self.append(value)
+            return
+
+        # Replace the first value of the same duration that it outranks
+        key = priorityKey(value.filingFiscalYear, value.alias.weight)
+        for i in indices:
+            if outranks(key, self.keys[i]):
+                values[i] = value
+                self.keys[i] = key
+                return
+
+
+class ResolutionTable:
+    """
+    ConceptSlots for each (FinancialPeriod, concept) of one company, resolving into the periods'
+    conceptToFinancialValues lists.
+    """
+
+    def __init__(self):
+        self.slots: dict[tuple, ConceptSlots] = {}
+
+    @classmethod
+    def fromFinancialPeriods(cls, fps: list) -> "ResolutionTable":
+        """
+        Builds a table over FinancialPeriods that already hold resolved values.
+        """
+        table = cls()
+        for fp in fps:
+            for concept, fvs in fp.conceptToFinancialValues.items():
+                table.slots[(fp, concept)] = ConceptSlots(fvs)
+        return table
+
+    def get(self, fp, concept: str) -> ConceptSlots | None:
+        return self.slots.get((fp, concept))
+
+    def offer(self, fp, concept: str, value) -> None:
+        slots = self.slots.get((fp, concept))
+        if slots is None:
+            slots = self.slots[(fp, concept)] = ConceptSlots(fp.conceptToFinancialValues[concept])
+        slots.offer(value)
@@ -0,0 +1,184 @@
+import argparse
+import concepts
+import config
+import postgres_utils
+import supabase_utils
+
+
+class SchemaError(Exception):
+    """
+    Raised when tables the ETL writes through the REST API are missing or lack columns. The API
+    cannot create them, so config.SCHEMA_PATH has to be applied to the database first.
+    """
+
+
+class Table:
+    """
+    A table the ETL writes, with its columns, key and secondary indexes. Through Postgres the
+    table is created or altered to match before a load; through the REST API it is only checked.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        columnTypes: list[tuple[str, str]],
+        key: list[str],
+        indexes: list[list[str]] = (),
+        keyNullable: bool = False,
+    ):
+        """
+        Parameters:
+            columnTypes: list[tuple[str, str]] - (column name, SQL type) pairs.
+
+            indexes: list[list[str]] - columns of each secondary index.
+
+            keyNullable: bool - the key columns can be NULL, so the key is a unique constraint
+            with NULLS NOT DISTINCT instead of a primary key.
+        """
+        self.name: str = name
+        self.columnTypes: list[tuple[str, str]] = columnTypes
+        self.key: list[str] = key
+        self.indexes: list[list[str]] = list(indexes)
+        self.keyNullable: bool = keyNullable
+
+    @property
+    def columns(self) -> list[str]:
+        return [name for name, _ in self.columnTypes]
+
+    def toSql(self) -> str:
+        """
+        Returns:
+            str - statements that create the table, or bring an existing one up to date: add the
+            columns it lacks (e.g. those of newly added concepts), its key constraint, which
+            upserts on the key need, and its indexes. They can be run any number of times.
+        """
+        name = quote(self.name)
+        keySql = "{} ({})".format(
+            "unique nulls not distinct" if self.keyNullable else "primary key",
+            ", ".join(map(quote, self.key)),
+        )
+        columnsSql = "".join(f"    {quote(c)} {type_},\n" for c, type_ in self.columnTypes)
+        statements = [f"create table if not exists {name} (\n{columnsSql}    {keySql}\n);"]
+        statements += [
+            f"alter table {name} add column if not exists {quote(c)} {type_};"
+            for c, type_ in self.columnTypes
+        ]
+        keyColumns = ", ".join(f"'{c}'" for c in sorted(self.key))
+        statements.append(
+            "do $$\n"
+            "begin\n"
+            "    if not exists (\n"
+            "        select from pg_constraint c\n"
+            f"        where c.conrelid = '{name}'::regclass and c.contype in ('p', 'u')\n"
+            "        and array(\n"
+            "            select a.attname::text collate \"C\" from pg_attribute a\n"
+            "            where a.attrelid = c.conrelid and a.attnum = any(c.conkey) order by 1\n"
+            f"        ) = array[{keyColumns}]\n"
+            "    ) then\n"
+            f"        alter table {name} add constraint {quote(self.name + '_key')} {keySql};\n"
+            "    end if;\n"
+            "end\n"
+            "$$;"
+        )
+        statements += [
+            "create index if not exists {} on {} ({});".format(
+                quote(f"{self.name}_{'_'.join(columns)}_idx".lower()),
+                name,
+                ", ".join(map(quote, columns)),
+            )
+            for columns in self.indexes
+        ]
+        return "\n".join(statements)
+
+
+# duration is NULL for instants and shares, so the key cannot be a primary key
+FINANCIALS = Table(
+    "financials",
+    [
+        ("cik", "text"),
+        ("year", "integer"),
+        ("period", "text"),
+        ("duration", "text"),
+        ("concept", "text"),
+        ("value", "double precision"),
+    ],
+    ["cik", "year", "period", "duration", "concept"],
+    keyNullable=True,
+)
+# Wide pivot of the values screens read: one row per (cik, year), one column per concept
+FINANCIALS_ANNUAL = Table(
+    "financials_annual",
+    [("cik", "text"), ("year", "integer")]
+    + [(c.name, "double precision") for c in concepts.Concept],
+    ["cik", "year"],
+    [["year"]],
+)
+DATA_VERSION = Table("data_version", [("id", "integer"), ("version", "bigint")], ["id"])
+SCREEN_CACHE = Table(
+    "screen_cache",
+    [("cache_key", "text"), ("data_version", "bigint"), ("results", "jsonb")],
+    ["cache_key"],
+)
+YEAR_END_CLOSES = Table(
+    "year_end_closes",
+    [
+        ("cik", "text"),
+        ("ticker", "text"),
+        ("year", "integer"),
+        ("close_date", "date"),
+        ("close", "double precision"),
+    ],
+    ["ticker", "year"],
+    [["cik", "year"]],
+)
+TABLES = [FINANCIALS, FINANCIALS_ANNUAL, DATA_VERSION, SCREEN_CACHE, YEAR_END_CLOSES]
+
+
+def quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def toSql(tables: list[Table] = None) -> str:
+    tables = TABLES if tables is None else tables
+    return "\n\n".join(table.toSql() for table in tables) + "\n"
+
+
+def prepareTables(tables: list[Table], logger) -> None:
+    """
+    Makes sure the tables exist with all their columns before anything is loaded into them.
+    Through Postgres they are created or brought up to date; the REST API cannot run DDL, so
+    there they are only checked.
+
+    Raises:
+        SchemaError: through the REST API, listing every table that is missing or lacks columns.
+    """
+    if postgres_utils.isAvailable():
+        postgres_utils.executeScript(toSql(tables))
+        return
+    problems = []
+    for table in tables:
+        problem = supabase_utils.checkColumns(table.name, table.columns)
+        if problem:
+            problems.append(f"{table.name}: {problem}")
+    if problems:
+        raise SchemaError(
+            "\n".join(problems)
+            + f"\nApply {config.SCHEMA_PATH} to the database (python schema.py writes it)"
+        )
+    logger.info(f"Tables {', '.join(table.name for table in tables)} are in place")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write the SQL that creates or updates the tables the ETL writes. Through "
+        "the REST API, apply it to the database after changing concepts.json."
+    )
+    parser.add_argument("--out", default=config.SCHEMA_PATH)
+    args = parser.parse_args()
+    with open(args.out, "w") as f:
+        f.write(
+            "-- Tables the ETL writes. Generated by python schema.py from its table definitions"
+            " and concepts.json; safe to run again.\n\n"
+        )
+        f.write(toSql())
+    print(f"Wrote {args.out}")
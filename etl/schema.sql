@@ -0,0 +1,175 @@
+-- Tables the ETL writes. Generated by python schema.py from its table definitions and concepts.json; safe to run again.
+
+create table if not exists "financials" (
+    "cik" text,
+    "year" integer,
+    "period" text,
+    "duration" text,
+    "concept" text,
+    "value" double precision,
+    unique nulls not distinct ("cik", "year", "period", "duration", "concept")
+);
+alter table "financials" add column if not exists "cik" text;
+alter table "financials" add column if not exists "year" integer;
+alter table "financials" add column if not exists "period" text;
+alter table "financials" add column if not exists "duration" text;
+alter table "financials" add column if not exists "concept" text;
+alter table "financials" add column if not exists "value" double precision;
+do $$
+begin
+    if not exists (
+        select from pg_constraint c
+        where c.conrelid = '"financials"'::regclass and c.contype in ('p', 'u')
+        and array(
+            select a.attname::text collate "C" from pg_attribute a
+            where a.attrelid = c.conrelid and a.attnum = any(c.conkey) order by 1
+        ) = array['cik', 'concept', 'duration', 'period', 'year']
+    ) then
+        alter table "financials" add constraint "financials_key" unique nulls not distinct ("cik", "year", "period", "duration", "concept");
+    end if;
+end
+$$;
+
+create table if not exists "financials_annual" (
+    "cik" text,
+    "year" integer,
+    "SharesOutstanding" double precision,
+    "CashAndCashEquivalents" double precision,
+    "Assets" double precision,
+    "ShortTermDebt" double precision,
+    "LongTermDebt" double precision,
+    "Equity" double precision,
+    "Revenue" double precision,
+    "NetIncome" double precision,
+    "CashFlowFromOperatingActivities" double precision,
+    "CashFlowFromInvestingActivities" double precision,
+    "CashFlowFromFinancingActivities" double precision,
+    "CapitalExpenditures" double precision,
+    "Dividends" double precision,
+    "FreeCashFlow" double precision,
+    "RevenueTTM" double precision,
+    "NetIncomeTTM" double precision,
+    "FreeCashFlowTTM" double precision,
+    "RevenueGrowth" double precision,
+    "NetIncomeGrowth" double precision,
+    "RevenuePerShare" double precision,
+    "EarningsPerShare" double precision,
+    "FreeCashFlowPerShare" double precision,
+    "BookValuePerShare" double precision,
+    primary key ("cik", "year")
+);
+alter table "financials_annual" add column if not exists "cik" text;
+alter table "financials_annual" add column if not exists "year" integer;
+alter table "financials_annual" add column if not exists "SharesOutstanding" double precision;
+alter table "financials_annual" add column if not exists "CashAndCashEquivalents" double precision;
+alter table "financials_annual" add column if not exists "Assets" double precision;
+alter table "financials_annual" add column if not exists "ShortTermDebt" double precision;
+alter table "financials_annual" add column if not exists "LongTermDebt" double precision;
+alter table "financials_annual" add column if not exists "Equity" double precision;
+alter table "financials_annual" add column if not exists "Revenue" double precision;
+alter table "financials_annual" add column if not exists "NetIncome" double precision;
+alter table "financials_annual" add column if not exists "CashFlowFromOperatingActivities" double precision;
+alter table "financials_annual" add column if not exists "CashFlowFromInvestingActivities" double precision;
+alter table "financials_annual" add column if not exists "CashFlowFromFinancingActivities" double precision;
+alter table "financials_annual" add column if not exists "CapitalExpenditures" double precision;
+alter table "financials_annual" add column if not exists "Dividends" double precision;
+alter table "financials_annual" add column if not exists "FreeCashFlow" double precision;
+alter table "financials_annual" add column if not exists "RevenueTTM" double precision;
+alter table "financials_annual" add column if not exists "NetIncomeTTM" double precision;
+alter table "financials_annual" add column if not exists "FreeCashFlowTTM" double precision;
+alter table "financials_annual" add column if not exists "RevenueGrowth" double precision;
+alter table "financials_annual" add column if not exists "NetIncomeGrowth" double precision;
+alter table "financials_annual" add column if not exists "RevenuePerShare" double precision;
+alter table "financials_annual" add column if not exists "EarningsPerShare" double precision;
+alter table "financials_annual" add column if not exists "FreeCashFlowPerShare" double precision;
+alter table "financials_annual" add column if not exists "BookValuePerShare" double precision;
+do $$
+begin
+    if not exists (
+        select from pg_constraint c
+        where c.conrelid = '"financials_annual"'::regclass and c.contype in ('p', 'u')
+        and array(
+            select a.attname::text collate "C" from pg_attribute a
+            where a.attrelid = c.conrelid and a.attnum = any(c.conkey) order by 1
+        ) = array['cik', 'year']
+    ) then
+        alter table "financials_annual" add constraint "financials_annual_key" primary key ("cik", "year");
+    end if;
+end
+$$;
+create index if not exists "financials_annual_year_idx" on "financials_annual" ("year");
+
+create table if not exists "data_version" (
+    "id" integer,
+    "version" bigint,
+    primary key ("id")
+);
+alter table "data_version" add column if not exists "id" integer;
+alter table "data_version" add column if not exists "version" bigint;
+do $$
+begin
+    if not exists (
+        select from pg_constraint c
+        where c.conrelid = '"data_version"'::regclass and c.contype in ('p', 'u')
+        and array(
+            select a.attname::text collate "C" from pg_attribute a
+            where a.attrelid = c.conrelid and a.attnum = any(c.conkey) order by 1
+        ) = array['id']
+    ) then
+        alter table "data_version" add constraint "data_version_key" primary key ("id");
+    end if;
+end
+$$;
+
+create table if not exists "screen_cache" (
+    "cache_key" text,
+    "data_version" bigint,
+    "results" jsonb,
+    primary key ("cache_key")
+);
+alter table "screen_cache" add column if not exists "cache_key" text;
+alter table "screen_cache" add column if not exists "data_version" bigint;
+alter table "screen_cache" add column if not exists "results" jsonb;
+do $$
+begin
+    if not exists (
+        select from pg_constraint c
+        where c.conrelid = '"screen_cache"'::regclass and c.contype in ('p', 'u')
+        and array(
+            select a.attname::text collate "C" from pg_attribute a
+            where a.attrelid = c.conrelid and a.attnum = any(c.conkey) order by 1
+        ) = array['cache_key']
+    ) then
+        alter table "screen_cache" add constraint "screen_cache_key" primary key ("cache_key");
+    end if;
+end
+$$;
+
+create table if not exists "year_end_closes" (
+    "cik" text,
+    "ticker" text,
+    "year" integer,
+    "close_date" date,
+    "close" double precision,
+    primary key ("ticker", "year")
+);
+alter table "year_end_closes" add column if not exists "cik" text;
+alter table "year_end_closes" add column if not exists "ticker" text;
+alter table "year_end_closes" add column if not exists "year" integer;
+alter table "year_end_closes" add column if not exists "close_date" date;
+alter table "year_end_closes" add column if not exists "close" double precision;
+do $$
+begin
+    if not exists (
+        select from pg_constraint c
+        where c.conrelid = '"year_end_closes"'::regclass and c.contype in ('p', 'u')
+        and array(
+            select a.attname::text collate "C" from pg_attribute a
+            where a.attrelid = c.conrelid and a.attnum = any(c.conkey) order by 1
+        ) = array['ticker', 'year']
+    ) then
+        alter table "year_end_closes" add constraint "year_end_closes_key" primary key ("ticker", "year");
+    end if;
+end
+$$;
+create index if not exists "year_end_closes_cik_year_idx" on "year_end_closes" ("cik", "year");
@@ -0,0 +1,451 @@
+import argparse
+import re
+from datetime import date, timedelta
+import numpy as np
+import concepts
+import snapshot
+
+MARKET_CAP = "[Market Cap]"
+SHARES_OUTSTANDING = concepts.Concept.SharesOutstanding.name
+TOKEN = re.compile(r"\[[^\]]+\]")
+LEXEME = re.compile(r"\s*(?:(\[[^\]]+\])|(\d+(?:\.\d*)?|\.\d+)|([-+*/()]))")
+COMPARISON = re.compile(r"(.+)(<|>)(.+)")
+
+
+class FormulaCube:
+    """
+    Dense company x year x concept cube of annual values, the data a screen reads.
+
+    Each row is one row of the companies table; a CIK with several tickers fills several rows,
+    like the join in the SQL path. Cells hold what financials_annual holds: the Q4 value with
+    duration Year, else the one with no duration, NaN where there is neither.
+    """
+
+    def __init__(
+        self,
+        tickers: list[str],
+        companyNames: list[str],
+        close: np.ndarray,
+        years: np.ndarray,
+        values: np.ndarray,
+    ):
+        self.tickers: list[str] = tickers
+        self.companyNames: list[str] = companyNames
+        self.close: np.ndarray = close  # float64, NaN where there is no price
+        self.years: np.ndarray = years
+        self.yearToIndex: dict[int, int] = {int(y): i for i, y in enumerate(years)}
+        self.conceptToIndex: dict[str, int] = {c.name: i for i, c in enumerate(concepts.Concept)}
+        self.values: np.ndarray = values  # float64, (companies, years, concepts)
+
+    def __len__(self) -> int:
+        return len(self.tickers)
+
+    def column(self, year: int, concept: str) -> np.ndarray:
+        """
+        Returns the values of one concept in one year for every company, all NaN if the cube
+        has no such year or concept.
+        """
+        y = self.yearToIndex.get(year)
+        c = self.conceptToIndex.get(concept)
+        if y is None or c is None:
+            return np.full(len(self), np.nan)
+        return self.values[:, y, c]
+
+    def hasYear(self, year: int) -> np.ndarray:
+        """
+        Returns whether each company has any value in a year, i.e. a financials_annual row.
+        """
+        y = self.yearToIndex.get(year)
+        if y is None:
+            return np.zeros(len(self), dtype=bool)
+        return ~np.isnan(self.values[:, y]).all(axis=1)
+
+    @classmethod
+    def fromArrays(
+        cls,
+        ciks: np.ndarray,
+        years: np.ndarray,
+        conceptNames: np.ndarray,
+        isYear: np.ndarray,
+        values: np.ndarray,
+        companies: list[dict],
+    ) -> "FormulaCube":
+        """
+        Parameters:
+            ciks, years, conceptNames, values: np.ndarray - one element per Q4 financials row
+            with duration Year or no duration.
+
+            isYear: np.ndarray[bool] - True where the row's duration is Year.
+
+            companies: list[dict] - companies rows with cik, ticker, company and close.
+        """
+        cikValues, cikIndex = np.unique(np.asarray(ciks, dtype=str), return_inverse=True)
+        yearValues, yearIndex = np.unique(np.asarray(years, dtype=np.int64), return_inverse=True)
+        conceptToIndex = {c.name: i for i, c in enumerate(concepts.Concept)}
+        conceptIndex = np.array(
+            [conceptToIndex.get(c, -1) for c in conceptNames.tolist()], dtype=np.int64
+        )
+        # Rows without a duration first, then one row per cell, the last: the Year one if the
+        # cell has both. Assigning to repeated indices would leave any one of the values.
+        order = np.flatnonzero(conceptIndex >= 0)
+        order = order[np.argsort(isYear[order], kind="stable")]
+        cells = (cikIndex[order] * len(yearValues) + yearIndex[order]) * len(conceptToIndex)
+        cells += conceptIndex[order]
+        _, lastFromEnd = np.unique(cells[::-1], return_index=True)
+        order = order[len(order) - 1 - lastFromEnd]
+        cikCube = np.full((len(cikValues) + 1, len(yearValues), len(conceptToIndex)), np.nan)
+        cikCube[cikIndex[order], yearIndex[order], conceptIndex[order]] = np.asarray(
+            values, dtype=np.float64
+        )[order]
+
+        cikToIndex = {cik: i for i, cik in enumerate(cikValues.tolist())}
+        # Companies without financials point at the last, all-NaN, slice
+        companyCik = np.array(
+            [cikToIndex.get(c["cik"], len(cikValues)) for c in companies], dtype=np.int64
+        )
+        return cls(
+            [c["ticker"] for c in companies],
+            [c["company"] for c in companies],
+            np.array(
+                [np.nan if c["close"] is None else c["close"] for c in companies],
+                dtype=np.float64,
+            ),
+            yearValues,
+            cikCube[companyCik],
+        )
+
+    @classmethod
+    def fromRows(cls, financials: list[dict], companies: list[dict]) -> "FormulaCube":
+        """
+        Builds a cube from financials and companies rows as stored in the database.
+        """
+        rows = [
+            r
+            for r in financials
+            if r["period"] == "Q4" and r["duration"] in (concepts.Duration.Year.name, None)
+        ]
+        return cls.fromArrays(
+            np.array([r["cik"] for r in rows], dtype=str),
+            np.array([r["year"] for r in rows], dtype=np.int64),
+            np.array([r["concept"] for r in rows], dtype=object),
+            np.array([r["duration"] is not None for r in rows], dtype=bool),
+            np.array([r["value"] for r in rows], dtype=np.float64),
+            companies,
+        )
+
+    @classmethod
+    def fromSnapshot(cls) -> "FormulaCube":
+        """
+        Builds a cube from the columnar snapshot written by the ETL.
+        """
+        import pyarrow.compute as pc
+
+        table = snapshot.readFinancials()
+        companies = snapshot.readCompanies()
+        if table is None or companies is None:
+            raise FileNotFoundError("No financials or companies snapshot")
+        duration = table["duration"].cast("string")
+        table = table.filter(
+            pc.and_(
+                pc.equal(table["period"].cast("string"), "Q4"),
+                pc.or_kleene(
+                    pc.equal(duration, concepts.Duration.Year.name), pc.is_null(duration)
+                ),
+            )
+        )
+        return cls.fromArrays(
+            table["cik"].to_numpy(zero_copy_only=False).astype(str),
+            table["year"].to_numpy(),
+            table["concept"].cast("string").to_numpy(zero_copy_only=False),
+            pc.is_valid(table["duration"]).to_numpy(zero_copy_only=False),
+            table["value"].to_numpy(),
+            companies.to_pylist(),
+        )
+
+
+class Screen:
+    """
+    A formula compiled for evaluation over a FormulaCube.
+
+    Follows getSqlQuery in the web app, which reads financials_annual: each side of the single
+    < or > is an arithmetic expression of numbers and [YEAR Concept] or [Market Cap] tokens, and
+    a company passes if it has every token's value and the comparison holds. Division of two
+    integer constants truncates and division by zero is an error, as in Postgres.
+    """
+
+    def __init__(self, formula: str, mostRecentYear: int):
+        formula = formula.replace("\u00a0", " ")
+        match = COMPARISON.search(formula)
+        if not match:
+            raise ValueError("The formula must be an inequality and include one of < or >")
+        left, self.operator, right = (s.strip() for s in match.groups())
+        self.mostRecentYear: int = mostRecentYear
+        self.tokens: list[str] = list(dict.fromkeys(TOKEN.findall(formula)))
+        self.left = Parser(left).parse()
+        self.right = Parser(right).parse()
+
+    @property
+    def canonical(self) -> str:
+        """
+        The formula with token spelling, spacing and the order of sums and products normalized,
+        the same as canonicalFormula in the web app.
+        """
+        return self.left.canonical() + self.operator + self.right.canonical()
+
+    def join(self, cube: FormulaCube) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+        """
+        Does what the SQL path's joins do: keeps the companies with a financials_annual row for
+        every year the formula uses. Their missing values stay NaN, as NULLs would.
+
+        Returns:
+            tuple[np.ndarray, dict[str, np.ndarray]] - index of each kept company, and each
+            token's value for each kept company.
+        """
+        present = np.ones(len(cube), dtype=bool)
+        columns = {}
+        for token in self.tokens:
+            if token == MARKET_CAP:
+                year = self.mostRecentYear
+                columns[token] = cube.close * cube.column(year, SHARES_OUTSTANDING)
+            else:
+                year, concept = parseToken(token)
+                columns[token] = cube.column(year, concept)
+            present &= cube.hasYear(year)
+        rows = np.flatnonzero(present)
+        return rows, {token: column[rows] for token, column in columns.items()}
+
+    def evaluate(self, cube: FormulaCube, limit: int = 0) -> list[dict]:
+        """
+        Returns:
+            list[dict] - ticker, company, leftside and rightside of each passing company, in
+            cube order.
+        """
+        rows, columns = self.join(cube)
+        if limit > 0:
+            rows = rows[:limit]
+            columns = {token: column[:limit] for token, column in columns.items()}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            left = np.broadcast_to(self.left.evaluate(columns)[0], rows.shape)
+            right = np.broadcast_to(self.right.evaluate(columns)[0], rows.shape)
+            passes = left < right if self.operator == "<" else left > right
+        return [
+            {
+                "ticker": cube.tickers[i],
+                "company": cube.companyNames[i],
+                "leftside": float(left[j]),
+                "rightside": float(right[j]),
+            }
+            for j, i in zip(np.flatnonzero(passes).tolist(), rows[passes].tolist())
+        ]
+
+
+class Number:
+    __slots__ = ("text", "value", "isInteger")
+
+    def __init__(self, text: str):
+        self.text: str = text
+        self.isInteger: bool = "." not in text
+        self.value = int(text) if self.isInteger else float(text)
+
+    def evaluate(self, columns: dict):
+        return self.value, self.isInteger
+
+    def canonical(self) -> str:
+        return self.text
+
+
+class Column:
+    __slots__ = ("token",)
+
+    def __init__(self, token: str):
+        self.token: str = token
+
+    def evaluate(self, columns: dict):
+        return columns[self.token], False
+
+    def canonical(self) -> str:
+        if self.token == MARKET_CAP:
+            return MARKET_CAP
+        year = self.token.strip("[]").split(" ")[0]
+        return f"[{year} {parseToken(self.token)[1]}]"
+
+
+class Negate:
+    __slots__ = ("operand",)
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def evaluate(self, columns: dict):
+        value, isInteger = self.operand.evaluate(columns)
+        return -value, isInteger
+
+    def canonical(self) -> str:
+        return f"(-{self.operand.canonical()})"
+
+
+class BinaryOp:
+    __slots__ = ("operator", "left", "right")
+
+    def __init__(self, operator: str, left, right):
+        self.operator: str = operator
+        self.left = left
+        self.right = right
+
+    def evaluate(self, columns: dict):
+        left, leftIsInteger = self.left.evaluate(columns)
+        right, rightIsInteger = self.right.evaluate(columns)
+        isInteger = leftIsInteger and rightIsInteger
+        if self.operator == "+":
+            return left + right, isInteger
+        if self.operator == "-":
+            return left - right, isInteger
+        if self.operator == "*":
+            return left * right, isInteger
+        # Postgres raises on division by zero for any row it evaluates, NULLs aside
+        if np.any((np.asarray(right) == 0) & ~np.isnan(np.asarray(left, dtype=np.float64))):
+            raise ZeroDivisionError("division by zero")
+        if isInteger:
+            quotient = abs(left) // abs(right)
+            return (quotient if (left < 0) == (right < 0) else -quotient), True
+        return left / right, False
+
+    def canonical(self) -> str:
+        """
+        Returns a string that is the same for expressions that differ only in the order of the
+        terms of a sum or the factors of a product.
+        """
+        if self.operator in ("+", "-"):
+            return "(" + "".join(sorted(sumTerms(self, "+"))) + ")"
+        if self.operator == "*":
+            return "(" + "*".join(sorted(productFactors(self))) + ")"
+        return f"({self.left.canonical()}/{self.right.canonical()})"
+
+
+def sumTerms(node, sign: str) -> list[str]:
+    """
+    Returns the signed canonical terms of a sum, looking through nested sums, differences and
+    negations.
+    """
+    flipped = "-" if sign == "+" else "+"
+    if isinstance(node, Negate):
+        return sumTerms(node.operand, flipped)
+    if not isinstance(node, BinaryOp) or node.operator not in ("+", "-"):
+        return [sign + node.canonical()]
+    return sumTerms(node.left, sign) + sumTerms(
+        node.right, sign if node.operator == "+" else flipped
+    )
+
+
+def productFactors(node) -> list[str]:
+    if not isinstance(node, BinaryOp) or node.operator != "*":
+        return [node.canonical()]
+    return productFactors(node.left) + productFactors(node.right)
+
+
+class Parser:
+    """
+    Recursive descent parser for one side of a formula: + - * / with the usual precedence,
+    unary minus, parentheses, numbers and bracketed tokens.
+    """
+
+    def __init__(self, text: str):
+        self.lexemes: list[tuple[str, str]] = lex(text)
+        self.pos: int = 0
+
+    def parse(self):
+        node = self.expression()
+        if self.pos != len(self.lexemes):
+            raise ValueError(f"Unexpected {self.lexemes[self.pos][1]!r} in formula")
+        return node
+
+    def peek(self) -> str | None:
+        return self.lexemes[self.pos][1] if self.pos < len(self.lexemes) else None
+
+    def expression(self):
+        node = self.term()
+        while self.peek() in ("+", "-"):
+            operator = self.lexemes[self.pos][1]
+            self.pos += 1
+            node = BinaryOp(operator, node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek() in ("*", "/"):
+            operator = self.lexemes[self.pos][1]
+            self.pos += 1
+            node = BinaryOp(operator, node, self.factor())
+        return node
+
+    def factor(self):
+        if self.pos >= len(self.lexemes):
+            raise ValueError("Unexpected end of formula")
+        kind, text = self.lexemes[self.pos]
+        self.pos += 1
+        if kind == "token":
+            return Column(text)
+        if kind == "number":
+            return Number(text)
+        if text == "-":
+            return Negate(self.factor())
+        if text == "+":
+            return self.factor()
+        if text == "(":
+            node = self.expression()
+            if self.peek() != ")":
+                raise ValueError("Missing ) in formula")
+            self.pos += 1
+            return node
+        raise ValueError(f"Unexpected {text!r} in formula")
+
+
+def lex(text: str) -> list[tuple[str, str]]:
+    lexemes = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = LEXEME.match(text, pos)
+        if not m:
+            raise ValueError(f"Unexpected character {text[pos]!r} in formula")
+        token, number, operator = m.groups()
+        if token:
+            lexemes.append(("token", token))
+        elif number:
+            lexemes.append(("number", number))
+        else:
+            lexemes.append(("operator", operator))
+        pos = m.end()
+    return lexemes
+
+
+def parseToken(token: str) -> tuple[int, str]:
+    """
+    Returns the year and concept name of a [YEAR Concept] token, e.g. [2023 Net Income] ->
+    (2023, "NetIncome"), named the way getSqlQuery names them.
+    """
+    words = token.strip("[]").split(" ")
+    concept = "".join(w[:1].upper() + w[1:] for w in words[1:])
+    try:
+        return int(words[0]), concept
+    except ValueError:
+        raise ValueError(f"Invalid year in {token}")
+
+
+def getMostRecentYear(today: date = None) -> int:
+    """
+    Returns the most recent year that all companies have reported for.
+    """
+    today = today or date.today()
+    return (today - timedelta(days=90)).year - 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Screen companies with a formula")
+    parser.add_argument("formula", help='e.g. "[2023 Net Income] > [2022 Net Income]"')
+    parser.add_argument("--year", type=int, default=None, help="year used for [Market Cap]")
+    args = parser.parse_args()
+    cube = FormulaCube.fromSnapshot()
+    screen = Screen(args.formula, args.year or getMostRecentYear())
+    for row in screen.evaluate(cube):
+        print(f"{row['ticker']}\t{row['company']}\t{row['leftside']}\t{row['rightside']}")
@@ -0,0 +1,121 @@
+import json
+import time
+import postgres_utils
+import schema
+import snapshot
+import supabase_utils
+from screen import FormulaCube, Screen, getMostRecentYear
+
+DATA_VERSION_TABLE = schema.DATA_VERSION.name
+SCREEN_CACHE_TABLE = schema.SCREEN_CACHE.name
+SCREEN_CACHE_COLUMNS = schema.SCREEN_CACHE.columns
+DATA_VERSION_ID = 1  # data_version holds a single row
+
+
+def refresh(logger, warm: bool = True) -> int | None:
+    """
+    Marks the screened data as changed after a successful load: precomputes the results of every
+    saved formula under a new data version, then publishes that version. The web app's result
+    cache keys on the version, so its stale entries stop matching, and its first lookup of a
+    saved formula finds the precomputed results.
+
+    Results are computed from the columnar snapshot; without one the version is still bumped.
+
+    Parameters:
+        warm: bool - False if the snapshot was not written by this load, so it holds older data
+        than the tables. The cache is then cleared instead of precomputed from it.
+
+    Returns:
+        int | None: the new data version, or None if it could not be published.
+    """
+    version = time.time_ns() // 1_000_000
+    cube = None
+    if warm:
+        try:
+            cube = FormulaCube.fromSnapshot() if snapshot.isAvailable() else None
+        except FileNotFoundError:
+            pass
+    if cube is None:
+        logger.info("No current snapshot to precompute screens from, only bumping the version")
+        try:
+            clearScreenCache(logger)
+        except Exception as e:
+            # Entries of older versions are not served anyway
+            logger.error(f"Error clearing the screen cache: {e}")
+    else:
+        try:
+            warmScreenCache(cube, version, logger)
+        except Exception as e:
+            # The web app computes uncached screens itself, so the new version is still published
+            logger.error(f"Error precomputing saved screens: {e}")
+    try:
+        setDataVersion(version)
+    except Exception as e:
+        logger.error(f"Error setting data version: {e}")
+        return None
+    logger.info(f"Data version is now {version}")
+    return version
+
+
+def cacheKey(canonicalFormula: str, mostRecentYear: int) -> str:
+    """
+    Same as screenCacheKey in the web app. The year is part of the key because [Market Cap]
+    depends on it.
+    """
+    return f"{mostRecentYear}|{canonicalFormula}"
+
+
+def warmScreenCache(cube: FormulaCube, version: int, logger) -> int:
+    """
+    Replaces the screen_cache table with the results of each distinct saved formula.
+
+    Returns:
+        int: number of formulas precomputed.
+    """
+    mostRecentYear = getMostRecentYear()
+    keyToResults = {}
+    for formula in fetchFormulas(logger):
+        try:
+            screen = Screen(formula, mostRecentYear)
+            key = cacheKey(screen.canonical, mostRecentYear)
+            if key not in keyToResults:
+                keyToResults[key] = screen.evaluate(cube)
+        except (ValueError, ZeroDivisionError) as e:
+            # The web app reports these itself when the formula is run
+            logger.debug(f"Not precomputing {formula!r}: {e}")
+    rows = [(key, version, json.dumps(results)) for key, results in keyToResults.items()]
+    if postgres_utils.isAvailable():
+        postgres_utils.bulkLoad(SCREEN_CACHE_TABLE, SCREEN_CACHE_COLUMNS, rows, logger)
+    else:
+        supabase_utils.truncateAndInsert(
+            SCREEN_CACHE_TABLE,
+            [
+                {"cache_key": key, "data_version": version, "results": results}
+                for key, results in keyToResults.items()
+            ],
+            logger,
+            onConflict="cache_key",
+        )
+    logger.info(f"Precomputed {len(rows)} saved screens")
+    return len(rows)
+
+
+def clearScreenCache(logger) -> None:
+    if postgres_utils.isAvailable():
+        postgres_utils.truncateIfExists(SCREEN_CACHE_TABLE)
+    else:
+        supabase_utils.truncate(SCREEN_CACHE_TABLE, logger)
+
+
+def fetchFormulas(logger) -> list[str]:
+    if postgres_utils.isAvailable():
+        return postgres_utils.fetchColumn("formulas", "formula")
+    return [r["formula"] for r in supabase_utils.batchFetch("formulas", ["formula"], logger)]
+
+
+def setDataVersion(version: int) -> None:
+    row = {"id": DATA_VERSION_ID, "version": version}
+    if postgres_utils.isAvailable():
+        postgres_utils.upsertRow(DATA_VERSION_TABLE, row, ["id"])
+    else:
+        supabase_utils.supabase.table(DATA_VERSION_TABLE).upsert(row, on_conflict="id").execute()
@@ -0,0 +1,282 @@
+import hashlib
+import json
+import os
+import shutil
+import zlib
+from datetime import datetime
+import numpy as np
+import config
+import concepts
+import fetch
+import quality
+from factstore import FactStore
+from manifest import Manifest
+from snapshot import swapDirectory
+
+SHARD_VERSION = 1
+META_NAME = "shard.json"
+ISSUES_NAME = "issues.csv"
+
+
+class ShardError(Exception):
+    """
+    Raised when shard outputs are missing, damaged or were not built from the same inputs.
+    """
+
+
+def parseShard(spec: str) -> tuple[int, int]:
+    """
+    Parameters:
+        spec: str - "i/N", the i-th of N shards, counting from 0.
+
+    Returns:
+        tuple[int, int] - (i, N).
+
+    Raises:
+        ValueError: if spec is not of that form.
+    """
+    shard, sep, shards = spec.partition("/")
+    if not sep:
+        raise ValueError(f"Expected i/N, got {spec!r}")
+    shard, shards = int(shard), int(shards)
+    if shards < 1:
+        raise ValueError(f"Number of shards must be at least 1, got {shards}")
+    if not 0 <= shard < shards:
+        raise ValueError(f"Shard {shard} is not in 0..{shards - 1}")
+    return shard, shards
+
+
+def shardOf(cik: str, shards: int) -> int:
+    # CRC-32 rather than hash(), which is salted per process
+    return zlib.crc32(cik.encode()) % shards
+
+
+def shardCiks(ciks: list[str], shard: int, shards: int) -> list[str]:
+    """
+    Returns:
+        list[str] - the CIKs of ciks that belong to the shard, in the same order. Every machine
+        splits the same list the same way, and each CIK stays in its shard when others are
+        added or removed.
+    """
+    return [cik for cik in ciks if shardOf(cik, shards) == shard]
+
+
+def ciksChecksum(ciks: list[str]) -> str:
+    return hashlib.sha256("\n".join(sorted(ciks)).encode()).hexdigest()
+
+
+def fileChecksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(config.CHUNK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def archiveIdentity(path: str = None) -> dict:
+    """
+    Returns:
+        dict - what identifies the companyfacts.zip a shard was parsed from across machines: the
+        ETag and Last-Modified of its download, if known, and its size.
+    """
+    path = path or config.ZIP_PATH
+    resource = fetch.loadResource(path + ".meta.json")
+    identity = resource.toDict() if resource else {}
+    identity["size"] = os.path.getsize(path)
+    return identity
+
+
+def shardDirectory(shard: int, shards: int, directory: str = None) -> str:
+    return os.path.join(directory or config.SHARD_DIR, f"{shard}-of-{shards}")
+
+
+class ShardWriter:
+    """
+    Writes the output of one shard of a sharded run from FactStores added one at a time. Each
+    store is saved as a chunk file of its arrays. close adds the shard's concept issues and
+    shard.json, which describes the shard: the inputs it was built from, and the facts, rows and
+    SHA-256 of every file. The shard is built in a temporary directory and swapped in whole, so
+    re-running a shard replaces its previous output.
+    """
+
+    def __init__(self, shard: int, shards: int, directory: str = None):
+        self.shard: int = shard
+        self.shards: int = shards
+        self.directory: str = shardDirectory(shard, shards, directory)
+        self.tmpDir: str = self.directory + ".tmp"
+        self.chunks: list[dict] = []
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+        os.makedirs(self.tmpDir)
+
+    def add(self, store: FactStore) -> None:
+        if len(store) == 0:
+            return
+        name = f"chunk-{len(self.chunks):05d}.npz"
+        path = os.path.join(self.tmpDir, name)
+        np.savez(path, **store.toArrays())
+        self.chunks.append(
+            {
+                "file": name,
+                "ciks": len(store.ciks),
+                "facts": len(store),
+                "sha256": fileChecksum(path),
+            }
+        )
+
+    def close(
+        self, manifest: Manifest, ciks: list[str], allCiks: list[str], issues: list[tuple]
+    ) -> None:
+        """
+        Parameters:
+            manifest: Manifest - fingerprints of the shard's CIKs that are in the archive.
+
+            ciks: list[str] - the shard's CIKs.
+
+            allCiks: list[str] - the CIKs of every shard.
+        """
+        issuesPath = os.path.join(self.tmpDir, ISSUES_NAME)
+        quality.saveIssues(issues, path=issuesPath)
+        meta = {
+            "version": SHARD_VERSION,
+            "shard": self.shard,
+            "shards": self.shards,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "rulesVersion": manifest.rulesVersion,
+            "archive": archiveIdentity(),
+            "allCiks": {"count": len(allCiks), "sha256": ciksChecksum(allCiks)},
+            "ciks": len(ciks),
+            "members": manifest.cikToFingerprint,
+            "facts": sum(chunk["facts"] for chunk in self.chunks),
+            "chunks": self.chunks,
+            "issues": {
+                "file": ISSUES_NAME,
+                "rows": len(issues),
+                "sha256": fileChecksum(issuesPath),
+            },
+        }
+        with open(os.path.join(self.tmpDir, META_NAME), "w") as f:
+            json.dump(meta, f, indent=2)
+        swapDirectory(self.tmpDir, self.directory)
+
+    def abort(self) -> None:
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+
+def loadShards(shards: int, directory: str = None) -> list[dict]:
+    """
+    Checks that the output of each of the shards is present and intact, and that all were built
+    from the same CIK list, archive and concept rules as this ETL, so that together they hold
+    every CIK exactly once. Nothing is loaded; see readChunks.
+
+    Returns:
+        list[dict] - the shards' shard.json, in shard order.
+
+    Raises:
+        ShardError: listing every problem found, so failed shards can be re-run together.
+    """
+    problems = []
+    metas = []
+    for shard in range(shards):
+        path = shardDirectory(shard, shards, directory)
+        try:
+            with open(os.path.join(path, META_NAME), "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            problems.append(f"shard {shard}/{shards}: missing")
+            continue
+        shardProblems = checkShard(meta, path, shard, shards)
+        problems.extend(f"shard {shard}/{shards}: {p}" for p in shardProblems)
+        if not shardProblems:
+            metas.append(meta)
+    if metas:
+        first = metas[0]
+        if first["rulesVersion"] != concepts.rulesVersion():
+            problems.append(
+                f"built with concept rules {first['rulesVersion']}, not the current ones"
+            )
+        for meta in metas[1:]:
+            differs = [key for key in ("rulesVersion", "allCiks") if meta[key] != first[key]]
+            if not sameArchive(meta["archive"], first["archive"]):
+                differs.append("archive")
+            for key in differs:
+                problems.append(
+                    f"shard {meta['shard']}/{shards}: {key} differs from shard "
+                    f"{first['shard']}/{shards}"
+                )
+        complete = len(metas) == shards
+        if complete and sum(meta["ciks"] for meta in metas) != first["allCiks"]["count"]:
+            problems.append("shards do not add up to the CIK list")
+    if problems:
+        raise ShardError("\n".join(problems))
+    return metas
+
+
+def sameArchive(a: dict, b: dict) -> bool:
+    # A copy of the archive has no download metadata, so compare what both know
+    return all(a[key] == b[key] for key in a.keys() & b.keys())
+
+
+def checkShard(meta: dict, path: str, shard: int, shards: int) -> list[str]:
+    """
+    Returns:
+        list[str] - problems with one shard's output, empty if it is intact.
+    """
+    if meta.get("version") != SHARD_VERSION:
+        return [f"version {meta.get('version')} is not {SHARD_VERSION}"]
+    if (meta["shard"], meta["shards"]) != (shard, shards):
+        return [f"holds shard {meta['shard']}/{meta['shards']}"]
+    problems = []
+    misplaced = [cik for cik in meta["members"] if shardOf(cik, shards) != shard]
+    if misplaced:
+        problems.append(f"{len(misplaced)} CIKs belong to other shards, e.g. {misplaced[0]}")
+    files = [(chunk["file"], chunk["sha256"]) for chunk in meta["chunks"]]
+    files.append((meta["issues"]["file"], meta["issues"]["sha256"]))
+    for name, checksum in files:
+        filePath = os.path.join(path, name)
+        if not os.path.exists(filePath):
+            problems.append(f"{name} is missing")
+        elif fileChecksum(filePath) != checksum:
+            problems.append(f"{name} does not match its checksum")
+    if problems:
+        return problems
+    for chunk in meta["chunks"]:
+        with np.load(os.path.join(path, chunk["file"])) as arrays:
+            if len(arrays["factValue"]) != chunk["facts"]:
+                problems.append(f"{chunk['file']} does not hold {chunk['facts']} facts")
+    if sum(chunk["facts"] for chunk in meta["chunks"]) != meta["facts"]:
+        problems.append(f"chunks do not add up to {meta['facts']} facts")
+    issues = quality.loadIssues(os.path.join(path, meta["issues"]["file"]))
+    if len(issues) != meta["issues"]["rows"]:
+        problems.append(f"{meta['issues']['file']} does not hold {meta['issues']['rows']} rows")
+    return problems
+
+
+def readChunks(metas: list[dict], directory: str = None):
+    """
+    Yields the FactStore of each chunk of the shards, one at a time.
+    """
+    for meta in metas:
+        path = shardDirectory(meta["shard"], meta["shards"], directory)
+        for chunk in meta["chunks"]:
+            with np.load(os.path.join(path, chunk["file"])) as arrays:
+                yield FactStore.fromArrays(arrays)
+
+
+def readIssues(metas: list[dict], directory: str = None) -> list[tuple]:
+    """
+    Returns:
+        list[tuple] - the concept issues of all the shards, by CIK.
+    """
+    issues = []
+    for meta in metas:
+        path = shardDirectory(meta["shard"], meta["shards"], directory)
+        issues.extend(quality.loadIssues(os.path.join(path, meta["issues"]["file"])))
+    issues.sort(key=lambda row: row[0])
+    return issues
+
+
+def mergedManifest(metas: list[dict]) -> Manifest:
+    cikToFingerprint = {}
+    for meta in metas:
+        cikToFingerprint.update(meta["members"])
+    return Manifest(metas[0]["rulesVersion"], cikToFingerprint)
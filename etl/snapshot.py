@@ -0,0 +1,400 @@
+import json
+import os
+import shutil
+import numpy as np
+import concepts
+import config
+from factstore import FactStore, NO_DURATION
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+INDEX_VERSION = 3
+FINANCIALS_DIR = os.path.join(config.SNAPSHOT_DIR, "financials")
+COMPANIES_PATH = os.path.join(config.SNAPSHOT_DIR, "companies.arrow")
+YEAR_END_CLOSES_PATH = os.path.join(config.SNAPSHOT_DIR, "year_end_closes.arrow")
+INDEX_NAME = "index.json"
+
+# Every file shares these dictionaries, so a code means the same thing in every year and batch
+CONCEPT_NAMES = [c.name for c in concepts.Concept]
+DURATION_NAMES = [d.name for d in concepts.Duration]
+PERIOD_NAMES = [p.name for p in concepts.Period]
+
+
+def isAvailable() -> bool:
+    return pa is not None
+
+
+def financialsSchema():
+    return pa.schema(
+        [
+            ("cik", pa.string()),
+            ("year", pa.int16()),
+            ("period", pa.dictionary(pa.int8(), pa.string())),
+            ("duration", pa.dictionary(pa.int8(), pa.string())),
+            ("concept", pa.dictionary(pa.int16(), pa.string())),
+            ("value", pa.float64()),
+        ]
+    )
+
+
+def companiesSchema():
+    return pa.schema(
+        [
+            ("cik", pa.string()),
+            ("ticker", pa.string()),
+            ("company", pa.string()),
+            ("close_date", pa.date32()),
+            ("close", pa.float64()),
+        ]
+    )
+
+
+def yearEndClosesSchema():
+    return pa.schema(
+        [
+            ("cik", pa.string()),
+            ("ticker", pa.string()),
+            ("year", pa.int16()),
+            ("close_date", pa.date32()),
+            ("close", pa.float64()),
+        ]
+    )
+
+
+def writeFinancials(store: FactStore, logger, replaceCiks: list[str] = None) -> bool:
+    """
+    Writes the facts as a columnar snapshot: one Arrow IPC file per calendar year, each holding
+    one record batch per concept, plus an index of which batch holds which concept. Concept,
+    duration and period are dictionary-encoded. Files are uncompressed so readers can memory-map
+    a year and read a single concept's batch without touching the rest.
+
+    The new snapshot is built in a temporary directory and swapped in whole.
+
+    Parameters:
+        replaceCiks: list[str] - If given, store only holds these CIKs' facts, and they replace
+        these CIKs' rows in the existing snapshot. If None, store replaces the whole snapshot.
+
+    Returns:
+        bool: False if the snapshot was not written.
+    """
+    if not isAvailable():
+        logger.info("pyarrow is not installed, skipping financials snapshot")
+        return False
+    writer = FinancialsWriter(logger, replaceCiks)
+    writer.add(store)
+    return writer.close()
+
+
+class FinancialsWriter:
+    """
+    Builds the financials snapshot (see writeFinancials) from FactStores added one at a time, so
+    the facts never have to be held in memory together. Each added store's rows are appended to
+    a spill file per year; close sorts each year's rows by concept, one year at a time, writes
+    the year files and swaps the snapshot in.
+    """
+
+    def __init__(self, logger, replaceCiks: list[str] = None):
+        """
+        Parameters:
+            replaceCiks: list[str] - as for writeFinancials.
+        """
+        self.logger = logger
+        self.replaceCiks: list[str] | None = replaceCiks
+        self.tmpDir: str = FINANCIALS_DIR + ".tmp"
+        self.spillDir: str = os.path.join(self.tmpDir, "spill")
+        self.yearToSpill: dict[int, tuple] = {}  # year -> (file, stream writer)
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+        os.makedirs(self.spillDir)
+
+    def add(self, store: FactStore) -> None:
+        if len(store) == 0:
+            return
+        table = factStoreToTable(store)
+        years = table["year"].to_numpy()
+        order = np.argsort(years, kind="stable")
+        table = table.take(pa.array(order))
+        years = years[order]
+        bounds = np.flatnonzero(np.diff(years)) + 1
+        for start, end in zip(
+            np.concatenate(([0], bounds)), np.concatenate((bounds, [len(years)]))
+        ):
+            year = int(years[start])
+            if year not in self.yearToSpill:
+                sink = pa.OSFile(os.path.join(self.spillDir, f"year={year}.arrows"), "wb")
+                self.yearToSpill[year] = (sink, pa.ipc.new_stream(sink, table.schema))
+            self.yearToSpill[year][1].write_table(table.slice(start, end - start))
+
+    def close(self) -> bool:
+        """
+        Finishes the snapshot and swaps it in.
+
+        Returns:
+            bool: False if the snapshot was not written.
+        """
+        self.closeSpills()
+        existingIndex = None
+        if self.replaceCiks is not None:
+            existingIndex = loadIndex()
+            if existingIndex is None:
+                self.logger.warning(
+                    "No financials snapshot to update, skipping until the next full load"
+                )
+                self.abort()
+                return False
+            replaced = pa.array(self.replaceCiks, pa.string())
+        years = set(self.yearToSpill)
+        if existingIndex:
+            years.update(int(y) for y in existingIndex["years"])
+
+        index = {"version": INDEX_VERSION, "years": {}}
+        rows = 0
+        for year in sorted(years):
+            parts = []
+            entry = existingIndex and existingIndex["years"].get(str(year))
+            if entry:
+                path = os.path.join(FINANCIALS_DIR, entry["file"])
+                existing = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+                keep = pc.invert(pc.is_in(existing["cik"], value_set=replaced))
+                parts.append(existing.filter(keep))
+            if year in self.yearToSpill:
+                path = os.path.join(self.spillDir, f"year={year}.arrows")
+                parts.append(pa.ipc.open_stream(pa.memory_map(path, "r")).read_all())
+            table = pa.concat_tables(parts).combine_chunks() if len(parts) > 1 else parts[0]
+            if len(table) == 0:
+                continue
+            index["years"][str(year)] = writeYear(table, year, self.tmpDir)
+            rows += len(table)
+        shutil.rmtree(self.spillDir)
+        with open(os.path.join(self.tmpDir, INDEX_NAME), "w") as f:
+            json.dump(index, f, indent=2)
+
+        swapDirectory(self.tmpDir, FINANCIALS_DIR)
+        self.logger.info(f"Wrote financials snapshot: {rows} rows, {len(index['years'])} years")
+        return True
+
+    def abort(self) -> None:
+        self.closeSpills()
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+    def closeSpills(self) -> None:
+        for sink, writer in self.yearToSpill.values():
+            if not sink.closed:
+                writer.close()
+                sink.close()
+
+
+def writeYear(table, year: int, directory: str) -> dict:
+    """
+    Writes one year's rows with one record batch per concept, keeping the rows' order within
+    each concept.
+
+    Returns:
+        dict - the year's index entry.
+    """
+    conceptCodes = table["concept"].combine_chunks().indices.to_numpy()
+    order = np.argsort(conceptCodes, kind="stable")
+    table = table.take(pa.array(order))
+    codes = conceptCodes[order]
+    fileName = f"year={year}.arrow"
+    batchIndex = {}
+    bounds = np.flatnonzero(np.diff(codes)) + 1
+    with pa.OSFile(os.path.join(directory, fileName), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            for i, (start, end) in enumerate(
+                zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(codes)])))
+            ):
+                batch = table.slice(start, end - start).combine_chunks()
+                writer.write_batch(batch.to_batches()[0])
+                batchIndex[CONCEPT_NAMES[codes[start]]] = [i, int(end - start)]
+    return {"file": fileName, "rows": len(table), "concepts": batchIndex}
+
+
+def factStoreToTable(store: FactStore):
+    """
+    Builds an Arrow table straight from a FactStore's arrays, in the store's row order.
+    """
+    factPeriod = np.frombuffer(store.factPeriod, dtype=np.uint32)
+    conceptIds = [c.value for c in concepts.Concept]
+    durationIds = [d.value for d in concepts.Duration]
+    # Map enum values to positions in the shared dictionaries
+    conceptCode = np.full(max(conceptIds) + 1, -1, dtype=np.int16)
+    conceptCode[conceptIds] = np.arange(len(conceptIds))
+    durationCode = np.full(max(durationIds) + 1, -1, dtype=np.int8)
+    durationCode[durationIds] = np.arange(len(durationIds))
+
+    ciks = pa.array(store.ciks, pa.string())
+    factCik = pa.array(np.frombuffer(store.factCik, dtype=np.uint32))
+    years = np.frombuffer(store.periodYear, dtype=np.uint16)[factPeriod].astype(np.int16)
+    quarters = np.frombuffer(store.periodQuarter, dtype=np.uint8)[factPeriod].astype(np.int8) - 1
+    factConcept = conceptCode[np.frombuffer(store.factConcept, dtype=np.uint16)]
+    factDuration = np.frombuffer(store.factDuration, dtype=np.int8)
+    durations = pa.array(
+        durationCode[factDuration], pa.int8(), mask=factDuration == NO_DURATION
+    )
+    return pa.Table.from_arrays(
+        [
+            ciks.take(factCik),
+            pa.array(years, pa.int16()),
+            pa.DictionaryArray.from_arrays(pa.array(quarters), pa.array(PERIOD_NAMES)),
+            pa.DictionaryArray.from_arrays(durations, pa.array(DURATION_NAMES)),
+            pa.DictionaryArray.from_arrays(pa.array(factConcept), pa.array(CONCEPT_NAMES)),
+            pa.array(np.frombuffer(store.factValue, dtype=np.float64), pa.float64()),
+        ],
+        schema=financialsSchema(),
+    )
+
+
+def loadIndex(directory: str = None) -> dict | None:
+    directory = directory or FINANCIALS_DIR
+    try:
+        with open(os.path.join(directory, INDEX_NAME), "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return index if index.get("version") == INDEX_VERSION else None
+
+
+def openYear(year: int, directory: str = None):
+    """
+    Memory-maps one year of the financials snapshot.
+
+    Returns:
+        pyarrow.ipc.RecordBatchFileReader, or None if the snapshot has no such year.
+    """
+    directory = directory or FINANCIALS_DIR
+    index = loadIndex(directory)
+    entry = index and index["years"].get(str(year))
+    if not entry:
+        return None
+    return pa.ipc.open_file(pa.memory_map(os.path.join(directory, entry["file"]), "r"))
+
+
+def readConcept(year: int, concept: str, directory: str = None):
+    """
+    Reads one concept of one year, touching only that record batch of the memory-mapped file.
+
+    Returns:
+        pyarrow.RecordBatch, or None if there are no rows for it.
+    """
+    directory = directory or FINANCIALS_DIR
+    index = loadIndex(directory)
+    entry = index and index["years"].get(str(year))
+    if not entry or concept not in entry["concepts"]:
+        return None
+    reader = pa.ipc.open_file(pa.memory_map(os.path.join(directory, entry["file"]), "r"))
+    return reader.get_batch(entry["concepts"][concept][0])
+
+
+def readFinancials(
+    years: list[int] = None, conceptNames: list[str] = None, directory: str = None
+):
+    """
+    Reads the financials snapshot, optionally limited to some years and concepts.
+
+    Returns:
+        pyarrow.Table, or None if there is no snapshot.
+    """
+    directory = directory or FINANCIALS_DIR
+    index = loadIndex(directory)
+    if index is None:
+        return None
+    batches = []
+    for year, entry in index["years"].items():
+        if years is not None and int(year) not in years:
+            continue
+        reader = pa.ipc.open_file(pa.memory_map(os.path.join(directory, entry["file"]), "r"))
+        for concept, (i, _) in entry["concepts"].items():
+            if conceptNames is None or concept in conceptNames:
+                batches.append(reader.get_batch(i))
+    return pa.Table.from_batches(batches, schema=financialsSchema())
+
+
+def writeCompanies(rows: list[dict], logger) -> bool:
+    """
+    Writes the companies table (with close prices) as a single Arrow IPC file.
+
+    Parameters:
+        rows: list[dict] - rows as written to the companies table.
+    """
+    if not isAvailable():
+        logger.info("pyarrow is not installed, skipping companies snapshot")
+        return False
+    schema = companiesSchema()
+    table = pa.Table.from_pydict(
+        {
+            "cik": [r["cik"] for r in rows],
+            "ticker": [r["ticker"] for r in rows],
+            "company": [r["company"] for r in rows],
+            "close_date": pc.cast(
+                pa.array([r["close_date"] for r in rows], pa.string()), pa.date32()
+            ),
+            "close": [r["close"] for r in rows],
+        },
+        schema=schema,
+    )
+    writeTable(table, COMPANIES_PATH)
+    logger.info(f"Wrote companies snapshot: {len(table)} rows")
+    return True
+
+
+def writeYearEndCloses(rows: list[dict], logger) -> bool:
+    """
+    Writes the last close of each ticker in each year, for historical market caps.
+
+    Parameters:
+        rows: list[dict] - rows as written to the year_end_closes table.
+    """
+    if not isAvailable():
+        logger.info("pyarrow is not installed, skipping year-end closes snapshot")
+        return False
+    table = pa.Table.from_pydict(
+        {
+            "cik": [r["cik"] for r in rows],
+            "ticker": [r["ticker"] for r in rows],
+            "year": [r["year"] for r in rows],
+            "close_date": pc.cast(
+                pa.array([r["close_date"] for r in rows], pa.string()), pa.date32()
+            ),
+            "close": [r["close"] for r in rows],
+        },
+        schema=yearEndClosesSchema(),
+    )
+    writeTable(table, YEAR_END_CLOSES_PATH)
+    logger.info(f"Wrote year-end closes snapshot: {len(table)} rows")
+    return True
+
+
+def writeTable(table, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmpPath = path + ".tmp"
+    with pa.OSFile(tmpPath, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmpPath, path)
+
+
+def readCompanies(path: str = None):
+    return readTable(path or COMPANIES_PATH)
+
+
+def readYearEndCloses(path: str = None):
+    return readTable(path or YEAR_END_CLOSES_PATH)
+
+
+def readTable(path: str):
+    if not os.path.exists(path):
+        return None
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+def swapDirectory(newDir: str, directory: str) -> None:
+    oldDir = directory + ".old"
+    shutil.rmtree(oldDir, ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, oldDir)
+    os.rename(newDir, directory)
+    shutil.rmtree(oldDir, ignore_errors=True)
@@ -1,6 +1,13 @@
 from dotenv import load_dotenv
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import json
 import os
+import random
+import time
 import config
+import httpx
+from postgrest.exceptions import APIError
 from supabase import create_client, Client
 
 load_dotenv()
@@ -9,46 +16,390 @@ url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 
+TRANSIENT_HTTP_STATUSES = {408, 429, 500, 502, 503, 504}
+# Connection exception, transaction rollback, insufficient resources, operator intervention
+TRANSIENT_SQLSTATE_CLASSES = {"08", "40", "53", "57"}
+# Timed out acquiring a database connection
+TRANSIENT_POSTGREST_CODES = {"PGRST003"}
+# Cardinality violation, data exception, integrity constraint violation: caused by some rows
+ROW_SQLSTATE_CLASSES = {"21", "22", "23"}
 
-def batchInsert(tablename: str, rows: list[dict], logger, batchSize: int = config.BATCH_SIZE_SUPABASE) -> None:
-    for i in range(0, len(rows), batchSize):
-        batch = rows[i:i + batchSize]
+
+class WriteSummary:
+    def __init__(self, tablename: str):
+        self.tablename: str = tablename
+        self.rowsWritten: int = 0
+        self.rowsFailed: int = 0
+        self.batchesRetried: int = 0
+        self.batchesSplit: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.rowsFailed == 0
+
+    def add(self, other: "WriteSummary") -> None:
+        self.rowsWritten += other.rowsWritten
+        self.rowsFailed += other.rowsFailed
+        self.batchesRetried += other.batchesRetried
+        self.batchesSplit += other.batchesSplit
+
+    def __str__(self):
+        return (
+            f"{self.tablename}: {self.rowsWritten} rows written, {self.rowsFailed} rows failed, "
+            f"{self.batchesRetried} batches retried, {self.batchesSplit} batches split"
+        )
+
+
+def batchInsert(
+    tablename: str,
+    rows: list[dict],
+    logger,
+    batchSize: int = config.BATCH_SIZE_SUPABASE,
+    onConflict: str = None,
+    maxInFlight: int = config.MAX_IN_FLIGHT_SUPABASE,
+    maxRetries: int = config.MAX_RETRIES_SUPABASE,
+    maxPayloadBytes: int = config.MAX_PAYLOAD_BYTES_SUPABASE,
+) -> WriteSummary:
+    """
+    Writes rows in batches, keeping up to maxInFlight batches in flight.
+
+    Transient failures are retried with jittered exponential backoff. A batch rejected because of
+    some of its rows (bad values, constraint violations) is split in half until the offending rows
+    are isolated, so one bad row only loses itself. Any other failure, including transient ones
+    that outlast their retries, fails the whole batch: splitting would only multiply requests to
+    a server that is down.
+    Batches shrink below batchSize when the observed payload size per row would exceed
+    maxPayloadBytes.
+
+    Parameters:
+        onConflict: str - comma-separated unique key, e.g. "cik,year,period,duration,concept".
+        If given, rows are upserted on it so that retrying a batch that actually landed never
+        duplicates rows. The key needs a unique index (NULLS NOT DISTINCT if a key column can be
+        null). If None, rows are plainly inserted.
+
+    Returns:
+        WriteSummary - counts of rows written and failed.
+    """
+    summary = WriteSummary(tablename)
+    pending: deque[list[dict]] = deque()  # batches split from failed ones, sent first
+    nextRow = 0
+    bytesSent = 0
+    rowsSent = 0
+
+    def nextBatch() -> list[dict] | None:
+        nonlocal nextRow
+        if pending:
+            return pending.popleft()
+        if nextRow >= len(rows):
+            return None
+        size = batchSize
+        if rowsSent:
+            size = max(1, min(batchSize, maxPayloadBytes * rowsSent // bytesSent))
+        batch = rows[nextRow:nextRow + size]
+        nextRow += len(batch)
+        return batch
+
+    with ThreadPoolExecutor(max_workers=maxInFlight) as executor:
+        inFlight = {}
+        while True:
+            while len(inFlight) < maxInFlight:
+                batch = nextBatch()
+                if batch is None:
+                    break
+                future = executor.submit(sendBatch, tablename, batch, onConflict, maxRetries)
+                inFlight[future] = batch
+            if not inFlight:
+                break
+            done, _ = wait(inFlight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = inFlight.pop(future)
+                try:
+                    payloadBytes, retries = future.result()
+                except Exception as e:
+                    summary.batchesRetried += getattr(e, "retries", 0)
+                    if len(batch) > 1 and isRowError(e):
+                        summary.batchesSplit += 1
+                        half = len(batch) // 2
+                        pending.appendleft(batch[half:])
+                        pending.appendleft(batch[:half])
+                    elif len(batch) > 1:
+                        summary.rowsFailed += len(batch)
+                        logger.error(
+                            f"Error inserting {len(batch)} rows into {tablename} table: {e}"
+                        )
+                    else:
+                        summary.rowsFailed += 1
+                        logger.error(f"Error inserting into {tablename} table: {e} (row: {batch[0]})")
+                    continue
+                summary.rowsWritten += len(batch)
+                summary.batchesRetried += retries
+                bytesSent += payloadBytes
+                rowsSent += len(batch)
+
+    logFn = logger.info if summary.ok else logger.error
+    logFn(str(summary))
+    return summary
+
+
+def sendBatch(tablename: str, batch: list[dict], onConflict: str, maxRetries: int) -> tuple[int, int]:
+    """
+    Sends one batch, retrying transient failures.
+
+    Returns:
+        tuple[int, int] - the batch's payload size in bytes and the number of retries it took.
+
+    Raises:
+        Exception: the last error, with a retries attribute, once the batch is given up on.
+    """
+    payloadBytes = len(json.dumps(batch, default=str))
+    for attempt in range(maxRetries + 1):
         try:
-            response = supabase.table(tablename).insert(batch).execute()
+            query = supabase.table(tablename)
+            if onConflict:
+                query = query.upsert(batch, on_conflict=onConflict)
+            else:
+                query = query.insert(batch)
+            query.execute()
+            return payloadBytes, attempt
         except Exception as e:
-            logger.error(f"Error inserting into {tablename} table: {e}")
+            if attempt == maxRetries or not isTransient(e):
+                e.retries = attempt
+                raise
+            time.sleep(retryDelay(attempt))
+
+
+def retryDelay(attempt: int) -> float:
+    delay = min(config.RETRY_MAX_DELAY_SUPABASE, config.RETRY_BASE_DELAY_SUPABASE * 2**attempt)
+    return random.uniform(0, delay)
+
+
+def isTransient(e: Exception) -> bool:
+    """
+    Returns True for errors that are worth retrying as-is: network failures, timeouts, rate
+    limiting, unavailable servers and Postgres connection/serialization/resource errors.
+    """
+    if isinstance(e, httpx.TransportError):
+        return True
+    if isinstance(e, APIError):
+        code = e.code
+        if isinstance(code, int) or (isinstance(code, str) and code.isdigit() and len(code) == 3):
+            return int(code) in TRANSIENT_HTTP_STATUSES
+        if isinstance(code, str):
+            return code[:2] in TRANSIENT_SQLSTATE_CLASSES or code in TRANSIENT_POSTGREST_CODES
+    return False
+
 
+def isRowError(e: Exception) -> bool:
+    """
+    Returns True for errors Postgres raises because of the values of particular rows, which
+    sending the rest of the batch without them avoids.
+    """
+    return (
+        isinstance(e, APIError)
+        and isinstance(e.code, str)
+        and len(e.code) == 5
+        and e.code[:2] in ROW_SQLSTATE_CLASSES
+    )
 
-def batchFetch(tablename: str, columns: list[str], logger, batchSize: int = config.BATCH_SIZE_SUPABASE) -> list[dict]:
+
+def batchFetch(
+    tablename: str,
+    columns: list[str],
+    logger,
+    batchSize: int = config.BATCH_SIZE_SUPABASE,
+    orderBy: str = None,
+    parallel: int = 1,
+    maxRetries: int = config.MAX_RETRIES_SUPABASE,
+) -> list[dict]:
+    """
+    Fetches the given columns of every row of a table. Transient failures are retried with
+    jittered exponential backoff; any other failure raises, so the result is never silently
+    partial.
+
+    Parameters:
+        orderBy: str - a unique, indexed column. Pages are then fetched by key ("where key > last
+        key order by key limit batchSize"), so every page costs the same however deep into the
+        table it is, and rows come back sorted by it. Without it pages are fetched by offset,
+        which is only fine for small tables.
+
+        parallel: int - with orderBy, the key space is split into this many ranges of about
+        equal row counts, which are fetched concurrently.
+
+    Returns:
+        list[dict] - rows with the given columns.
+    """
+    if orderBy is None:
+        rows = fetchByOffset(tablename, columns, batchSize, maxRetries)
+    else:
+        selected = columns if orderBy in columns else columns + [orderBy]
+        bounds = keyBoundaries(tablename, orderBy, parallel, maxRetries) if parallel > 1 else []
+        ranges = list(zip([None] + bounds, bounds + [None]))
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            pages = executor.map(
+                lambda r: fetchKeyRange(
+                    tablename, selected, orderBy, r[0], r[1], batchSize, maxRetries
+                ),
+                ranges,
+            )
+            rows = [row for page in pages for row in page]
+        if orderBy not in columns:
+            for row in rows:
+                del row[orderBy]
+    logger.info(f"Fetched {len(rows)} rows from {tablename}")
+    return rows
+
+
+def fetchByOffset(tablename: str, columns: list[str], batchSize: int, maxRetries: int) -> list[dict]:
+    rows = []
     start = 0
+    while True:
+        page = executeWithRetry(
+            lambda: supabase.table(tablename)
+            .select(", ".join(columns))
+            .range(start, start + batchSize - 1),
+            maxRetries,
+        ).data
+        if not page:
+            return rows
+        rows.extend(page)
+        start += len(page)
+
+
+def fetchKeyRange(
+    tablename: str, columns: list[str], key: str, low, high, batchSize: int, maxRetries: int
+) -> list[dict]:
+    """
+    Fetches the rows with low <= key < high by keyset pagination. None leaves a side open.
+    """
     rows = []
+    last = None
     while True:
+
+        def query():
+            q = supabase.table(tablename).select(", ".join(columns))
+            if last is not None:
+                q = q.gt(key, last)
+            elif low is not None:
+                q = q.gte(key, low)
+            if high is not None:
+                q = q.lt(key, high)
+            return q.order(key).limit(batchSize)
+
+        # The server may cap a page below batchSize, so only an empty page marks the end
+        page = executeWithRetry(query, maxRetries).data
+        if not page:
+            return rows
+        rows.extend(page)
+        last = page[-1][key]
+
+
+def keyBoundaries(tablename: str, key: str, parts: int, maxRetries: int) -> list:
+    """
+    Returns:
+        list - up to parts - 1 increasing key values that split the table into ranges of about
+        equal row counts. Each is found with a one-row offset query, which scans the key's
+        index up to it, so this costs a few index scans rather than one per page.
+    """
+    count, _ = tableSignature(tablename, key, maxRetries)
+    step = count // parts
+    if step == 0:
+        return []
+    bounds = []
+    for i in range(1, parts):
+        page = executeWithRetry(
+            lambda: supabase.table(tablename)
+            .select(key)
+            .order(key)
+            .range(i * step, i * step),
+            maxRetries,
+        ).data
+        if page and (not bounds or page[0][key] > bounds[-1]):
+            bounds.append(page[0][key])
+    return bounds
+
+
+def tableSignature(tablename: str, key: str, maxRetries: int = config.MAX_RETRIES_SUPABASE) -> tuple:
+    """
+    Returns:
+        tuple[int, Any] - the table's row count and largest key, from two cheap queries. A cached
+        copy of the table whose signature still matches is taken to be current.
+    """
+    count = executeWithRetry(
+        lambda: supabase.table(tablename).select(key, count="exact", head=True), maxRetries
+    ).count
+    page = executeWithRetry(
+        lambda: supabase.table(tablename).select(key).order(key, desc=True).limit(1), maxRetries
+    ).data
+    return count or 0, page[0][key] if page else None
+
+
+def checkColumns(tablename: str, columns: list[str], maxRetries: int = config.MAX_RETRIES_SUPABASE) -> str | None:
+    """
+    Returns:
+        str | None - why the columns of the table cannot be read, e.g. the table or one of the
+        columns does not exist, or None if they can.
+    """
+    try:
+        executeWithRetry(lambda: supabase.table(tablename).select(",".join(columns)).limit(0), maxRetries)
+    except APIError as e:
+        if isTransient(e):
+            raise
+        return e.message
+    return None
+
+
+def executeWithRetry(makeQuery, maxRetries: int):
+    """
+    Executes the query built by makeQuery, retrying transient failures.
+
+    Raises:
+        Exception: the last error, once the query is given up on.
+    """
+    for attempt in range(maxRetries + 1):
         try:
-            end = start + batchSize - 1
-            response = (
-                supabase.table(tablename)
-                .select(", ".join(columns))
-                .range(start, end)
-                .execute()
-            )
+            return makeQuery().execute()
         except Exception as e:
-            logger.error(f"Error fetching from {tablename} table: {e}")
-            break
-        if not response.data:
-            break
-        rows.extend(response.data)
-        start += batchSize
-    return rows
+            if attempt == maxRetries or not isTransient(e):
+                raise
+            time.sleep(retryDelay(attempt))
 
 
-def truncate(tablename: str, logger) -> None:
+def truncate(tablename: str, logger, maxRetries: int = config.MAX_RETRIES_SUPABASE) -> bool:
+    """
+    Returns:
+        bool - False if the table could not be truncated, so callers do not report the load as
+        complete while the old rows are still there.
+    """
     try:
-        response = supabase.rpc("truncate_table", {"tablename": tablename}).execute()
-        return response
+        executeWithRetry(lambda: supabase.rpc("truncate_table", {"tablename": tablename}), maxRetries)
+        return True
     except Exception as e:
         logger.error(f"Error truncating {tablename} table: {e}")
+        return False
+
+
+def truncateAndInsert(tablename: str, rows: list[dict], logger, batchSize: int = config.BATCH_SIZE_SUPABASE, onConflict: str = None) -> WriteSummary:
+    if not truncate(tablename, logger):
+        return failedSummary(tablename, rows)
+    return batchInsert(tablename, rows, logger, batchSize, onConflict)
+
+def deleteWhereIn(tablename: str, column: str, values: list, logger, batchSize: int = config.BATCH_SIZE_SUPABASE_DELETE, maxRetries: int = config.MAX_RETRIES_SUPABASE) -> bool:
+    """
+    Returns:
+        bool - False if some of the rows could not be deleted.
+    """
+    for i in range(0, len(values), batchSize):
+        batch = values[i:i + batchSize]
+        try:
+            executeWithRetry(lambda: supabase.table(tablename).delete().in_(column, batch), maxRetries)
+        except Exception as e:
+            logger.error(f"Error deleting from {tablename} table: {e}")
+            return False
+    return True
+
 
-    
-def truncateAndInsert(tablename: str, rows: list[dict], logger, batchSize: int = config.BATCH_SIZE_SUPABASE) -> None:
-    truncate(tablename, logger)
-    batchInsert(tablename, rows, logger)
\ No newline at end of file
+def failedSummary(tablename: str, rows: list[dict]) -> WriteSummary:
+    # Rows not written because clearing the table before them failed
+    summary = WriteSummary(tablename)
+    summary.rowsFailed = len(rows)
+    return summary
@@ -1,10 +1,14 @@
-import requests
-import yfinance as yf
+import json
 from datetime import date
-import time
 import config
+import fetch
+import prices
+import schema
 import supabase_utils
+import snapshot
+import screen_cache
 import utils
+from prices import PriceProvider, PriceStore, YahooPriceProvider
 
 
 class Company:
@@ -24,44 +28,85 @@ class Company:
     def __repr__(self):
         return self.__str__()
 
+
 logger = utils.configureLogger(config.LOG_PATH_COMPANIES)
 
-headers = {"User-Agent": config.EMAIL}
-response = requests.get(config.URL_SEC_TICKERS, headers=headers)
-data = response.json()
-
-# TODO remove when ready for full update
-data = list(data.values())[:100]
-
-companies = {
-    entry["ticker"]: Company(
-        str(entry["cik_str"]).zfill(10), entry["ticker"], entry["title"]
-    )
-    for entry in data
-}
-
-tickers = list(companies.keys())
-batch_size = config.BATCH_SIZE_SEC_TICKERS
-for i in range(0, len(tickers), batch_size):
-    batch = tickers[:batch_size]
-    data = yf.download(batch, period="1d")["Close"]
-    priceDate = data.index[0].to_pydatetime().date()
-    for ticker in tickers:
-        if ticker in data.columns:
-            closePrice = data[ticker].iloc[0]
-            companies[ticker].priceDate = priceDate
-            companies[ticker].closePrice = closePrice
-    time.sleep(1)
-
-rows = [
-    {
-        "cik": c.cik,
-        "ticker": c.ticker,
-        "company": c.name,
-        "close_date": utils.dateToStr(c.priceDate),
-        "close": c.closePrice,
+
+def run(provider: PriceProvider = None, store: PriceStore = None) -> bool:
+    """
+    Updates the stored price history of every SEC ticker, then republishes the companies table
+    with each ticker's latest close and the year_end_closes table with the last close of each
+    year.
+
+    Parameters:
+        provider: PriceProvider - source of daily closes, Yahoo Finance by default.
+        store: PriceStore - price history on disk, config.PRICE_DIR by default.
+
+    Returns:
+        bool - True if both tables were written without errors.
+    """
+    try:
+        schema.prepareTables(
+            [schema.YEAR_END_CLOSES, schema.DATA_VERSION, schema.SCREEN_CACHE], logger
+        )
+    except schema.SchemaError as e:
+        logger.error(f"Not updating companies, tables are missing or out of date:\n{e}")
+        return False
+    provider = provider or YahooPriceProvider()
+    store = store or PriceStore()
+
+    fetch.fetch(config.URL_SEC_TICKERS, config.TICKERS_PATH, logger, verify=fetch.verifyJson)
+    with open(config.TICKERS_PATH, "r") as f:
+        data = json.load(f)
+
+    # TODO remove when ready for full update
+    data = list(data.values())[:100]
+
+    companies = {
+        entry["ticker"]: Company(
+            str(entry["cik_str"]).zfill(10), entry["ticker"], entry["title"]
+        )
+        for entry in data
     }
-    for c in companies.values()
-]
 
-supabase_utils.truncateAndInsert("companies", rows, logger)
\ No newline at end of file
+    prices.ingestPrices(list(companies.keys()), store, provider, logger)
+
+    yearEndRows = []
+    for ticker, company in companies.items():
+        last = store.lastBar(ticker)
+        if last is not None:
+            company.priceDate, company.closePrice = last
+        for year, (closeDate, close) in sorted(store.yearEndCloses(ticker).items()):
+            yearEndRows.append(
+                {
+                    "cik": company.cik,
+                    "ticker": ticker,
+                    "year": year,
+                    "close_date": utils.dateToStr(closeDate),
+                    "close": close,
+                }
+            )
+
+    rows = [
+        {
+            "cik": c.cik,
+            "ticker": c.ticker,
+            "company": c.name,
+            "close_date": utils.dateToStr(c.priceDate) if c.priceDate else None,
+            "close": c.closePrice,
+        }
+        for c in companies.values()
+    ]
+
+    summary = supabase_utils.truncateAndInsert("companies", rows, logger)
+    snapshotOk = snapshot.writeCompanies(rows, logger)
+    yearEndSummary = supabase_utils.truncateAndInsert("year_end_closes", yearEndRows, logger)
+    snapshot.writeYearEndCloses(yearEndRows, logger)
+    if summary.ok:
+        # [Market Cap] depends on close prices
+        screen_cache.refresh(logger, warm=snapshotOk)
+    return summary.ok and yearEndSummary.ok
+
+
+if __name__ == "__main__":
+    run()
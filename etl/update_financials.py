@@ -1,19 +1,40 @@
-import requests
 import os
-import zipfile
+import sys
 import json
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import pprint
+from bisect import bisect_left
 from collections import defaultdict
-from datetime import datetime, timedelta
+from typing import Iterable
+from datetime import datetime
+import numpy as np
 import config
 import concepts
 import time
-import shutil
+import cProfile
 import supabase_utils
+import postgres_utils
 import utils
+import manifest
+import fetch
+import quality
+import derived
+from metrics import RunMetrics
+from pipeline import ChunkWriter, boundedMap
+import snapshot
+import schema
+import screen_cache
+import shards
+from companyfacts import CompanyFactsArchive, extractFacts
+from factstore import FactStore
+from resolution import ResolutionTable
 
 
 class FinancialValue:
+    __slots__ = ("concept", "alias", "value", "units", "filingFiscalYear", "duration")
+
     def __init__(
         self,
         concept: concepts.Concept,
@@ -46,6 +67,8 @@ class FinancialValue:
 
 
 class FinancialPeriod:
+    __slots__ = ("cik", "end", "cy", "cp", "conceptToFinancialValues")
+
     def __init__(self, cik: str, end: datetime):
         self.cik: str = cik
         self.end: datetime = end
@@ -65,92 +88,692 @@ class FinancialPeriod:
         )
 
 
+class PeriodIndex:
+    """
+    A company's FinancialPeriods sorted chronologically, with bisect lookups on their end dates.
+    """
+
+    __slots__ = ("fps", "ends")
+
+    def __init__(self, fps: list[FinancialPeriod]):
+        """
+        Parameters:
+            fps: list[FinancialPeriod] - list of FinancialPeriods sorted chronologically.
+        """
+        self.fps: list[FinancialPeriod] = fps
+        self.ends: list[int] = [fp.end.toordinal() for fp in fps]
+
+    def __len__(self) -> int:
+        return len(self.fps)
+
+    def __getitem__(self, i: int) -> FinancialPeriod:
+        return self.fps[i]
+
+    def get(self, end: int) -> FinancialPeriod | None:
+        """
+        Gets the FinancialPeriod ending exactly on the given date ordinal.
+        """
+        i = bisect_left(self.ends, end)
+        if i < len(self.ends) and self.ends[i] == end:
+            return self.fps[i]
+        return None
+
+    def getMostRecent(self, date: int) -> FinancialPeriod | None:
+        """
+        Gets the most recent FinancialPeriod within 60 days before to 7 days after the given date.
+
+        Of several such periods, the earliest one is returned.
+
+        Parameters:
+            date: int - ordinal of the date from which to find the most recent FinancialPeriod end.
+        """
+        i = bisect_left(self.ends, date - 60)
+        if i < len(self.ends) and self.ends[i] <= date + 7:
+            return self.fps[i]
+        return None
+
+
 logger = utils.configureLogger(config.LOG_PATH_FINANCIALS)
 
+FINANCIALS_COLUMNS = schema.FINANCIALS.columns
+FINANCIALS_KEY = ",".join(schema.FINANCIALS.key)
+ANNUAL_TABLE = schema.FINANCIALS_ANNUAL.name
+ANNUAL_COLUMNS = schema.FINANCIALS_ANNUAL.columns
+ANNUAL_KEY = ",".join(schema.FINANCIALS_ANNUAL.key)
+# Tables a load writes, checked or created before anything is parsed
+LOAD_TABLES = [schema.FINANCIALS, schema.FINANCIALS_ANNUAL, schema.DATA_VERSION, schema.SCREEN_CACHE]
+NO_START = -1  # start ordinal of entries without a start date
+NO_DURATION = -1
+DURATIONS = {d.value: d for d in concepts.Duration} | {NO_DURATION: None}
+EPOCH_YEAR = 1970  # year of quarter number 0
 
-def run():
-    start_time = time.perf_counter()
-    ciks = fetchCiks()
-    problemCikCount = 0
-    cikToFinancialPeriods = {}
 
-    ### START A: Use cursor ###
+def run(
+    workers: int = 1,
+    full: bool = False,
+    profile: list[str] = None,
+    shard: tuple[int, int] = None,
+):
+    """
+    Parameters:
+        workers: int - number of processes to parse CIKs with.
+
+        full: bool - If True, rebuild the whole financials table. Otherwise only CIKs whose
+        companyfacts member changed since the last run (per the manifest) are re-parsed and
+        replaced, unless the concept rules changed, which also forces a full rebuild.
+
+        profile: list[str] - CIKs to run under cProfile, each writing its stats to
+        config.PROFILE_DIR.
+
+        shard: tuple[int, int] - (i, N) to parse only the i-th of N shards of the CIKs (see
+        shards.shardCiks) and write them to config.SHARD_DIR instead of loading them, so N
+        machines can each run one shard. A shard is always parsed in full. merge loads the
+        shards once all N are written.
+
+    Parsed CIKs are gathered into chunks of about config.PIPELINE_CHUNK_FACTS facts, which
+    writer threads load into financials, financials_annual and the snapshot while parsing goes
+    on. The writers' queues are bounded, so memory use does not grow with the number of CIKs.
+
+    Per-stage timings, counters and the slowest CIKs are written to
+    config.METRICS_PATH_FINANCIALS and config.PROMETHEUS_PATH_FINANCIALS at the end. Stages
+    timed inside processCik are summed over all CIKs, so with several workers they can add up to
+    more than the run took.
+    """
+    start_time = time.perf_counter()
+    if shard is None and not prepareTables():
+        return 1
+    global profileCiks
+    profileCiks = set(profile or [])
+    metrics = RunMetrics()
+    ciks = allCiks = fetchCiks()
+    if shard is not None:
+        ciks = shards.shardCiks(allCiks, *shard)
+        logger.info(f"Shard {shard[0]}/{shard[1]}: {len(ciks)} of {len(allCiks)} CIKs")
+    # ciks = [
+    #     # '0001551152', # AbbVie
+    #     # '0000002488', # Advanced Micro Devices
+    #     # '0001018724', # Amazon
+    #     # '0000004962', # American Express
+    #     # '0000320193', # Apple
+    #     # '0001973239', # ARM Holdings
+    #     # '0001393818', # BlackStone
+    #     # '0001730168', # Broadcom
+    #     # '0000012927', # Boeing
+    #     # '0000858877', # Cisco
+    #     # '0000909832', # Costco
+    #     # '0000315189', # Deere
+    #     # '0001744489', # Disney
+    #     # '0001551182', # Eaton
+    #     # '0000034088', # Exxon Mobil
+    #     # '0000886982', # Goldman Sachs
+    #     # '0001707925', # Linde
+    #     '0001141391', # Mastercard
+    #     # '0000064040', # S&P Global
+    #     # '0001594805', # Shopify
+    # ]
+    with metrics.timer("manifest"), CompanyFactsArchive(config.ZIP_PATH) as archive:
+        current = manifest.currentManifest(archive, ciks)
     for cik in ciks:
-        ### END A ###
-
-        ### START B: Use list ###
-        # cursor.fetchall() # Need to "use up" cursor
-        # ciks = [
-        #     # ('0001551152',), # AbbVie
-        #     # ('0000002488',), # Advanced Micro Devices
-        #     # ('0001018724',), # Amazon
-        #     # ('0000004962',), # American Express
-        #     # ('0000320193',), # Apple
-        #     # ('0001973239',), # ARM Holdings
-        #     # ('0001393818',), # BlackStone
-        #     # ('0001730168',), # Broadcom
-        #     # ('0000012927',), # Boeing
-        #     # ('0000858877',), # Cisco
-        #     # ('0000909832',), # Costco
-        #     # ('0000315189',), # Deere
-        #     # ('0001744489',), # Disney
-        #     # ('0001551182',), # Eaton
-        #     # ('0000034088',), # Exxon Mobil
-        #     # ('0000886982',), # Goldman Sachs
-        #     # ('0001707925',), # Linde
-        #     ('0001141391',), # Mastercard
-        #     # ('0000064040',), # S&P Global
-        #     # ('0001594805',), # Shopify
-        # ]
-        # for cik in ciks:
-        # ### END B ###
-
-        with zipfile.ZipFile(config.ZIP_PATH, "r") as z:
-            fname = "CIK" + cik + ".json"
-            try:
-                with z.open(fname) as f:
-                    content = f.read()
-                    data = json.loads(content.decode("utf-8"))
-                    fps: list[FinancialPeriod] = createFinancialPeriods(
-                        data, cik
-                    )
-                    if fps:
-                        problemCikCount += logConceptIssues(
-                            cik, fps, useExcuses=True
-                        )
-                        cikToFinancialPeriods[cik] = fps
-            except KeyError as ke:
-                utils.logCik(logger.debug, cik, f"KeyError: {ke}")
-
-    rows = []
-    for cik, fps in cikToFinancialPeriods.items():
-        for fp in fps:
-            for concept, fvs in fp.conceptToFinancialValues.items():
-                for fv in fvs:
-                    duration = fv.duration.name if fv.duration else None
-                    rows.append(
-                        {
-                            "cik": cik,
-                            "year": fp.cy,
-                            "period": fp.cp.name,
-                            "duration": duration,
-                            "concept": concept,
-                            "value": fv.value,
-                        }
-                    )
-    supabase_utils.truncateAndInsert("financials", rows, logger)
+        if cik not in current.cikToFingerprint:
+            utils.logCik(logger.debug, cik, "not found in archive")
+    previous = None
+    if not full and shard is None:
+        previous = manifest.loadManifest(config.MANIFEST_PATH_FINANCIALS)
+    if previous and previous.rulesVersion == current.rulesVersion:
+        changed, removed = previous.diff(current)
+        logger.info(f"Incremental load: {len(changed)} changed, {len(removed)} removed CIKs")
+    else:
+        changed, removed = list(current.cikToFingerprint), None
+        logger.info(f"Full load: {len(changed)} CIKs")
+    replaceCiks = None if removed is None else changed + removed
+    issues = []
+    chunks = parseChunks(changed, workers, metrics, issues)
+    if shard is None:
+        ok, snapshotOk = loadChunks(chunks, metrics, replaceCiks)
+        if ok:
+            manifest.saveManifest(current, config.MANIFEST_PATH_FINANCIALS)
+            quality.saveIssues(issues, replaceCiks=replaceCiks)
+            with metrics.timer("screen_cache"):
+                screen_cache.refresh(logger, warm=snapshotOk)
+    else:
+        ok = writeShard(chunks, metrics, shard, current, ciks, allCiks, issues)
+    problemCikCount = len({issue[0] for issue in issues})
+    metrics.count("issues", len(issues))
+    metrics.count("problem_ciks", problemCikCount)
 
     end_time = time.perf_counter()
     elapsed_time = end_time - start_time
-    logger.debug(f"{problemCikCount} CIKs with issues")
+    logger.debug(f"{problemCikCount} CIKs with {len(issues)} issues")
+    for cik, seconds in metrics.slowestCiks()[:5]:
+        utils.logCik(logger.debug, cik, f"took {seconds:.3f} seconds")
+    metrics.writeJson(
+        config.METRICS_PATH_FINANCIALS,
+        job="update_financials",
+        ok=ok,
+        full=removed is None,
+        workers=workers,
+        shard=None if shard is None else f"{shard[0]}/{shard[1]}",
+        seconds=round(elapsed_time, 6),
+    )
+    metrics.writePrometheus(
+        config.PROMETHEUS_PATH_FINANCIALS, "update_financials", elapsed_time, ok
+    )
+    logger.info(f"Elapsed time: {elapsed_time:.2f} seconds")
+    print(f"Elapsed time: {elapsed_time:.2f} seconds")
+    return 0 if ok else 1
+
+
+def merge(shardCount: int) -> int:
+    """
+    Loads the output of a sharded run (see run) once all shardCount shards are present, intact
+    and built from the same inputs, as one full load: atomic through Postgres, as for a full run.
+    The manifest and concept issues of all shards are saved too, so the next run can be
+    incremental.
+
+    Returns:
+        int - exit status, 1 if a shard is missing or inconsistent and nothing was loaded.
+    """
+    start_time = time.perf_counter()
+    metrics = RunMetrics()
+    try:
+        with metrics.timer("validate"):
+            metas = shards.loadShards(shardCount)
+    except shards.ShardError as e:
+        logger.error(f"Not loading {shardCount} shards:\n{e}")
+        return 1
+    if not prepareTables():
+        return 1
+    merged = shards.mergedManifest(metas)
+    issues = shards.readIssues(metas)
+    facts = sum(meta["facts"] for meta in metas)
+    ciks = len(merged.cikToFingerprint)
+    logger.info(f"Merging {shardCount} shards: {facts} facts of {ciks} CIKs")
+    ok, snapshotOk = loadChunks(shards.readChunks(metas), metrics)
+    if ok:
+        manifest.saveManifest(merged, config.MANIFEST_PATH_FINANCIALS)
+        quality.saveIssues(issues)
+        with metrics.timer("screen_cache"):
+            screen_cache.refresh(logger, warm=snapshotOk)
+    metrics.count("issues", len(issues))
+
+    elapsed_time = time.perf_counter() - start_time
+    metrics.writeJson(
+        config.METRICS_PATH_FINANCIALS,
+        job="update_financials",
+        ok=ok,
+        full=True,
+        shards=shardCount,
+        seconds=round(elapsed_time, 6),
+    )
+    metrics.writePrometheus(
+        config.PROMETHEUS_PATH_FINANCIALS, "update_financials", elapsed_time, ok
+    )
     logger.info(f"Elapsed time: {elapsed_time:.2f} seconds")
     print(f"Elapsed time: {elapsed_time:.2f} seconds")
-    # shutil.copyfile(config.LOG_PATH, os.path.join(config.LOG_DIR, "copy.log"))
+    return 0 if ok else 1
+
 
+def prepareTables() -> bool:
+    """
+    Returns:
+        bool: False if the tables a load writes are not in place and cannot be created, in which
+        case nothing should be parsed.
+    """
+    try:
+        schema.prepareTables(LOAD_TABLES, logger)
+    except schema.SchemaError as e:
+        logger.error(f"Not loading, tables are missing or out of date:\n{e}")
+        return False
+    return True
+
+
+def parseChunks(ciks: list[str], workers: int, metrics: RunMetrics, issues: list[tuple]):
+    """
+    Parses the CIKs (see processCiks) and yields their facts in chunks of about
+    config.PIPELINE_CHUNK_FACTS facts.
+
+    Parameters:
+        issues: list[tuple] - the CIKs' concept issues are appended to it.
+    """
+    chunk = FactStore()
+    for cik, cikStore, cikIssues, cikMetrics in processCiks(ciks, workers):
+        issues.extend(cikIssues)
+        chunk.extend(cikStore)
+        metrics.merge(cikMetrics)
+        if len(chunk) >= config.PIPELINE_CHUNK_FACTS:
+            yield chunk
+            chunk = FactStore()
+    if len(chunk):
+        yield chunk
 
-def fetchCiks() -> list:
-    rows = supabase_utils.batchFetch("companies", ["cik"], logger)
-    return [row["cik"] for row in rows]
+
+def loadChunks(
+    chunks: Iterable[FactStore], metrics: RunMetrics, replaceCiks: list[str] = None
+) -> tuple[bool, bool]:
+    """
+    Loads chunks of facts into financials, financials_annual and, if pyarrow is installed, the
+    snapshot, each through its own writer thread, while the chunks are still being produced.
+
+    Parameters:
+        replaceCiks: list[str] - If given, only these CIKs' rows are replaced. See loadTable.
+
+    Returns:
+        tuple[bool, bool]: True if financials and financials_annual were written in full, and
+        True if the snapshot was written with the same facts.
+    """
+    snapshotWriter = None
+    if snapshot.isAvailable():
+        snapshotWriter = snapshot.FinancialsWriter(logger, replaceCiks)
+    writers = [
+        ChunkWriter(
+            "financials",
+            lambda stores, m: loadFinancials(stores, m, replaceCiks),
+            logger,
+            config.PIPELINE_QUEUE_CHUNKS,
+        ),
+        ChunkWriter(
+            "annual",
+            lambda stores, m: loadAnnualFinancials(stores, m, replaceCiks),
+            logger,
+            config.PIPELINE_QUEUE_CHUNKS,
+        ),
+    ]
+    if snapshotWriter:
+
+        def writeSnapshot(stores, m) -> bool:
+            for store in stores:
+                snapshotWriter.add(store)
+            return True
+
+        writers.append(
+            ChunkWriter("snapshot", writeSnapshot, logger, config.PIPELINE_QUEUE_CHUNKS)
+        )
+
+    try:
+        results = writeChunks(chunks, writers, metrics)
+    except BaseException:
+        if snapshotWriter:
+            snapshotWriter.abort()
+        raise
+    ok = results["financials"] and results["annual"]
+    snapshotOk = False
+    if snapshotWriter:
+        with metrics.timer("snapshot"):
+            if ok and results["snapshot"]:
+                try:
+                    snapshotOk = snapshotWriter.close()
+                except Exception as e:
+                    logger.error(f"Error writing financials snapshot: {e}")
+                    snapshotWriter.abort()
+            else:
+                snapshotWriter.abort()
+    return ok, snapshotOk
+
+
+def writeShard(
+    chunks: Iterable[FactStore],
+    metrics: RunMetrics,
+    shard: tuple[int, int],
+    current: manifest.Manifest,
+    ciks: list[str],
+    allCiks: list[str],
+    issues: list[tuple],
+) -> bool:
+    """
+    Writes chunks of facts as the output of one shard (see shards.ShardWriter), on a writer
+    thread like loadChunks.
+
+    Parameters:
+        shard: tuple[int, int] - (i, N).
+
+        issues: list[tuple] - the shard's concept issues, complete once chunks is exhausted.
+
+    Returns:
+        bool: True if the shard was written.
+    """
+
+    def write(stores, m) -> bool:
+        for store in stores:
+            shardWriter.add(store)
+        return True
+
+    shardWriter = shards.ShardWriter(*shard)
+    writer = ChunkWriter("shard", write, logger, config.PIPELINE_QUEUE_CHUNKS)
+    try:
+        ok = writeChunks(chunks, [writer], metrics)["shard"]
+        if ok:
+            shardWriter.close(current, ciks, allCiks, issues)
+            logger.info(f"Wrote shard to {shardWriter.directory}")
+    except BaseException:
+        shardWriter.abort()
+        raise
+    if not ok:
+        shardWriter.abort()
+    return ok
+
+
+def writeChunks(
+    chunks: Iterable[FactStore], writers: list[ChunkWriter], metrics: RunMetrics
+) -> dict[str, bool]:
+    """
+    Hands each chunk to every writer and waits for them to finish. If producing the chunks
+    fails, the writers are aborted.
+
+    Returns:
+        dict[str, bool] - each writer's result by name.
+    """
+    try:
+        with metrics.timer("process"):
+            for chunk in chunks:
+                metrics.count("chunks")
+                with metrics.timer("backpressure"):
+                    for writer in writers:
+                        writer.put(chunk)
+    except BaseException:
+        for writer in writers:
+            writer.abort()
+        raise
+    with metrics.timer("drain"):
+        results = {writer.name: writer.finish() for writer in writers}
+    for writer in writers:
+        metrics.merge(writer.metrics)
+    return results
+
+
+def loadFinancials(
+    stores: Iterable[FactStore], metrics: RunMetrics = None, replaceCiks: list[str] = None
+) -> bool:
+    """
+    Replaces the whole financials table with the facts of stores, or only the rows of
+    replaceCiks if given. See loadTable.
+
+    Returns:
+        bool: True if every row was written.
+    """
+    return loadTable(
+        schema.FINANCIALS.name,
+        FINANCIALS_COLUMNS,
+        FINANCIALS_KEY,
+        FactStore.rows,
+        stores,
+        metrics,
+        replaceCiks,
+    )
+
+
+def loadAnnualFinancials(
+    stores: Iterable[FactStore], metrics: RunMetrics = None, replaceCiks: list[str] = None
+) -> bool:
+    """
+    Rebuilds the financials_annual pivot from the facts, the same way loadFinancials loads
+    financials. Each store must hold all facts of its CIKs.
+
+    Returns:
+        bool: True if every row was written.
+    """
+    return loadTable(
+        ANNUAL_TABLE,
+        ANNUAL_COLUMNS,
+        ANNUAL_KEY,
+        FactStore.annualRows,
+        stores,
+        metrics,
+        replaceCiks,
+    )
+
+
+def loadTable(
+    tablename: str,
+    columns: list[str],
+    key: str,
+    rowsOf,
+    stores: Iterable[FactStore],
+    metrics: RunMetrics = None,
+    replaceCiks: list[str] = None,
+) -> bool:
+    """
+    Writes the rows of each store as it arrives. Through Postgres, when it is configured, the
+    rows stream into one COPY that is swapped in atomically (or, with replaceCiks, applied in
+    one transaction); else the table (or replaceCiks' rows) is cleared and each store's rows
+    are inserted through the Supabase REST API.
+
+    Parameters:
+        rowsOf: function - returns a store's rows, e.g. FactStore.rows.
+
+        stores: Iterable[FactStore] - consumed once.
+
+        replaceCiks: list[str] - If given, only these CIKs' rows are replaced.
+
+    Returns:
+        bool: True if every row was written.
+    """
+    if postgres_utils.isAvailable():
+        rows = (row for store in stores for row in rowsOf(store))
+        if replaceCiks is None:
+            count = postgres_utils.bulkLoad(tablename, columns, rows, logger)
+        else:
+            count = postgres_utils.replaceWhereIn(
+                tablename, "cik", replaceCiks, columns, rows, logger
+            )
+        recordRows(metrics, count, count)
+        return True
+    if replaceCiks is None:
+        cleared = supabase_utils.truncate(tablename, logger)
+    else:
+        cleared = supabase_utils.deleteWhereIn(tablename, "cik", replaceCiks, logger)
+    if not cleared:
+        # Inserting would leave old rows mixed in; the manifest is not saved, so the next run
+        # loads these CIKs again
+        return False
+    summary = supabase_utils.WriteSummary(tablename)
+    emitted = 0
+    for store in stores:
+        rows = rowsToDicts(rowsOf(store), columns)
+        summary.add(supabase_utils.batchInsert(tablename, rows, logger, onConflict=key))
+        emitted += len(rows)
+    recordRows(metrics, emitted, summary=summary)
+    return summary.ok
+
+
+def rowsToDicts(rows, columns: list[str] = FINANCIALS_COLUMNS) -> list[dict]:
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def recordRows(
+    metrics: RunMetrics | None, emitted: int, written: int = None, summary=None
+) -> None:
+    """
+    Counts rows handed to a load and, from its WriteSummary if it has one, rows written.
+    """
+    if metrics is None:
+        return
+    metrics.count("rows_emitted", emitted)
+    if summary is None:
+        metrics.count("rows_written", written)
+    else:
+        metrics.recordWrite(summary)
+
+
+def processCiks(ciks: list[str], workers: int = 1):
+    """
+    Yields (cik, FactStore, issues, RunMetrics) for each CIK, in the same order as ciks.
+
+    Parameters:
+        workers: int - number of processes to spread the CIKs over. Each worker opens its
+        own CompanyFactsArchive. 1 processes everything in this process.
+    """
+    minIssueYear = datetime.today().year - config.ISSUE_YEARS
+    if workers <= 1:
+        with CompanyFactsArchive(config.ZIP_PATH) as archive:
+            for cik in ciks:
+                yield processCik(cik, archive, minIssueYear)
+        return
+
+    # Small chunks keep the workers evenly loaded despite very uneven company sizes
+    chunksize = max(1, min(config.PIPELINE_CIKS_PER_TASK, len(ciks) // (workers * 16)))
+    tasks = [ciks[i : i + chunksize] for i in range(0, len(ciks), chunksize)]
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=initWorker,
+        initargs=(config.ZIP_PATH, minIssueYear),
+    ) as executor:
+        for results in boundedMap(
+            executor, processCiksInWorker, tasks, workers * config.PIPELINE_TASKS_PER_WORKER
+        ):
+            yield from results
+
+
+def processCik(
+    cik: str, archive: CompanyFactsArchive, minIssueYear: int
+) -> tuple[str, FactStore, list[tuple], RunMetrics]:
+    """
+    Parses one CIK's companyfacts JSON.
+
+    Parameters:
+        minIssueYear: int - first calendar year to check for concept issues.
+
+    Returns:
+        tuple[str, FactStore, list[tuple], RunMetrics] - the CIK, a FactStore holding its facts,
+        its concept issues as quality.ISSUE_COLUMNS rows, and the time spent in each stage.
+    """
+    if cik in profileCiks:
+        profiler = cProfile.Profile()
+        result = profiler.runcall(parseCik, cik, archive, minIssueYear)
+        path = os.path.join(config.PROFILE_DIR, f"CIK{cik}.prof")
+        os.makedirs(config.PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(path)
+        utils.logCik(logger.info, cik, f"profile written to {path}")
+        return result
+    return parseCik(cik, archive, minIssueYear)
+
+
+def parseCik(
+    cik: str, archive: CompanyFactsArchive, minIssueYear: int
+) -> tuple[str, FactStore, list[tuple], RunMetrics]:
+    metrics = RunMetrics()
+    start = time.perf_counter()
+    store = FactStore()
+    issues = []
+    try:
+        with metrics.timer("read"):
+            content = archive.read(cik)
+        metrics.count("bytes_read", len(content))
+        with metrics.timer("decode"):
+            data = extractFacts(content, concepts.strToAlias)
+        issues = resolveFacts(cik, data, store, metrics, minIssueYear)
+    except KeyError as ke:
+        utils.logCik(logger.debug, cik, f"KeyError: {ke}")
+    metrics.count("ciks_processed")
+    metrics.recordCik(cik, time.perf_counter() - start)
+    return cik, store, issues, metrics
+
+
+def resolveFacts(
+    cik: str, data: dict, store: FactStore, metrics: RunMetrics, minIssueYear: int = None
+) -> list[tuple]:
+    """
+    Applies the resolution rules to one company's decoded companyfacts data and adds its periods,
+    resolved facts and derived metrics to store. The point-in-time store runs the same rules on
+    the facts filed by a date.
+
+    Parameters:
+        store: FactStore - an empty store, as derived metrics are computed over all of it.
+
+        minIssueYear: int - first calendar year checked for concept issues. None skips the check.
+
+    Returns:
+        list[tuple] - the company's concept issues.
+    """
+    issues = []
+    with metrics.timer("periods"):
+        periods = createPeriodIndex(data, cik)
+    if not periods:
+        return issues
+    metrics.count("facts_seen", countFacts(data))
+    with metrics.timer("resolve"):
+        table = addFinancialValues(data, periods)
+    with metrics.timer("derive"):
+        addMissingOneQuarterConcepts(periods, cik, table)
+    if minIssueYear is not None:
+        with metrics.timer("issues"):
+            issues = findConceptIssues(cik, periods.fps, minIssueYear, useExcuses=True)
+    with metrics.timer("store"):
+        store.addFinancialPeriods(cik, periods.fps)
+    metrics.count("periods", len(periods))
+    metrics.count("facts_kept", len(store))
+    with metrics.timer("derived_metrics"):
+        metrics.count("facts_derived", derived.addDerivedMetrics(store))
+    return issues
+
+
+def countFacts(data: dict) -> int:
+    """
+    Returns the number of entries of wanted tags, i.e. the facts addFinancialValues goes over.
+    """
+    return sum(
+        len(entries)
+        for factType in ["dei", "us-gaap"]
+        for aliasStr, metadata in data["facts"].get(factType, {}).items()
+        if aliasStr in concepts.strToAlias
+        for entries in metadata["units"].values()
+    )
+
+
+workerArchive: CompanyFactsArchive = None
+workerMinIssueYear: int = None
+profileCiks: set[str] = set()
+
+
+def initWorker(zipPath: str, minIssueYear: int) -> None:
+    global workerArchive, workerMinIssueYear
+    workerArchive = CompanyFactsArchive(zipPath)
+    workerMinIssueYear = minIssueYear
+
+
+def processCiksInWorker(ciks: list[str]) -> list[tuple[str, FactStore, list[tuple], RunMetrics]]:
+    return [processCik(cik, workerArchive, workerMinIssueYear) for cik in ciks]
+
+
+def fetchCiks(path: str = None) -> list[str]:
+    """
+    Returns the CIKs in the companies table.
+
+    Through the REST API the list is cached at config.CIK_CACHE_PATH together with the table's
+    row count and largest CIK. While those still match, the cached list is used and the table
+    is not paged through. The companies table is only ever replaced as a whole, so a change of
+    membership that keeps both the same is not expected.
+    """
+    if postgres_utils.isAvailable():
+        return sorted(postgres_utils.fetchColumn("companies", "cik"))
+    path = path or config.CIK_CACHE_PATH
+    count, maxCik = supabase_utils.tableSignature("companies", "cik")
+    cached = loadCikCache(path)
+    if cached and cached["count"] == count and cached["maxCik"] == maxCik:
+        logger.info(f"Using {count} cached CIKs")
+        return cached["ciks"]
+    rows = supabase_utils.batchFetch(
+        "companies", ["cik"], logger, orderBy="cik", parallel=config.FETCH_PARALLEL_SUPABASE
+    )
+    ciks = [row["cik"] for row in rows]
+    saveCikCache(path, {"count": count, "maxCik": maxCik, "ciks": ciks})
+    return ciks
+
+
+def loadCikCache(path: str) -> dict | None:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def saveCikCache(path: str, cache: dict) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w") as f:
+        json.dump(cache, f, separators=(",", ":"))
+    os.replace(tmpPath, path)
 
 
 def createFinancialPeriods(
@@ -161,6 +784,20 @@ def createFinancialPeriods(
         list[FinancialPeriod] | None - a list of FinancialPeriod objects filled out with data and
         sorted in chronological order. Returns None if the list cannot be created.
     """
+    periods = createPeriodIndex(data, cik)
+    if periods is None:
+        return None
+    table = addFinancialValues(data, periods)
+    addMissingOneQuarterConcepts(periods, cik, table)
+    return periods.fps
+
+
+def createPeriodIndex(data: dict, cik: str) -> PeriodIndex | None:
+    """
+    Returns:
+        PeriodIndex | None - the company's empty FinancialPeriods, one per distinct 10-K/10-Q
+        Assets date, sorted chronologically. Returns None if the data is not usable.
+    """
     if not checkData(data, cik):
         return None
 
@@ -170,16 +807,12 @@ def createFinancialPeriods(
     endToFinancialPeriod = {}
     for e in processed:
         if isDesiredForm(e["form"]):
-            endToFinancialPeriod[utils.strToDate(e["end"])] = FinancialPeriod(
-                cik, utils.strToDate(e["end"])
-            )
+            end = utils.strToOrdinal(e["end"])
+            endToFinancialPeriod[end] = FinancialPeriod(cik, utils.ordinalToDate(end))
     financialPeriods = [fp for fp in endToFinancialPeriod.values()]
     addCalendarAttributes(financialPeriods)
     financialPeriods.sort(key=lambda fp: fp.end)
-
-    addFinancialValues(data, endToFinancialPeriod, financialPeriods)
-    addMissingOneQuarterConcepts(financialPeriods, cik)
-    return financialPeriods
+    return PeriodIndex(financialPeriods)
 
 
 def checkData(data: dict, cik: str) -> bool:
@@ -206,18 +839,16 @@ def processEntries(entries: list[dict]):
     """
     processed = []
     entriesSorted = sorted(entries, key=lambda e: e["end"])
-    for i in range(len(entriesSorted)):
-        entry = entriesSorted[i]
+    ends = utils.strsToOrdinals([e["end"] for e in entriesSorted]).tolist()
+    prev = None
+    for entry, cur in zip(entriesSorted, ends):
         if not isDesiredForm(entry["form"]):
             continue
         # If two dates are only one day apart, skip the later one
-        if processed:
-            prev = utils.strToDate(processed[-1]["end"])
-            cur = utils.strToDate(entry["end"])
-            diff = (cur - prev).days
-            if diff <= 1:
-                continue
+        if prev is not None and cur - prev <= 1:
+            continue
         processed.append(entry)
+        prev = cur
     return processed
 
 
@@ -225,182 +856,146 @@ def addCalendarAttributes(fps: list[FinancialPeriod]) -> None:
     """
     Adds calendar year and calendar period to each item in a list of FinancialPeriods.
     """
+    if not fps:
+        return
     fpsReverseChronological = sorted(fps, key=lambda fp: fp.end, reverse=True)
-    cyqes = [None] * len(fpsReverseChronological)
-    for i in range(len(fpsReverseChronological)):
-        fp = fpsReverseChronological[i]
-        cyqe = getCyqePriorTo(cyqes[i - 1]) if i > 0 else getMostRecentCyqe(fp.end)
-        diff = (fp.end - cyqe).days
+    ends = np.array([fp.end.toordinal() for fp in fpsReverseChronological], dtype=np.int64)
+    mostRecent = getMostRecentCyqes(ends)
+    # Each period takes the quarter before the previous period's, so quarters can run down to
+    # len(fps) below the earliest most recent one
+    first = int(mostRecent.min()) - len(fps)
+    cyqeEnds = getCyqeOrdinals(np.arange(first, int(mostRecent.max()) + 1)).tolist()
+    ends = ends.tolist()
+    mostRecent = mostRecent.tolist()
+    cyqe = None
+    for i, fp in enumerate(fpsReverseChronological):
+        cyqe = cyqe - 1 if i > 0 else mostRecent[i]
+        diff = ends[i] - cyqeEnds[cyqe - first]
         if diff < 0 or diff > 180:
-            cyqe = getMostRecentCyqe(fp.end)
-        fp.cy = cyqe.year
-        fp.cp = getPeriod(cyqe)
-        cyqes[i] = cyqe
+            cyqe = mostRecent[i]
+        fp.cy = EPOCH_YEAR + cyqe // 4
+        fp.cp = concepts.Period(cyqe % 4 + 1)
 
 
 def isDesiredForm(form: str) -> bool:
     return form == "10-K" or form == "10-Q"
 
 
-def getMostRecentCyqe(date: datetime) -> datetime:
-    y = date.year
-    if date < datetime(y, 3, 31):
-        return datetime(y - 1, 12, 31)
-    if date < datetime(y, 6, 30):
-        return datetime(y, 3, 31)
-    if date < datetime(y, 9, 30):
-        return datetime(y, 6, 30)
-    if date < datetime(y, 12, 31):
-        return datetime(y, 9, 30)
-    return datetime(y, 12, 31)
+def getMostRecentCyqes(ends: np.ndarray) -> np.ndarray:
+    """
+    Gets the most recent calendar quarter end on or before each date.
 
+    Parameters:
+        ends: np.ndarray - date ordinals.
 
-def getCyqePriorTo(cyqe: datetime) -> datetime:
-    return getMostRecentCyqe(cyqe - timedelta(days=1))
+    Returns:
+        np.ndarray - calendar quarter end of each date, as a quarter number counted from the
+        first quarter of 1970 (EPOCH_YEAR * 4 + quarter - 1 is 0).
+    """
+    days = utils.ordinalsToDatetime64(ends)
+    months = days.astype("datetime64[M]").astype(np.int64)
+    quarters = months // 3
+    quarterEnds = ((quarters + 1) * 3).astype("datetime64[M]").astype("datetime64[D]") - 1
+    return np.where(days >= quarterEnds, quarters, quarters - 1)
 
 
-def getPeriod(cyqe: datetime) -> concepts.Period:
-    return concepts.Period(cyqe.month // 3)
+def getCyqeOrdinals(quarters: np.ndarray) -> np.ndarray:
+    """
+    Returns the date ordinal of the last day of each quarter number (see getMostRecentCyqes).
+    """
+    nextQuarterStarts = ((quarters + 1) * 3).astype("datetime64[M]").astype("datetime64[D]")
+    return utils.datetime64ToOrdinals(nextQuarterStarts - 1)
 
 
 def addFinancialValues(
-    data: dict, endToFp: dict[datetime, FinancialPeriod], fps: list[FinancialPeriod]
-) -> None:
+    data: dict, periods: PeriodIndex, table: ResolutionTable = None
+) -> ResolutionTable:
     """
-    Adds FinancialValues taken directly from the data.
+    Adds FinancialValues taken directly from the data, resolving competing values as they come.
 
     Parameters:
-        fps: list[FinancialPeriod] - list of FinancialPeriods sorted chronologically
+        periods: PeriodIndex - the company's FinancialPeriods
+
+        table: ResolutionTable - table to resolve into. A new one is created if not given.
+
+    Returns:
+        ResolutionTable - the table holding the resolved values.
     """
+    if table is None:
+        table = ResolutionTable()
     for factType in ["dei", "us-gaap"]:
         for aliasStr, metadata in data["facts"][factType].items():
             if aliasStr not in concepts.strToAlias:
                 continue
             for units, entries in metadata["units"].items():  # units e.g. USD or shares
-                entries.sort(key=lambda e: e["end"])
-                for entry in entries:
+                ends = utils.strsToOrdinals([e["end"] for e in entries])
+                # Stable, so entries with the same end keep their order, as sorting on the
+                # "end" strings would
+                order = np.argsort(ends, kind="stable")
+                entries = [entries[i] for i in order.tolist()]
+                ends = ends[order]
+                starts = np.array(
+                    [utils.strToOrdinal(e["start"]) if "start" in e else NO_START for e in entries],
+                    dtype=np.int64,
+                )
+                durations = getDurationsFromDates(starts, ends)
+                for entry, end, duration in zip(entries, ends.tolist(), durations):
                     # if not isDesiredForm(entry['form']):
                     #     continue
-                    end = utils.strToDate(entry["end"])
                     if units == "shares":
-                        fp = getMostRecentFp(fps, end)
-                        if not fp:
-                            continue
+                        fp = periods.getMostRecent(end)
                     else:
-                        if end not in endToFp:
-                            continue
-                        fp = endToFp[end]
+                        fp = periods.get(end)
+                    if not fp:
+                        continue
                     alias: concepts.Concept = concepts.strToAlias[aliasStr]
                     val = int(entry["val"])
                     filingFY = int(entry["fy"]) if entry["fy"] else None
                     fv = FinancialValue(
-                        alias.concept, alias, val, units, filingFiscalYear=filingFY
+                        alias.concept,
+                        alias,
+                        val,
+                        units,
+                        filingFiscalYear=filingFY,
+                        duration=duration,
                     )
-                    if "start" in entry:
-                        fv.duration = getDurationFromDates(
-                            utils.strToDate(entry["start"]), end
-                        )
-                    existing: list[FinancialValue] = fp.conceptToFinancialValues[
-                        alias.concept.name
-                    ]
-                    conditionallyAddFinancialValue(existing, fv)
-
-
-def getMostRecentFp(
-    fps: list[FinancialPeriod], date: datetime
-) -> FinancialPeriod | None:
-    """
-    Gets the most recent FinancialPeriod within 60 days before to 7 days after the given date.
-
-    Parameters:
-        fps: list[FinancialPeriod] - list of FinancialPeriods sorted chronologically.
-
-        date: datetime - the date from which to find the most recent FinancialPeriod end.
-    """
-    for i in range(len(fps)):
-        diff = (date - fps[i].end).days
-        if -7 <= diff <= 60:
-            return fps[i]
-        if diff < -7:
-            return None
-    return None
-
-
-def conditionallyAddFinancialValue(
-    existingValues: list[FinancialValue], newValue: FinancialValue
-) -> None:
-    """
-    Determines whether and how a FinancialValue should be added to a list, then does it.
-
-    The new value can be appended, skipped, or replace an existing element.
-    """
-    # If the list is empty, append it
-    if not existingValues:
-        existingValues.append(newValue)
-        return
-
-    # For shares, just take the higher value
-    if newValue.units == "shares":
-        if newValue.value >= existingValues[0].value:
-            existingValues[0] = newValue
-        return
-
-    # If the duration doesn't exist, append it
-    if not any(ev.duration == newValue.duration for ev in existingValues):
-        existingValues.append(newValue)
-        return
-
-    # Replace
-    for i in range(len(existingValues)):
-        exist = existingValues[i]
-        if exist.duration == newValue.duration and newValue.filingFiscalYear:
-            # Replace if more recent filingFiscalYear
-            if (
-                not exist.filingFiscalYear
-            ) or newValue.filingFiscalYear > exist.filingFiscalYear:
-                existingValues[i] = newValue
-                return
-            # Replace if alias has higher weight
-            if (
-                exist.filingFiscalYear == newValue.filingFiscalYear
-                and newValue.alias.weight >= exist.alias.weight
-            ):
-                existingValues[i] = newValue
-                return
-    return
+                    table.offer(fp, alias.concept.name, fv)
+    return table
 
 
 def addMissingOneQuarterConcepts(
-    fps: list[FinancialPeriod], cik: str 
+    fps: PeriodIndex | list[FinancialPeriod], cik: str, table: ResolutionTable = None
 ) -> None:
     """
+    Derives OneQuarter values from consecutive periods, e.g. Year - ThreeQuarters, in one
+    chronological pass. Values derived for a period can in turn be used by the next one.
+
     Parameters
-    fps: list[FinancialPeriod]
-        A list of FinancialPeriods sorted in chronological order
+    fps: PeriodIndex | list[FinancialPeriod]
+        The company's FinancialPeriods in chronological order
+    table: ResolutionTable
+        The table the periods' values were resolved with. Built from fps if not given.
     """
+    if table is None:
+        table = ResolutionTable.fromFinancialPeriods(fps)
     for i in range(1, len(fps)):
         fp = fps[i]
+        oldFp = fps[i - 1]
         for concept, fvs in fp.conceptToFinancialValues.items():
-            alreadyHas = any(fv.duration == concepts.Duration.OneQuarter for fv in fvs)
-            noNeed = any(fv.units == "shares" or fv.duration == None for fv in fvs)
+            slots = table.get(fp, concept)
+            oldSlots = table.get(oldFp, concept)
+            if not fvs or oldSlots is None:
+                continue
+            alreadyHas = slots.has(concepts.Duration.OneQuarter)
+            noNeed = slots.has(None) or any(fv.units == "shares" for fv in fvs)
             if alreadyHas or noNeed:
                 continue
             for fv in fvs:
                 if fv.duration == concepts.Duration.Other:
                     continue
-                oldFp = fps[i - 1]
-                oldFvs = oldFp.conceptToFinancialValues[concept]
-                prevFv = next(
-                    (
-                        oldFv
-                        for oldFv in oldFvs
-                        if oldFv.duration
-                        and oldFv.duration.value == fv.duration.value - 1
-                    ),
-                    None,
-                )
+                prevFv = oldSlots.first(concepts.Duration(fv.duration.value - 1))
                 if prevFv:
-                    fvs.append(
+                    slots.append(
                         FinancialValue(
                             concept,
                             fv.alias,
@@ -413,93 +1008,145 @@ def addMissingOneQuarterConcepts(
     return
 
 
-def logConceptIssues(
-    cik: str, fps: list[FinancialPeriod], useExcuses=False
-) -> int:
+def findConceptIssues(
+    cik: str, fps: list[FinancialPeriod], minYear: int, useExcuses=False
+) -> list[tuple]:
     """
     Returns:
-        int: 1 if there are issues, 0 if no issues
+        list[tuple] - one quality.ISSUE_COLUMNS row per (period, concept, issue kind).
 
     Parameters:
         fps: list[FinancialPeriod] - a list of populated FinancialPeriods, sorted chronologically.
 
+        minYear: int - periods in earlier calendar years are not checked.
+
         useExcuses: bool - If True, skip CIKs which are listed in concepts.excuses.
     """
     if useExcuses and cik in concepts.excuses:
-        return 0
-    problemCount = 0
+        return []
+    issues = []
     for i in range(2, len(fps)):
         fp = fps[i]
-        if fp.cy < datetime.today().year - 10:
+        if fp.cy < minYear:
             continue
-        for c in concepts.Concept:
-            concept = c.name
-            fvs = fp.conceptToFinancialValues[concept]
-            pre = f"{utils.dateToStr(fp.end)} {concept}"
-            msg = None
+        period = None
+        for c in concepts.reportedConcepts:
+            fvs = fp.conceptToFinancialValues[c.name]
+            kind = None
+            detail = ""
             if not fvs:
-                msg = f"{pre}: no FinancialValues"
+                kind = quality.MISSING
             elif fvs[0].units == "shares":
                 if len(fvs) > 1:
-                    msg = f"{pre}: {len(fvs)} values for concept"
+                    kind = quality.MULTIPLE_SHARE_VALUES
             else:  # USD
                 if (
                     len(fvs) == 1
                     and fvs[0].duration
                     and fvs[0].duration != concepts.Duration.OneQuarter
                 ):
-                    msg = f"{pre} ({fvs[0].alias.name}): one value but with {fvs[0].duration.name} duration"
+                    kind = quality.NON_QUARTER_DURATION
+                    detail = f"{fvs[0].alias.name} {fvs[0].duration.name}"
                 elif len(fvs) > 1:
                     if not any(
                         fv.duration and fv.duration != concepts.Duration.OneQuarter
                         for fv in fvs
                     ):
-                        msg = f"{pre}: {len(fvs)} values but none with OneQuarter duration"
-            if msg:
-                utils.logCik(logger.debug, cik, msg)
-                problemCount += 1
-    if problemCount > 0:
-        msg = f"{problemCount} problems"
-        utils.logCik(logger.debug, cik, msg)
-        jsonFilename = f"CIK{cik}.json"
-        extractZipFileToJson(jsonFilename)
-        return 1
-    return 0
-
-
-def getDurationFromDates(start: datetime, end: datetime) -> concepts.Duration:
-    days = (end - start).days
-    if 60 < days < 120:
-        return concepts.Duration.OneQuarter
-    if 150 < days < 210:
-        return concepts.Duration.TwoQuarters
-    if 240 < days < 300:
-        return concepts.Duration.ThreeQuarters
-    if 310 < days < 400:
-        return concepts.Duration.Year
-    return concepts.Duration.Other
-
-
-def extractZipFileToJson(filename: str):
-    with zipfile.ZipFile(config.ZIP_PATH, "r") as zf:
-        with zf.open(filename) as inFile:
-            content = inFile.read()
-            data = json.loads(content.decode("utf-8"))
-            filepath = os.path.join(config.PROBLEM_CIK_DIR, filename)
-            os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            with open(filepath, "w") as outFile:
-                json.dump(data, outFile, indent=2)
-
-
-# Download companyfacts.zip
-# headers = {'User-Agent': config.EMAIL}
-# with requests.get(config.URL_SEC_COMPANYFACTS, headers=headers, stream=True) as r:
-#     r.raise_for_status()
-#     os.makedirs(os.path.dirname(config.ZIP_PATH), exist_ok=True)
-#     with open(config.ZIP_PATH, "wb") as f:
-#         for chunk in r.iter_content(chunk_size=config.CHUNK_SIZE):
-#             if chunk:
-#                 f.write(chunk)
+                        kind = quality.NO_QUARTER_DURATION
+            if kind:
+                period = period or utils.dateToStr(fp.end)
+                issues.append((cik, period, c.name, kind, len(fvs), detail))
+    if issues:
+        utils.logCik(logger.debug, cik, f"{len(issues)} problems")
+    return issues
+
+
+def getDurationsFromDates(
+    starts: np.ndarray, ends: np.ndarray
+) -> list[concepts.Duration | None]:
+    """
+    Buckets the length of each start-end date range into a Duration.
+
+    Parameters:
+        starts: np.ndarray - start date ordinals, or NO_START for entries without a start.
+
+        ends: np.ndarray - end date ordinals.
+
+    Returns:
+        list[concepts.Duration | None] - one per entry, None where there is no start.
+    """
+    days = ends - starts
+    ids = np.select(
+        [
+            (60 < days) & (days < 120),
+            (150 < days) & (days < 210),
+            (240 < days) & (days < 300),
+            (310 < days) & (days < 400),
+        ],
+        [
+            concepts.Duration.OneQuarter.value,
+            concepts.Duration.TwoQuarters.value,
+            concepts.Duration.ThreeQuarters.value,
+            concepts.Duration.Year.value,
+        ],
+        default=concepts.Duration.Other.value,
+    )
+    ids[starts == NO_START] = NO_DURATION
+    return [DURATIONS[i] for i in ids.tolist()]
+
+
+def downloadCompanyFacts() -> bool:
+    """
+    Downloads companyfacts.zip if the SEC has published a newer one.
+
+    Returns:
+        bool: True if a new archive was downloaded.
+    """
+    return fetch.fetch(
+        config.URL_SEC_COMPANYFACTS, config.ZIP_PATH, logger, verify=fetch.verifyZip
+    )
+
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="Load SEC companyfacts into the financials table")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="number of processes to parse CIKs with"
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="rebuild every CIK instead of only changed ones"
+    )
+    parser.add_argument(
+        "--download", action="store_true", help="download companyfacts.zip first if it changed"
+    )
+    parser.add_argument(
+        "--profile",
+        action="append",
+        metavar="CIK",
+        help=f"run this CIK under cProfile, writing its stats to {config.PROFILE_DIR}",
+    )
+    parser.add_argument(
+        "--shard",
+        type=shards.parseShard,
+        metavar="i/N",
+        help=f"parse only shard i of N (from 0) into {config.SHARD_DIR} instead of loading it",
+    )
+    parser.add_argument(
+        "--merge",
+        type=int,
+        metavar="N",
+        help="check that all N shards are written and consistent, then load them at once",
+    )
+    parser.add_argument(
+        "--extract-issues",
+        action="store_true",
+        help=f"only write the raw JSON of CIKs with concept issues to {config.PROBLEM_CIK_DIR}",
+    )
+    args = parser.parse_args()
+    if args.extract_issues:
+        quality.extractIssueCiks(logger)
+        sys.exit(0)
+    if args.merge:
+        sys.exit(merge(args.merge))
+    if args.download:
+        downloadCompanyFacts()
+    sys.exit(run(workers=args.workers, full=args.full, profile=args.profile, shard=args.shard))
@@ -1,8 +1,11 @@
-from datetime import datetime
+from datetime import date, datetime
 import logging
+import numpy as np
 import config
 import os
 
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()  # datetime64 day 0
+
 
 def dateToStr(d: datetime) -> str:
     return d.strftime("%Y-%m-%d")
@@ -12,6 +15,44 @@ def strToDate(dateStr: str) -> datetime:
     return datetime.strptime(dateStr, "%Y-%m-%d")
 
 
+# Companyfacts repeats the same few thousand dates across every company and tag
+strToOrdinalCache: dict[str, int] = {}
+ordinalToDateCache: dict[int, datetime] = {}
+
+
+def strToOrdinal(dateStr: str) -> int:
+    """
+    Returns the proleptic Gregorian ordinal (datetime.toordinal) of a YYYY-MM-DD string.
+    """
+    ordinal = strToOrdinalCache.get(dateStr)
+    if ordinal is None:
+        try:
+            ordinal = date.fromisoformat(dateStr).toordinal()
+        except ValueError:
+            ordinal = strToDate(dateStr).toordinal()
+        strToOrdinalCache[dateStr] = ordinal
+    return ordinal
+
+
+def strsToOrdinals(dateStrs: list[str]) -> np.ndarray:
+    return np.fromiter(map(strToOrdinal, dateStrs), dtype=np.int64, count=len(dateStrs))
+
+
+def ordinalToDate(ordinal: int) -> datetime:
+    d = ordinalToDateCache.get(ordinal)
+    if d is None:
+        d = ordinalToDateCache[ordinal] = datetime.fromordinal(ordinal)
+    return d
+
+
+def ordinalsToDatetime64(ordinals: np.ndarray) -> np.ndarray:
+    return (ordinals - EPOCH_ORDINAL).astype("datetime64[D]")
+
+
+def datetime64ToOrdinals(days: np.ndarray) -> np.ndarray:
+    return days.astype("datetime64[D]").astype(np.int64) + EPOCH_ORDINAL
+
+
 def configureLogger(logFile: str, level=logging.DEBUG) -> logging.Logger:
     os.makedirs(os.path.dirname(logFile), exist_ok=True)
     logger = logging.getLogger(__name__)
@@ -25,6 +25,16 @@ const concepts = [
   "Cash Flow from Financing Activities",
   "Capital Expenditures",
   "Dividends",
+  "Free Cash Flow",
+  "Revenue TTM",
+  "Net Income TTM",
+  "Free Cash Flow TTM",
+  "Revenue Growth",
+  "Net Income Growth",
+  "Revenue per Share",
+  "Earnings per Share",
+  "Free Cash Flow per Share",
+  "Book Value per Share",
 ];
 
 export default function Home() {
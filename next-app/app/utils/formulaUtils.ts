@@ -122,13 +122,15 @@ export function extractTokens(formula: string): Set<string> {
   return new Set(formula.match(regex));
 }
 
-function getSqlName(token: string): string {
+function getSqlTableName(year: string): string {
+  return `Annual${year}`;
+}
+
+function getTokenYear(token: string, mostRecentYear: string): string {
   if (token === "[Market Cap]") {
-    return "MarketCap";
+    return mostRecentYear;
   }
-  const year = extractYear(token);
-  const concept = extractConceptName(token);
-  return `${concept}${year}`;
+  return extractYear(token);
 }
 
 function getSqlSelectTerm(token: string, mostRecentYear: string): string {
@@ -136,22 +138,17 @@ function getSqlSelectTerm(token: string, mostRecentYear: string): string {
     const sharesOutstanding = getSqlSelectTerm(`[${mostRecentYear} Shares Outstanding]`, mostRecentYear);
     return `(companies.close * ${sharesOutstanding})`;
   }
-  return `${getSqlName(token)}.value`;
+  return `${getSqlTableName(extractYear(token))}."${extractConceptName(token)}"`;
 }
 
-function getSqlJoinStatement(token: string, mostRecentYear: string): string {
-  if (token === "[Market Cap]") {
-    return getSqlJoinStatement(
-      `[${mostRecentYear} Shares Outstanding]`,
-      mostRecentYear
-    );
-  }
-  const concept = getSqlName(token);
-  return `join financials ${concept} on companies.cik = ${concept}.cik
-            and ${concept}.concept = '${extractConceptName(token)}'
-            and ${concept}.year = ${extractYear(token)}
-            and ${concept}.period = 'Q4'
-            and (${concept}.duration = 'Year' or ${concept}.duration is null)`;
+/**
+ * Joins one year of financials_annual, which has a column per concept holding the Q4 value
+ * with duration Year (or no duration), so each year is joined once however many tokens use it.
+ */
+function getSqlJoinStatement(year: string): string {
+  const table = getSqlTableName(year);
+  return `join financials_annual ${table} on companies.cik = ${table}.cik
+            and ${table}.year = ${year}`;
 }
 
 function getSqlSelectExpression(
@@ -193,9 +190,10 @@ export function getSqlQuery(
     tokens,
     mostRecentYear
   );
-  const joinStatements = [...tokens].map((token) =>
-    getSqlJoinStatement(token, mostRecentYear)
+  const years = new Set(
+    [...tokens].map((token) => getTokenYear(token, mostRecentYear))
   );
+  const joinStatements = [...years].map((year) => getSqlJoinStatement(year));
   const limitStatement = limit > 0 ? `limit ${limit}` : "";
 
   return `
@@ -215,6 +213,133 @@ export function getSqlQuery(
   `;
 }
 
+type FormulaNode =
+  | { kind: "number"; text: string }
+  | { kind: "token"; token: string }
+  | { kind: "negate"; operand: FormulaNode }
+  | { kind: "binary"; operator: string; left: FormulaNode; right: FormulaNode };
+
+function lexFormulaSide(side: string): string[] {
+  const lexemeRegex = /\s*(?:(\[[^\]]+\])|(\d+(?:\.\d*)?|\.\d+)|([-+*/()]))/y;
+  const lexemes: string[] = [];
+  const text = side.trimEnd();
+  lexemeRegex.lastIndex = 0;
+  while (lexemeRegex.lastIndex < text.length) {
+    const match = lexemeRegex.exec(text);
+    if (!match) throw new Error("Unexpected character in formula");
+    lexemes.push(match[1] ?? match[2] ?? match[3]);
+  }
+  return lexemes;
+}
+
+function parseFormulaSide(side: string): FormulaNode {
+  const lexemes = lexFormulaSide(side);
+  let pos = 0;
+
+  const expression = (): FormulaNode => {
+    let node = term();
+    while (lexemes[pos] === "+" || lexemes[pos] === "-") {
+      const operator = lexemes[pos++];
+      node = { kind: "binary", operator, left: node, right: term() };
+    }
+    return node;
+  };
+
+  const term = (): FormulaNode => {
+    let node = factor();
+    while (lexemes[pos] === "*" || lexemes[pos] === "/") {
+      const operator = lexemes[pos++];
+      node = { kind: "binary", operator, left: node, right: factor() };
+    }
+    return node;
+  };
+
+  const factor = (): FormulaNode => {
+    if (pos >= lexemes.length) throw new Error("Unexpected end of formula");
+    const lexeme = lexemes[pos++];
+    if (lexeme.startsWith("[")) return { kind: "token", token: lexeme };
+    if (/^[\d.]/.test(lexeme)) return { kind: "number", text: lexeme };
+    if (lexeme === "-") return { kind: "negate", operand: factor() };
+    if (lexeme === "+") return factor();
+    if (lexeme === "(") {
+      const node = expression();
+      if (lexemes[pos++] !== ")") throw new Error("Missing ) in formula");
+      return node;
+    }
+    throw new Error(`Unexpected ${lexeme} in formula`);
+  };
+
+  const node = expression();
+  if (pos !== lexemes.length) throw new Error(`Unexpected ${lexemes[pos]} in formula`);
+  return node;
+}
+
+function canonicalNode(node: FormulaNode): string {
+  switch (node.kind) {
+    case "number":
+      return node.text;
+    case "token":
+      if (node.token === "[Market Cap]") return node.token;
+      return `[${extractYear(node.token)} ${extractConceptName(node.token)}]`;
+    case "negate":
+      return `(-${canonicalNode(node.operand)})`;
+    case "binary":
+      if (node.operator === "+" || node.operator === "-") {
+        return `(${sumTerms(node, "+").sort().join("")})`;
+      }
+      if (node.operator === "*") {
+        return `(${productFactors(node).sort().join("*")})`;
+      }
+      return `(${canonicalNode(node.left)}/${canonicalNode(node.right)})`;
+  }
+}
+
+function sumTerms(node: FormulaNode, sign: string): string[] {
+  const flipped = sign === "+" ? "-" : "+";
+  if (node.kind === "negate") {
+    return sumTerms(node.operand, flipped);
+  }
+  if (node.kind !== "binary" || (node.operator !== "+" && node.operator !== "-")) {
+    return [sign + canonicalNode(node)];
+  }
+  return [
+    ...sumTerms(node.left, sign),
+    ...sumTerms(node.right, node.operator === "+" ? sign : flipped),
+  ];
+}
+
+function productFactors(node: FormulaNode): string[] {
+  if (node.kind !== "binary" || node.operator !== "*") {
+    return [canonicalNode(node)];
+  }
+  return [...productFactors(node.left), ...productFactors(node.right)];
+}
+
+/**
+ * @returns The formula with token spelling, spacing and the order of the
+ * terms of sums and factors of products normalized, so formulas that screen
+ * the same share a cache entry. Must stay in sync with Screen.canonical in
+ * the ETL, which precomputes results for saved formulas.
+ */
+export function canonicalFormula(formula: string): string {
+  const match = formula.replace(/\u00A0/g, " ").match(/(.+)(<|>)(.+)/);
+  if (!match) throw new Error("Formula must contain < or >");
+  const [, left, operator, right] = match.map((s) => s.trim());
+  return (
+    canonicalNode(parseFormulaSide(left)) +
+    operator +
+    canonicalNode(parseFormulaSide(right))
+  );
+}
+
+/**
+ * @returns The key results are cached under. The year is part of it because
+ * [Market Cap] depends on it. Same as cacheKey in the ETL.
+ */
+export function screenCacheKey(canonical: string, mostRecentYear: string) {
+  return `${mostRecentYear}|${canonical}`;
+}
+
 export async function isValidFormula(
   formula: string,
   dates: string[],
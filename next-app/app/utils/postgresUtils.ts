@@ -1,16 +1,88 @@
 "use server";
 
 import postgres from "postgres";
-import { getSqlQuery } from "@/app/utils/formulaUtils";
+import {
+  canonicalFormula,
+  getSqlQuery,
+  screenCacheKey,
+} from "@/app/utils/formulaUtils";
+import { LruCache } from "@/app/utils/resultCache";
 
 const sql = postgres(process.env.POSTGRES_URL!, { ssl: "require" });
 
+const MAX_CACHED_SCREENS = 1000;
+const MAX_CACHED_ROWS = 500_000;
+// How long a fetched data version is trusted before checking for a new ETL load
+const DATA_VERSION_TTL_MS = 30_000;
+
+const resultCache = new LruCache<postgres.Row[]>(MAX_CACHED_SCREENS, MAX_CACHED_ROWS);
+let dataVersion: { version: string | null; fetchedAt: number } = {
+  version: null,
+  fetchedAt: 0,
+};
+
+/**
+ * @returns The version stamp the ETL bumps after each load, or null if
+ * there is none, in which case results are not cached.
+ */
+async function getDataVersion(): Promise<string | null> {
+  if (Date.now() - dataVersion.fetchedAt < DATA_VERSION_TTL_MS) {
+    return dataVersion.version;
+  }
+  let version: string | null = null;
+  try {
+    const rows = await sql`select version from data_version where id = 1`;
+    version = rows.length ? String(rows[0].version) : null;
+  } catch {
+    version = null;
+  }
+  if (version !== dataVersion.version) {
+    resultCache.clear();
+  }
+  dataVersion = { version, fetchedAt: Date.now() };
+  return version;
+}
+
+function getCacheKey(formula: string, mostRecentYear: string): string | null {
+  try {
+    return screenCacheKey(canonicalFormula(formula), mostRecentYear);
+  } catch {
+    // Let the query report what is wrong with the formula
+    return null;
+  }
+}
+
 export async function fetchResults(formula: string, mostRecentYear: string, limit: number = -1) {
   const clean = formula.replace(/\u00A0/g, " ");
+  const version = await getDataVersion();
+  const cacheKey = version ? getCacheKey(clean, mostRecentYear) : null;
+  const memoryKey = `${version}|${limit}|${cacheKey}`;
+  if (cacheKey) {
+    const cached = resultCache.get(memoryKey);
+    if (cached) return cached;
+  }
+
+  // Results of saved formulas are precomputed by the ETL for the current version
+  if (cacheKey && limit <= 0) {
+    const warmed = await sql`
+      select results
+      from screen_cache
+      where cache_key = ${cacheKey} and data_version = ${version}
+    `.catch(() => []);
+    if (warmed.length) {
+      const data = warmed[0].results as postgres.Row[];
+      resultCache.set(memoryKey, data, Math.max(data.length, 1));
+      return data;
+    }
+  }
+
   const query = getSqlQuery(clean, mostRecentYear, limit);
 
   if (query) {
     const data = await sql.unsafe(query);
+    if (cacheKey) {
+      resultCache.set(memoryKey, data, Math.max(data.length, 1));
+    }
     return data;
   }
 }
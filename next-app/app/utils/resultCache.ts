@@ -0,0 +1,52 @@
+/**
+ * Least-recently-used cache bounded by entry count and by total weight
+ * (e.g. number of result rows). A Map iterates in insertion order, so the
+ * first key is always the least recently used one.
+ */
+export class LruCache<V> {
+  private entries = new Map<string, { value: V; weight: number }>();
+  private totalWeight = 0;
+
+  constructor(
+    private maxEntries: number,
+    private maxWeight: number = Infinity
+  ) {}
+
+  get(key: string): V | undefined {
+    const entry = this.entries.get(key);
+    if (!entry) return undefined;
+    this.entries.delete(key);
+    this.entries.set(key, entry);
+    return entry.value;
+  }
+
+  set(key: string, value: V, weight: number = 1) {
+    if (weight > this.maxWeight) return;
+    this.delete(key);
+    this.entries.set(key, { value, weight });
+    this.totalWeight += weight;
+    while (
+      this.entries.size > this.maxEntries ||
+      this.totalWeight > this.maxWeight
+    ) {
+      const oldest = this.entries.keys().next().value as string;
+      this.delete(oldest);
+    }
+  }
+
+  delete(key: string) {
+    const entry = this.entries.get(key);
+    if (!entry) return;
+    this.entries.delete(key);
+    this.totalWeight -= entry.weight;
+  }
+
+  clear() {
+    this.entries.clear();
+    this.totalWeight = 0;
+  }
+
+  get size() {
+    return this.entries.size;
+  }
+}